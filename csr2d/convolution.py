@@ -3,47 +3,170 @@ import numpy as np
 import scipy.fft as sp_fft
 
 
-def fftconvolve2(rho, *greens):
+# FFT Configuration
+# All meshes are real, so real-to-complex transforms are used.
+# s is the padded shape, workers the number of threads (None: scipy.fft default)
+fft  = lambda x, s, workers=None: sp_fft.rfft2(x, s=s, workers=workers)
+ifft = lambda x, s, workers=None: sp_fft.irfft2(x, s=s, overwrite_x=True, workers=workers)
+
+
+def fft_shape(shape, z_halfwidth=0):
+    """
+    Padded shape for the FFTs of Green meshes with `shape`.
+
+    Any shape at least as large as the Green mesh gives the same result
+    in the extracted window, so sizes are rounded up to fast FFT lengths.
+    A z filter with taps at offsets -h..h (see `green_spectrum`) needs
+    h more points in z to avoid wrap-around into the window.
+    """
+    shape = (shape[0] + z_halfwidth,) + tuple(shape[1:])
+    return tuple(sp_fft.next_fast_len(n, real=True) for n in shape)
+
+
+class GreenSpectrum:
+    """
+    Fourier transforms of Green function meshes, prepared once
+    for repeated convolutions with fftconvolve2.
+
+    Use `green_spectrum` to create these from the Green meshes.
+
+    Parameters
+    ----------
+
+    spectra : tuple of np.arrays (2D, complex)
+        Real FFTs of the Green meshes, padded to fft_shape(shape)
+
+    shape : tuple of int
+        Shape of the Green meshes, which is twice the shape of the charge mesh
+
+    z_halfwidth : int
+        Half width of the z filter included in the spectra. Default: 0 (none)
+
+    """
+    def __init__(self, spectra, shape, z_halfwidth=0):
+        self.spectra = tuple(spectra)
+        self.shape = tuple(shape)
+        self.z_halfwidth = z_halfwidth
+        self.fft_shape = fft_shape(shape, z_halfwidth)
+
+    @property
+    def dtype(self):
+        """
+        Real dtype of the convolutions: np.float32 for complex64 spectra, otherwise np.float64
+        """
+        return np.dtype(np.float32) if self.spectra[0].dtype == np.complex64 else np.dtype(np.float64)
+
+    def __len__(self):
+        return len(self.spectra)
+
+
+def green_spectrum(*greens, workers=None, z_taps=None, dtype=np.float64):
     """
-    Efficiently perform a 2D convolution of a charge density rho and multiple Green functions. 
-    
+    Prepares Green function meshes for fftconvolve2.
+
     Parameters
     ----------
-    
-    rho : np.array (2D)
-        Charge mesh
-        
+
     *greens : np.arrays (2D)
-        Charge meshes for the Green functions, which should be twice the size of rho    
-        
-        
+        Meshes for the Green functions, which should be twice the size of the charge mesh
+
+    workers : int or None
+        Number of threads for the FFTs. Default: None (scipy.fft default)
+
+    z_taps : sequence of floats, optional
+        Convolution kernel in z for offsets -h..h, for example smoothing and d/dz
+        from csr2d.density.z_filter_taps. Its transfer function is multiplied into
+        the spectra, so that fftconvolve2 applies it to the charge mesh for free.
+
+    dtype : np.float64 or np.float32
+        Precision of the convolutions. For np.float32 the spectra are stored as complex64
+        (computed in double precision), and fftconvolve2 of a float32 rho runs in single precision.
+        Default: np.float64
+
     Returns
     -------
-    
-    fields : tuple of np.arrays with the same shape as rho. 
-    
-    """
-
-    # FFT Configuration
-    fft  = lambda x: sp_fft.fft2(x,  overwrite_x=True)
-    ifft = lambda x: sp_fft.ifft2(x, overwrite_x=True)    
-    
-    # Place rho in double-sized array. Should match the shape of green
-    n0, n1 = rho.shape
-    crho = np.zeros( (2*n0, 2*n1))
-    crho[0:n0,0:n1] = rho[0:n0,0:n1]
-    
-    # FFT
-    crho = fft(crho)    
-   
-    results = []
+
+    GreenSpectrum
+
+    """
+    shape = greens[0].shape
     for green in greens:
-        assert crho.shape == green.shape, f'Green array shape {green.shape} should be twice rho shape {rho.shape}'
-        result = ifft(crho*fft(green))
+        assert green.shape == shape, f'Green array shapes {green.shape} and {shape} differ'
+
+    h = 0 if z_taps is None else len(z_taps) // 2
+    s = fft_shape(shape, h)
+
+    spectra = [fft(green, s, workers) for green in greens]
+    if z_taps is not None:
+        # The z axis of rfft2 is a full complex FFT
+        kernel = np.zeros(s[0])
+        kernel[np.arange(-h, h+1) % s[0]] = z_taps
+        transfer = sp_fft.fft(kernel)[:, None]
+        for spectrum in spectra:
+            spectrum *= transfer
+    if np.dtype(dtype) == np.float32:
+        spectra = [spectrum.astype(np.complex64) for spectrum in spectra]
+
+    return GreenSpectrum(spectra, shape, h)
+
+
+def fftconvolve2(rho, *greens, workers=None, out=None):
+    """
+    Efficiently perform a 2D convolution of a charge density rho and multiple Green functions.
+
+    Parameters
+    ----------
+
+    rho : np.array (2D or 3D)
+        Charge mesh, or a stack of charge meshes with shape (B, nz, nx).
+        A stack is transformed in one batched FFT over its last two axes.
+        With float32 rho and a float32 GreenSpectrum, the FFTs are done in single precision.
+
+    *greens : np.arrays (2D) or a single GreenSpectrum
+        Charge meshes for the Green functions, which should be twice the size of rho.
+        A GreenSpectrum from `green_spectrum` skips the FFT of the Green functions,
+        which is the way to go when the same Green functions are used repeatedly.
+
+    workers : int or None
+        Number of threads for the FFTs. Default: None (scipy.fft default)
+
+    out : tuple of np.arrays, optional
+        Arrays with the shape of rho, one per Green function, to store the results in
+
+
+    Returns
+    -------
+
+    fields : tuple of np.arrays with the same shape as rho.
+        For a stack, fields[i][b] is the convolution of rho[b] with Green function i.
+
+    """
+    if len(greens) == 1 and isinstance(greens[0], GreenSpectrum):
+        spectrum = greens[0]
+    else:
+        spectrum = green_spectrum(*greens, workers=workers)
+
+    # rho is zero-padded to the (at least double-sized) FFT shape
+    n0, n1 = rho.shape[-2:]
+    assert spectrum.shape == (2*n0, 2*n1), f'Green array shape {spectrum.shape} should be twice rho shape {rho.shape[-2:]}'
+    s = spectrum.fft_shape
+
+    # FFT (over the last two axes, batched for a stack)
+    crho = fft(rho, s, workers)
+
+    if out is not None:
+        assert len(out) == len(spectrum), f'out must have {len(spectrum)} arrays'
+
+    results = []
+    for i, green_fft in enumerate(spectrum.spectra):
+        result = ifft(crho*green_fft, s, workers)
         # Extract the result
-        result = np.real(result[n0-1:2*n0-1,n1-1:2*n1-1])
+        result = result[..., n0-1:2*n0-1,n1-1:2*n1-1]
+        if out is not None:
+            out[i][...] = result
+            result = out[i]
         results.append(result)
-        
-        
-        
-    return tuple(results)
\ No newline at end of file
+
+
+
+    return tuple(results)
@@ -1,5 +1,5 @@
 
-from numba import vectorize, float64, njit
+from numba import vectorize, float64, njit, prange
 # For special functions
 from numba.extending import get_cython_function_address
 import ctypes
@@ -77,7 +77,8 @@ def psi_sx(z, x, beta):
     Note that 'x' here corresponds to 'chi = x/rho', 
     and 'z' here corresponds to 'xi = z/2/rho' in the paper. 
     
-    This is the most efficient routine.
+    This is the most efficient routine: alpha is solved once per point,
+    in a parallel Numba kernel (see `psi_sx0`).
     
     Parameters
     ----------
@@ -98,35 +99,7 @@ def psi_sx(z, x, beta):
     
     
     """
-    
-    # beta**2 appears far more than beta. Use this in internal functions
-    beta2 = beta**2
-
-    alp = alpha(z, x, beta2)
-    kap = sqrt(x**2 + 4*(1+x) * sin(alp)**2) # kappa(z, x, beta2) inline
-    
-    sin2a = sin(2*alp)
-    cos2a = cos(2*alp)    
-    
-    # psi_s calc
-    out_psi_s = (cos2a - 1 / (1+x)) / (
-            kap - beta * (1+x) * sin2a)    
-      
-    # psi_x calc    
-    arg2 = -4 * (1+x) / x**2
-    
-    ellipeinc = ss.ellipeinc(alp, arg2)
-    ellipkinc = ss.ellipkinc(alp, arg2) 
-
-    T1 = (1/abs(x)/(1 + x) * ((2 + 2*x + x**2) * ellipkinc - x**2 * ellipeinc))
-    D = kap**2 - beta2 * (1 + x)**2 * sin2a**2
-    T2 = ((kap**2 - 2*beta2 * (1+x)**2 + beta2 * (1+x) * (2 + 2*x + x**2) * cos2a)/ beta/ (1+x)/ D)
-    T3 = -kap * sin2a / D
-    T4 = kap * beta2 * (1 + x) * sin2a * cos2a / D
-    T5 = 1 / abs(x) * ellipkinc # psi_phi without e/rho**2 factor
-    out_psi_x = (T1 + T2 + T3 + T4) - 2 / beta2 * T5
-
-    return out_psi_s, out_psi_x
+    return psi_sx0(z, x, beta, 0)
 
 
 
@@ -467,6 +440,377 @@ def psi_x0(z, x, beta, dx):
         return  psi_x(z, x, beta)
 
 
+##################################################
+### Fused psi_s and psi_x kernel #################
+##################################################
+
+# Carlson symmetric forms of the elliptic integrals, in pure Numba.
+# Ref[3]: B. C. Carlson, Numerical computation of real or complex elliptic integrals,
+#         Numerical Algorithms 10, 13 (1995).
+
+@njit
+def carlson_rf(x, y, z):
+    """
+    Carlson's elliptic integral of the first kind R_F(x, y, z), Ref[3] Section 2.
+    x, y, z must be nonnegative, and at most one can be zero.
+    """
+    A0 = (x + y + z)/3
+    # Relative error r = 1e-16
+    Q = max(abs(A0 - x), abs(A0 - y), abs(A0 - z)) / (3e-16)**(1/6)
+    A = A0
+    xn, yn, zn = x, y, z
+    f = 1.0  # 4**n
+    while f*abs(A) <= Q:
+        sx = sqrt(xn)
+        sy = sqrt(yn)
+        sz = sqrt(zn)
+        lam = sx*sy + sx*sz + sy*sz
+        xn = (xn + lam)/4
+        yn = (yn + lam)/4
+        zn = (zn + lam)/4
+        A = (A + lam)/4
+        f *= 4
+    X = (A0 - x)/(f*A)
+    Y = (A0 - y)/(f*A)
+    Z = -(X + Y)
+    E2 = X*Y - Z**2
+    E3 = X*Y*Z
+    return (1 - E2/10 + E3/14 + E2**2/24 - 3*E2*E3/44)/sqrt(A)
+
+
+@njit
+def carlson_rd(x, y, z):
+    """
+    Carlson's elliptic integral of the second kind R_D(x, y, z), Ref[3] Section 4.
+    x, y must be nonnegative, at most one of them zero, and z positive.
+    """
+    A0 = (x + y + 3*z)/5
+    # Relative error r = 1e-16
+    Q = max(abs(A0 - x), abs(A0 - y), abs(A0 - z)) / (0.25e-16)**(1/6)
+    A = A0
+    xn, yn, zn = x, y, z
+    f = 1.0  # 4**n
+    total = 0.0
+    while f*abs(A) <= Q:
+        sx = sqrt(xn)
+        sy = sqrt(yn)
+        sz = sqrt(zn)
+        lam = sx*sy + sx*sz + sy*sz
+        total += 1/(f*sz*(zn + lam))
+        xn = (xn + lam)/4
+        yn = (yn + lam)/4
+        zn = (zn + lam)/4
+        A = (A + lam)/4
+        f *= 4
+    X = (A0 - x)/(f*A)
+    Y = (A0 - y)/(f*A)
+    Z = -(X + Y)/3
+    E2 = X*Y - 6*Z**2
+    E3 = (3*X*Y - 8*Z**2)*Z
+    E4 = 3*(X*Y - Z**2)*Z**2
+    E5 = X*Y*Z**3
+    return (1 - 3*E2/14 + E3/6 + 9*E2**2/88 - 3*E4/22 - 9*E2*E3/52 + 3*E5/26)/(f*A*sqrt(A)) + 3*total
+
+
+@njit
+def ellipkinc_carlson(phi, m):
+    """
+    Incomplete elliptic integral of the first kind F(phi|m), same convention as scipy.special.ellipkinc.
+    Valid for |phi| <= pi/2 and m*sin(phi)**2 < 1 (m can be large and negative).
+    """
+    s = sin(phi)
+    c = cos(phi)
+    return s*carlson_rf(c**2, 1 - m*s**2, 1.0)
+
+
+@njit
+def ellipeinc_carlson(phi, m):
+    """
+    Incomplete elliptic integral of the second kind E(phi|m), same convention as scipy.special.ellipeinc.
+    Valid for |phi| <= pi/2 and m*sin(phi)**2 < 1 (m can be large and negative).
+    """
+    s = sin(phi)
+    c = cos(phi)
+    c2 = c**2
+    d = 1 - m*s**2
+    return s*carlson_rf(c2, d, 1.0) - m/3*s**3*carlson_rd(c2, d, 1.0)
+
+
+# Default relative tolerance of the alpha root solvers
+ALPHA_RTOL = 1e-14
+
+
+@njit
+def _alpha_case_B(z, x, beta, rtol=ALPHA_RTOL):
+    """
+    alpha for case B from Brent's method, to relative precision rtol.
+    """
+    return brentq(f_root_case_B, -1, 1, args=(z, x, beta), xtol=1e-300, rtol=max(rtol, 4*2.220446049250313e-16),
+                  maxiter=200, disp=False)[0]
+
+
+@njit
+def _alpha_case_B_newton(z, x, beta, a, rtol):
+    """
+    Newton iteration for alpha (case B) starting at `a`, safeguarded by bisection.
+    
+    f_root_case_B increases with alpha and changes sign on (-1, 1). The bracket is narrowed 
+    with each iterate, and steps that leave it are replaced by bisection.
+    Returns nan if this does not converge.
+    """
+    lo = -1.0
+    hi = 1.0
+    for _ in range(100):
+        kap = sqrt(x**2 + 4*(1+x)*sin(a)**2)
+        f = a - beta/2*kap - z
+        if f == 0:
+            return a
+        if f > 0:
+            hi = a
+        else:
+            lo = a
+        fp = 1 - beta*(1+x)*sin(2*a)/kap if kap > 0 else 0.0  # Analytic derivative of f_root_case_B
+        a_new = a - f/fp if fp > 0 else hi
+        if not (lo < a_new < hi):
+            a_new = (lo + hi)/2
+        da = a_new - a
+        a = a_new
+        if abs(da) <= rtol*abs(a):
+            return a
+    return np.nan
+
+
+@njit
+def alpha_case_B_warm(z, x, beta, a0, rtol=ALPHA_RTOL):
+    """
+    alpha for case B, from Newton's method warm-started at a0,
+    falling back to Brent's method on (-1, 1) if that fails or if a0 is nan.
+    """
+    if a0 == a0:
+        a = _alpha_case_B_newton(z, x, beta, a0, rtol)
+        if a == a:
+            return a
+    return _alpha_case_B(z, x, beta, rtol)
+
+
+@njit(parallel=True, nogil=True)
+def _alpha_case_B_mesh_kernel(zvec, xvec, beta, rtol, out):
+    for j in prange(xvec.size):
+        a = np.nan
+        for i in range(zvec.size):
+            a = alpha_case_B_warm(zvec[i], xvec[j], beta, a, rtol)
+            out[i, j] = a
+
+
+def alpha_case_B_mesh(zvec, xvec, beta, rtol=ALPHA_RTOL, out=None):
+    """
+    alpha for case B on the grid spanned by zvec (z/2/rho) and xvec (x/rho).
+    
+    Each x column is swept in z in parallel, and each root warm-starts Newton's method
+    from the previous one, with Brent's method as a fallback.
+    
+    Parameters
+    ----------
+    zvec, xvec : np.array (1D)
+        Grid axes
+        
+    beta : float
+        Relativistic beta
+        
+    rtol : float
+        Relative tolerance of the roots. Default: ALPHA_RTOL
+        
+    out : np.array, optional
+        Preallocated (len(zvec), len(xvec)) array to fill
+    
+    Returns
+    -------
+    alpha : np.array
+    
+    """
+    out, = _mesh_out(zvec, xvec, out, 1)
+    _alpha_case_B_mesh_kernel(np.asarray(zvec, dtype=float), np.asarray(xvec, dtype=float), float(beta), float(rtol), out)
+    return out
+
+
+@njit
+def _psi_x_from_alpha(alp, x, beta, beta2):
+    """
+    psi_x as in `psi_x`, for a given alpha.
+    """
+    kap = sqrt(x**2 + 4*(1+x) * sin(alp)**2)
+    
+    sin2a = sin(2*alp)
+    cos2a = cos(2*alp)    
+    
+    arg2 = -4 * (1+x) / x**2
+    
+    F = ellipkinc_carlson(alp, arg2) 
+    E = ellipeinc_carlson(alp, arg2)
+    
+    T1 = (1/abs(x)/(1 + x) * ((2 + 2*x + x**2)*F - x**2*E))
+    D = kap**2 - beta2 * (1 + x)**2 * sin2a**2
+    T2 = ((kap**2 - 2*beta2*(1+x)**2 + beta2*(1+x)*(2 + 2*x + x**2)*cos2a)/ beta/ (1+x)/ D)
+    T3 = -kap * sin2a / D
+    T4 = kap * beta2 * (1 + x) * sin2a * cos2a / D
+    T5 = 1 / abs(x) * F # psi_phi without e/rho**2 factor
+    return (T1 + T2 + T3 + T4) - 2 / beta2 * T5
+
+
+@njit
+def _psi_sx_warm(z, x, beta, dx, a, a_m, a_p, rtol):
+    """
+    psi_s and psi_x at a single point, see `psi_sx_point`.
+    
+    a, a_m, a_p are the starting points for alpha at x, x - dx/2 and x + dx/2 (nan for none).
+    Returns psi_s, psi_x and the new alpha values.
+    """
+    beta2 = beta**2
+    
+    if z == 0 and x == 0:
+        out_psi_s = 0.0
+    else:
+        a = alpha_case_B_warm(z, x, beta, a, rtol)
+        kap = sqrt(x**2 + 4*(1+x) * sin(a)**2)
+        out_psi_s = (cos(2*a) - 1/(1+x)) / (kap - beta * (1+x) * sin(2*a))
+    
+    if x == 0 and dx != 0:
+        h = dx/2
+        a_m = alpha_case_B_warm(z, -h, beta, a_m, rtol)
+        a_p = alpha_case_B_warm(z, h, beta, a_p, rtol)
+        out_psi_x = (_psi_x_from_alpha(a_m, -h, beta, beta2) + _psi_x_from_alpha(a_p, h, beta, beta2))/2
+    else:
+        out_psi_x = _psi_x_from_alpha(a, x, beta, beta2)
+        
+    return out_psi_s, out_psi_x, a, a_m, a_p
+
+
+@njit
+def psi_sx_point(z, x, beta, dx):
+    """
+    psi_s and psi_x at a single point, solving for alpha once.
+    
+    As in `psi_s`, psi_s is zero at the origin.
+    As in `psi_x0`, psi_x at x == 0 is averaged over x = +/- dx/2.
+    If dx == 0 there is no averaging.
+    """
+    out_psi_s, out_psi_x, _, _, _ = _psi_sx_warm(z, x, beta, dx, np.nan, np.nan, np.nan, ALPHA_RTOL)
+    return out_psi_s, out_psi_x
+
+
+@njit(parallel=True)
+def psi_sx_kernel(z, x, beta, dx, out_psi_s, out_psi_x):
+    """
+    Fills flat arrays out_psi_s, out_psi_x with psi_s and psi_x at points (z, x), in parallel.
+    See `psi_sx_point`.
+    """
+    for i in prange(z.size):
+        out_psi_s[i], out_psi_x[i] = psi_sx_point(z[i], x[i], beta, dx)
+
+
+def psi_sx0(z, x, beta, dx):
+    """
+    psi_s and psi_x evaluated together, with alpha solved once per point.
+    
+    Same as `psi_s` and `psi_x0`, but with alpha from a full precision root finder
+    for both, and the elliptic integrals in Carlson form so that all of this runs in
+    a single parallel Numba kernel.
+    
+    Parameters
+    ----------
+    z : array-like
+        z/(2*rho)
+        
+    x : array-like
+        x/rho
+        
+    beta : float
+        Relativistic beta
+        
+    dx : float
+        psi_x at x == 0 is averaged over x = +/- dx/2
+        
+    Returns
+    -------
+    
+    psi_s, psi_x : tuple(ndarray, ndarray)
+    
+    """
+    z, x = np.broadcast_arrays(np.asarray(z, dtype=float), np.asarray(x, dtype=float))
+    shape = z.shape
+    z = np.ascontiguousarray(z).ravel()
+    x = np.ascontiguousarray(x).ravel()
+    out_psi_s = np.empty(z.size)
+    out_psi_x = np.empty(z.size)
+    psi_sx_kernel(z, x, float(beta), float(dx), out_psi_s, out_psi_x)
+    return out_psi_s.reshape(shape), out_psi_x.reshape(shape)
+
+
+def _mesh_out(zvec, xvec, out, n):
+    """
+    Checks or allocates `n` output meshes of shape (len(zvec), len(xvec)).
+    """
+    shape = (len(zvec), len(xvec))
+    if out is None:
+        return tuple(np.empty(shape) for _ in range(n))
+    out = tuple(out) if n > 1 else (out,)
+    assert len(out) == n, f'out must have {n} arrays'
+    for o in out:
+        assert o.shape == shape, f'out array shape {o.shape} should be {shape}'
+    return out
+
+
+@njit(parallel=True, nogil=True)
+def _psi_sx_mesh_kernel(zvec, xvec, beta, dx, rtol, out_psi_s, out_psi_x):
+    # Sweep each x column in z, warm-starting alpha from the previous z
+    for j in prange(xvec.size):
+        a = np.nan
+        a_m = np.nan
+        a_p = np.nan
+        for i in range(zvec.size):
+            out_psi_s[i, j], out_psi_x[i, j], a, a_m, a_p = _psi_sx_warm(zvec[i], xvec[j], beta, dx, a, a_m, a_p, rtol)
+
+
+def psi_sx_mesh(zvec, xvec, beta, dx, out=None, rtol=ALPHA_RTOL):
+    """
+    psi_s and psi_x meshes on the grid spanned by the 1D axes zvec and xvec,
+    filled in parallel without building coordinate meshes.
+    
+    alpha is found with the warm-started solver of `alpha_case_B_mesh`.
+    
+    Parameters
+    ----------
+    zvec : np.array (1D)
+        z/(2*rho) axis
+        
+    xvec : np.array (1D)
+        x/rho axis
+        
+    beta : float
+        Relativistic beta
+        
+    dx : float
+        psi_x at x == 0 is averaged over x = +/- dx/2
+        
+    out : tuple of two np.arrays, optional
+        Preallocated (len(zvec), len(xvec)) arrays to fill
+        
+    rtol : float
+        Relative tolerance of alpha. Default: ALPHA_RTOL
+        
+    Returns
+    -------
+    
+    psi_s, psi_x : tuple(ndarray, ndarray)
+        Same values as psi_sx0(zm, xm, beta, dx) with zm, xm from np.meshgrid(zvec, xvec, indexing='ij'),
+        up to the tolerance of alpha
+    
+    """
+    out = _mesh_out(zvec, xvec, out, 2)
+    _psi_sx_mesh_kernel(np.asarray(zvec, dtype=float), np.asarray(xvec, dtype=float), float(beta), float(dx), float(rtol), *out)
+    return out
+
+
 ##################################################
 ### Transient fields and potentials ##############
 ##################################################
@@ -685,6 +1029,88 @@ def alpha_exact_case_D_brentq(z, x, beta, lamb):
     return brentq(f_root_case_D, -1, 1, args=(z, x, beta, lamb))[0]
 
 
+@njit
+def _alpha_case_D_newton(z, x, beta, lamb, a, rtol):
+    """
+    Newton iteration for alpha (case D) starting at `a`, safeguarded by bisection
+    on the bracket (-1, 1) as in `_alpha_case_B_newton`.
+    Returns nan if this does not converge.
+    """
+    lo = -1.0
+    hi = 1.0
+    for _ in range(100):
+        kap = sqrt(lamb**2 + x**2 + 4*(1+x)*sin(a)**2 + 2*lamb*sin(2*a))
+        f = a + (lamb - beta*kap - z)/2
+        if f == 0:
+            return a
+        if f > 0:
+            hi = a
+        else:
+            lo = a
+        fp = 1 - beta*((1+x)*sin(2*a) + lamb*cos(2*a))/kap if kap > 0 else 0.0  # Analytic derivative of f_root_case_D
+        a_new = a - f/fp if fp > 0 else hi
+        if not (lo < a_new < hi):
+            a_new = (lo + hi)/2
+        da = a_new - a
+        a = a_new
+        if abs(da) <= rtol*abs(a):
+            return a
+    return np.nan
+
+
+@njit
+def alpha_case_D_warm(z, x, beta, lamb, a0, rtol=ALPHA_RTOL):
+    """
+    alpha for case D, from Newton's method warm-started at a0,
+    falling back to Brent's method on (-1, 1) if that fails or if a0 is nan.
+    """
+    if a0 == a0:
+        a = _alpha_case_D_newton(z, x, beta, lamb, a0, rtol)
+        if a == a:
+            return a
+    return brentq(f_root_case_D, -1, 1, args=(z, x, beta, lamb), xtol=1e-300, rtol=max(rtol, 4*2.220446049250313e-16),
+                  maxiter=200, disp=False)[0]
+
+
+@njit(parallel=True, nogil=True)
+def _alpha_case_D_mesh_kernel(zvec, xvec, beta, lamb, rtol, out):
+    for j in prange(xvec.size):
+        a = np.nan
+        for i in range(zvec.size):
+            a = alpha_case_D_warm(zvec[i], xvec[j], beta, lamb, a, rtol)
+            out[i, j] = a
+
+
+def alpha_case_D_mesh(zvec, xvec, beta, lamb, rtol=ALPHA_RTOL, out=None):
+    """
+    alpha for case D on the grid spanned by zvec (z/2/rho) and xvec (x/rho),
+    with the warm-started solver described in `alpha_case_B_mesh`.
+    """
+    out, = _mesh_out(zvec, xvec, out, 1)
+    _alpha_case_D_mesh_kernel(np.asarray(zvec, dtype=float), np.asarray(xvec, dtype=float), float(beta), float(lamb), float(rtol), out)
+    return out
+
+
+@njit
+def _Es_case_D_from_alpha(alp, z, x, beta, lamb):
+    """
+    Es_case_D for a given alpha.
+    """
+    if z == 0 and x == 0:
+        return 0.0
+    
+    sin2a = sin(2*alp)
+    cos2a = cos(2*alp) 
+
+    kap = sqrt(lamb**2 + x**2 + 4*(1+x)*sin(alp)**2 + 2*lamb*sin(2*alp)) # kappa for case D
+    
+    N1 = cos2a - (1+x)
+    N2 = lamb*cos2a + (1+x)*sin2a - beta*kap
+    D = kap - beta*(lamb*cos2a + (1+x)*sin2a)
+    
+    return N1*N2/D**3
+
+
 #@vectorize([float64(float64, float64, float64, float64)])
 #@np.vectorize
 @vectorize([float64(float64, float64, float64, float64)])
@@ -709,4 +1135,95 @@ def Es_case_D(z, x, beta, lamb):
     N2 = lamb*cos2a + (1+x)*sin2a - beta*kap
     D = kap - beta*(lamb*cos2a + (1+x)*sin2a)
     
-    return N1*N2/D**3
\ No newline at end of file
+    return N1*N2/D**3
+
+
+############################### Meshes from 1D axes ###################
+# As psi_sx_mesh, these fill (len(zvec), len(xvec)) meshes in parallel
+# directly from the axes, optionally into preallocated `out` arrays.
+# The kernels release the GIL, so row blocks can also run in threads (csr2d.parallel).
+
+@njit(parallel=True, nogil=True)
+def _case_A_mesh_kernel(zvec, xvec, beta, alp, out_Es, out_Fx):
+    for i in prange(zvec.size):
+        for j in range(xvec.size):
+            out_Es[i, j] = Es_case_A(zvec[i], xvec[j], beta, alp)
+            out_Fx[i, j] = Fx_case_A(zvec[i], xvec[j], beta, alp)
+
+
+def case_A_mesh(zvec, xvec, beta, alp, out=None):
+    """
+    Es_case_A and Fx_case_A meshes on the grid spanned by zvec (z/2/rho) and xvec (x/rho).
+    Returns the tuple (Es, Fx).
+    """
+    out = _mesh_out(zvec, xvec, out, 2)
+    _case_A_mesh_kernel(np.asarray(zvec, dtype=float), np.asarray(xvec, dtype=float), float(beta), float(alp), *out)
+    return out
+
+
+@njit(parallel=True, nogil=True)
+def _Es_case_B0_mesh_kernel(zvec, xvec, beta, out):
+    for i in prange(zvec.size):
+        for j in range(xvec.size):
+            # Same as Es_case_B0 (whose dx is unused), which is a parallel ufunc that Numba cannot call
+            if zvec[i] == 0:
+                out[i, j] = 0.0
+            else:
+                out[i, j] = Es_case_B(zvec[i], xvec[j], beta)
+
+
+def Es_case_B0_mesh(zvec, xvec, beta, out=None):
+    """
+    Es_case_B0 mesh on the grid spanned by zvec (z/2/rho) and xvec (x/rho).
+    """
+    out, = _mesh_out(zvec, xvec, out, 1)
+    _Es_case_B0_mesh_kernel(np.asarray(zvec, dtype=float), np.asarray(xvec, dtype=float), float(beta), out)
+    return out
+
+
+@njit(parallel=True, nogil=True)
+def _case_C_mesh_kernel(zvec, xvec, beta, alp, lamb, out_Es, out_Fx):
+    for i in prange(zvec.size):
+        for j in range(xvec.size):
+            out_Es[i, j] = Es_case_C(zvec[i], xvec[j], beta, alp, lamb)
+            out_Fx[i, j] = Fx_case_C(zvec[i], xvec[j], beta, alp, lamb)
+
+
+def case_C_mesh(zvec, xvec, beta, alp, lamb, out=None):
+    """
+    Es_case_C and Fx_case_C meshes on the grid spanned by zvec (z/2/rho) and xvec (x/rho).
+    Returns the tuple (Es, Fx).
+    """
+    out = _mesh_out(zvec, xvec, out, 2)
+    _case_C_mesh_kernel(np.asarray(zvec, dtype=float), np.asarray(xvec, dtype=float), float(beta), float(alp), float(lamb), *out)
+    return out
+
+
+@njit(parallel=True, nogil=True)
+def _Es_case_D_mesh_kernel(zvec, xvec, beta, lamb, rtol, out):
+    # Sweep each x column in z, warm-starting alpha from the previous z
+    for j in prange(xvec.size):
+        a = np.nan
+        for i in range(zvec.size):
+            a = alpha_case_D_warm(zvec[i], xvec[j], beta, lamb, a, rtol)
+            out[i, j] = _Es_case_D_from_alpha(a, zvec[i], xvec[j], beta, lamb)
+
+
+def Es_case_D_mesh(zvec, xvec, beta, lamb, out=None, rtol=ALPHA_RTOL):
+    """
+    Es_case_D mesh on the grid spanned by zvec (z/2/rho) and xvec (x/rho).
+    alpha is found with the warm-started solver of `alpha_case_D_mesh`, to relative tolerance rtol.
+    """
+    out, = _mesh_out(zvec, xvec, out, 1)
+    _Es_case_D_mesh_kernel(np.asarray(zvec, dtype=float), np.asarray(xvec, dtype=float), float(beta), float(lamb), float(rtol), out)
+    return out
+
+
+def case_D_mesh(zvec, xvec, beta, lamb, out=None, rtol=ALPHA_RTOL):
+    """
+    Es_case_D mesh on the grid spanned by zvec (z/2/rho) and xvec (x/rho).
+    Returns the tuple (Es,), since there is no Fx for case D.
+    """
+    if out is not None:
+        out, = out
+    return (Es_case_D_mesh(zvec, xvec, beta, lamb, out=out, rtol=rtol),)
@@ -1,5 +1,6 @@
 import numpy as np
 import time
+from contextlib import nullcontext
 
 from scipy.ndimage import convolve as conv
 from scipy.signal import convolve2d, fftconvolve, oaconvolve
@@ -9,6 +10,7 @@ from scipy.signal import convolve2d, fftconvolve, oaconvolve
 
 from csr2d.deposit import split_particles, deposit_particles, histogram_cic_2d
 from csr2d.central_difference import central_difference_z
+from csr2d.density import density_grids
 from csr2d.core import psi_s, psi_x
 
 # from csr2d.beam_conversion import particle_group_to_bmad, bmad_to_particle_group
@@ -34,9 +36,18 @@ def calc_csr_kick(
     reuse_psi_grids=False,
     psi_s_grid_old=None,
     psi_x_grid_old=None,
+    executor=None,
+    max_workers=12,
     verbose=True,
 ):
     """
+    executor : concurrent.futures.Executor, optional
+        Pool for the potential grids, such as csr2d.parallel.get_executor('process', max_workers),
+        which is started once and reused. Default: None (a ProcessPoolExecutor for this call)
+        
+    max_workers : int
+        Number of workers of the pool for executor=None, and of `executor`,
+        for the number of rows sent to a worker at a time. Default: 12
     """
     (x_b, xp_b, y_b, yp_b, z_b, zp_b) = beam
     zx_positions = np.stack((z_b, x_b)).T
@@ -62,18 +73,9 @@ def calc_csr_kick(
     charge_grid = histogram_cic_2d(z_b, x_b, charges, Nz, zmin, zmax, Nx, xmin, xmax)
     t2 = time.time()
 
-    # Normalize the grid so its integral is unity
-    norm = np.sum(charge_grid) * dz * dx
-    lambda_grid = charge_grid / norm
-
-    # Apply savgol filter
-    lambda_grid_filtered = np.array(
-        [savgol_filter(lambda_grid[:, i], 13, 2) for i in np.arange(Nx)]
-    ).T
-
-    # Differentiation in z
-    lambda_grid_filtered_prime = central_difference_z(
-        lambda_grid_filtered, Nz, Nx, dz, order=1
+    # Normalize the grid so its integral is unity, apply savgol filter and differentiate in z
+    lambda_grid_filtered, lambda_grid_filtered_prime = density_grids(
+        charge_grid, dz, dx, window=13, polyorder=2, order=1
     )
 
     zvec = np.linspace(zmin, zmax, Nz)
@@ -95,10 +97,14 @@ def calc_csr_kick(
         # psi_s_grid = psi_s(zm2,xm2,beta)
 
         beta_grid = beta * np.ones(zm2.shape)
-        with cf.ProcessPoolExecutor(max_workers=12) as executor:
-            temp = executor.map(psi_s, zm2 / 2 / rho, xm2, beta_grid)
+        # Rows are sent in chunks, a few per worker
+        chunksize = max(1, len(zm2) // (4 * max_workers))
+        # A given executor is not shut down
+        pool = cf.ProcessPoolExecutor(max_workers=max_workers) if executor is None else nullcontext(executor)
+        with pool as executor:
+            temp = executor.map(psi_s, zm2 / 2 / rho, xm2, beta_grid, chunksize=chunksize)
             psi_s_grid = np.array(list(temp))
-            temp2 = executor.map(psi_x, zm2 / 2 / rho, xm2, beta_grid)
+            temp2 = executor.map(psi_x, zm2 / 2 / rho, xm2, beta_grid, chunksize=chunksize)
             psi_x_grid = np.array(list(temp2))
 
     t4 = time.time()
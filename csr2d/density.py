@@ -0,0 +1,219 @@
+"""
+Density stage of the kick calculations:
+normalize the deposited charge grid, smooth it in z with a Savitzky-Golay filter,
+and differentiate it in z.
+
+This gives the same result as
+
+    lambda_grid = charge_grid / (np.sum(charge_grid) * dz * dx)
+    lambda_grid_filtered = np.array([savgol_filter(lambda_grid[:, i], 13, 2) for i in np.arange(nx)]).T
+    lambda_grid_filtered_prime = central_difference_z(lambda_grid_filtered, nz, nx, dz, order=1)
+
+in a single Numba kernel, writing into preallocated buffers.
+
+Alternatively, `z_filter_taps` gives the smoothing and differentiation as a single
+z convolution kernel, which can be applied in Fourier space together with the
+Green functions (see csr2d.convolution.green_spectrum).
+"""
+from functools import lru_cache
+
+import numpy as np
+from numba import njit, prange
+from scipy.signal import savgol_coeffs
+
+from csr2d.deposit import histogram_cic_2d
+
+
+@lru_cache()
+def savgol_matrices(window, polyorder):
+    """
+    Savitzky-Golay coefficients as used by scipy.signal.savgol_filter with mode='interp'.
+
+    Returns
+    -------
+    coeffs : np.array, shape (window,)
+        Interior coefficients. filtered[i] = coeffs @ y[i-h:i+h+1], h = window//2
+
+    edge_lo : np.array, shape (h, window)
+        filtered[i] = edge_lo[i] @ y[:window] for i < h
+
+    edge_hi : np.array, shape (h, window)
+        filtered[n-h+i] = edge_hi[i] @ y[-window:] for i < h
+
+    """
+    h = window // 2
+    coeffs = savgol_coeffs(window, polyorder, use='dot')
+    edge_lo = np.array([savgol_coeffs(window, polyorder, pos=i, use='dot') for i in range(h)])
+    edge_hi = np.array([savgol_coeffs(window, polyorder, pos=window-h+i, use='dot') for i in range(h)])
+    return coeffs, edge_lo, edge_hi
+
+
+# Central difference stencils of central_difference_z, indexed by order.
+# Points outside the grid are zero.
+DIFF_STENCILS = {
+    1: np.array([-1, 0, 1]) / 2,
+    2: np.array([1, -8, 0, 8, -1]) / 12,
+    3: np.array([-1, 9, -45, 0, 45, -9, 1]) / 60,
+}
+
+
+def z_filter_taps(smoothing='savgol', window=13, polyorder=2, sigma=2.0, derivative=True):
+    """
+    Smoothing and differentiation in z as a single convolution kernel.
+
+    Unlike `density_grids`, there are no special edge formulas: the density is
+    zero outside of the grid. The results agree away from the grid edges.
+
+    Parameters
+    ----------
+    smoothing : str or None
+        'savgol': Savitzky-Golay filter with window and polyorder (interior coefficients)
+        'gaussian': Gaussian with standard deviation sigma, truncated at 4 sigma
+        None: no smoothing
+
+    window, polyorder : int
+        Savitzky-Golay parameters. Default: 13, 2
+
+    sigma : float
+        Gaussian standard deviation in units of the grid spacing. Default: 2.0
+
+    derivative : bool
+        If True, the first order central difference is included.
+        The taps are then per grid spacing, and the result must be divided by dz.
+        Default: True
+
+    Returns
+    -------
+    taps : tuple of floats, length 2*h+1
+        Convolution kernel for offsets -h..h: out[i] = sum_m taps[m+h] * y[i-m]
+
+    """
+    if smoothing == 'savgol':
+        # savgol_coeffs(use='conv') is already in convolution order
+        taps = savgol_coeffs(window, polyorder, use='conv')
+    elif smoothing == 'gaussian':
+        h = int(4 * sigma + 0.5)
+        taps = np.exp(-0.5 * (np.arange(-h, h + 1) / sigma)**2)
+        taps /= taps.sum()
+    elif smoothing is None:
+        taps = np.ones(1)
+    else:
+        raise ValueError(f'Unknown smoothing: {smoothing}')
+
+    if derivative:
+        # (y[i+1] - y[i-1])/2 in convolution order
+        taps = np.convolve(taps, [0.5, 0, -0.5])
+
+    return tuple(float(t) for t in taps)
+
+
+@njit(parallel=True)
+def _density_kernel(charge_grid, scale, coeffs, edge_lo, edge_hi, stencil, endpoints, dz, out_filtered, out_prime):
+    nz, nx = charge_grid.shape
+    window = coeffs.size
+    h = window // 2
+
+    # Savitzky-Golay filter in z, along whole rows
+    for i in prange(nz):
+        for j in range(nx):
+            out_filtered[i, j] = 0.0
+        if i < h:
+            c = edge_lo[i]
+            i0 = 0
+        elif i >= nz - h:
+            c = edge_hi[i - (nz - h)]
+            i0 = nz - window
+        else:
+            c = coeffs
+            i0 = i - h
+        for k in range(window):
+            ck = c[k] * scale
+            for j in range(nx):
+                out_filtered[i, j] += ck * charge_grid[i0 + k, j]
+
+    # Central difference in z
+    m = stencil.size // 2
+    for i in prange(nz):
+        for j in range(nx):
+            out_prime[i, j] = 0.0
+        if endpoints and i == 0:
+            for j in range(nx):
+                out_prime[i, j] = (-1.5*out_filtered[0, j] + 2*out_filtered[1, j] - 0.5*out_filtered[2, j]) / dz
+        elif endpoints and i == nz - 1:
+            for j in range(nx):
+                out_prime[i, j] = (0.5*out_filtered[nz-3, j] - 2*out_filtered[nz-2, j] + 1.5*out_filtered[nz-1, j]) / dz
+        else:
+            for k in range(stencil.size):
+                ii = i + k - m
+                if stencil[k] == 0 or ii < 0 or ii >= nz:
+                    continue
+                sk = stencil[k] / dz
+                for j in range(nx):
+                    out_prime[i, j] += sk * out_filtered[ii, j]
+
+
+def density_grids(charge_grid, dz, dx, window=13, polyorder=2, order=1, out=None, dtype=np.float64):
+    """
+    Normalized, smoothed density and its z derivative from a deposited charge grid.
+
+    Parameters
+    ----------
+    charge_grid : np.array (2D)
+        Deposited charge, shape (nz, nx)
+
+    dz, dx : float
+        Grid spacing in z and x [m]. The density is normalized so its integral is unity.
+
+    window, polyorder : int
+        Savitzky-Golay filter window length and polynomial order, as in scipy.signal.savgol_filter.
+        Default: 13, 2
+
+    order : int
+        Accuracy order of the z derivative, as in central_difference_z. Default: 1
+
+    out : tuple of two np.arrays, optional
+        Preallocated arrays (same shape as charge_grid) for the results
+
+    dtype : np.float64 or np.float32
+        dtype of the results if out is not given. The normalization is computed
+        in float64 in any case. Default: np.float64
+
+    Returns
+    -------
+    lambda_grid_filtered, lambda_grid_filtered_prime : tuple(ndarray, ndarray)
+
+    """
+    nz, nx = charge_grid.shape
+    if order not in DIFF_STENCILS:
+        raise ValueError(' order value has to be 1 or 2 or 3!! ')
+    if window > nz:
+        raise ValueError(f'window ({window}) must not be larger than nz ({nz})')
+
+    if out is None:
+        out = (np.empty((nz, nx), dtype=dtype), np.empty((nz, nx), dtype=dtype))
+    for o in out:
+        assert o.shape == (nz, nx), f'out array shape {o.shape} should be {(nz, nx)}'
+        assert o.dtype == out[0].dtype, 'out arrays must have the same dtype'
+
+    coeffs, edge_lo, edge_hi = savgol_matrices(window, polyorder)
+    scale = 1 / (np.sum(charge_grid) * dz * dx)
+    _density_kernel(np.ascontiguousarray(charge_grid, dtype=float), scale, coeffs, edge_lo, edge_hi,
+                    DIFF_STENCILS[order], order == 1, dz, *out)
+    return out
+
+
+def deposit_density(z_b, x_b, weight, nz, zmin, zmax, nx, xmin, xmax, window=13, polyorder=2, order=1, out=None):
+    """
+    Deposits particles with histogram_cic_2d, then applies `density_grids`.
+
+    Returns
+    -------
+    charge_grid, lambda_grid_filtered, lambda_grid_filtered_prime : tuple of np.arrays
+
+    """
+    dz = (zmax - zmin) / (nz - 1)
+    dx = (xmax - xmin) / (nx - 1)
+    charge_grid = histogram_cic_2d(z_b, x_b, weight, nz, zmin, zmax, nx, xmin, xmax)
+    lambda_grid_filtered, lambda_grid_filtered_prime = density_grids(
+        charge_grid, dz, dx, window=window, polyorder=polyorder, order=order, out=out)
+    return charge_grid, lambda_grid_filtered, lambda_grid_filtered_prime
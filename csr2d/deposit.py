@@ -1,5 +1,5 @@
 import numpy as np
-from numba import jit, njit
+from numba import jit, njit, prange, get_num_threads
 import math
 
 def split_particles(position, charge, mins, maxs, sizes):
@@ -128,6 +128,59 @@ def deposit_particles(Np, sizes, indexes, contrib):
 
 
 
+@njit
+def _n_chunks(n_ptcl, n_cells):
+    """
+    Number of particle chunks deposited on private grids in parallel.
+    Each chunk should hold at least about one particle per cell,
+    otherwise clearing and reducing the private grids dominates.
+    """
+    return max(1, min(get_num_threads(), n_ptcl // max(n_cells, 1)))
+
+
+@njit
+def _deposit_cic_2d( q1, q2, w, start, stop,
+    bins_start_1, inv_spacing_1, bins_start_2, inv_spacing_2, hist_data ):
+    """
+    Deposits particles start..stop-1 onto hist_data (serial).
+    """
+    nbins_1, nbins_2 = hist_data.shape
+
+    for i in range(start, stop):
+
+        # Calculate the index of lower bin to which this particle contributes
+        q1_cell = (q1[i] - bins_start_1) * inv_spacing_1
+        q2_cell = (q2[i] - bins_start_2) * inv_spacing_2
+        i1_low_bin = int( math.floor( q1_cell ) )
+        i2_low_bin = int( math.floor( q2_cell ) )
+
+        # Calculate corresponding CIC shape and deposit the weight
+        S1_low = 1. - (q1_cell - i1_low_bin)
+        S2_low = 1. - (q2_cell - i2_low_bin)
+        if (i1_low_bin >= 0) and (i1_low_bin < nbins_1):
+            if (i2_low_bin >= 0) and (i2_low_bin < nbins_2):
+                hist_data[ i1_low_bin, i2_low_bin ] += w[i]*S1_low*S2_low
+            if (i2_low_bin+1 >= 0) and (i2_low_bin+1 < nbins_2):
+                hist_data[ i1_low_bin, i2_low_bin+1 ] += w[i]*S1_low*(1.-S2_low)
+        if (i1_low_bin+1 >= 0) and (i1_low_bin+1 < nbins_1):
+            if (i2_low_bin >= 0) and (i2_low_bin < nbins_2):
+                hist_data[ i1_low_bin+1, i2_low_bin ] += w[i]*(1.-S1_low)*S2_low
+            if (i2_low_bin+1 >= 0) and (i2_low_bin+1 < nbins_2):
+                hist_data[ i1_low_bin+1, i2_low_bin+1 ] += w[i]*(1.-S1_low)*(1.-S2_low)
+
+
+@njit(parallel=True)
+def _reduce_private(private, hist_data):
+    """
+    Sums the private grids private[c] into hist_data, in the order of c,
+    in parallel over the first grid dimension.
+    """
+    n_chunks = private.shape[0]
+    for i1 in prange(hist_data.shape[0]):
+        for c in range(n_chunks):
+            hist_data[i1] += private[c, i1]
+
+
 @njit(parallel=True)
 def histogram_cic_2d( q1, q2, w,
     nbins_1, bins_start_1, bins_end_1,
@@ -138,6 +191,10 @@ def histogram_cic_2d( q1, q2, w,
     in the second dimension.
     Contribution to each bins is determined by the
     Cloud-in-Cell weighting scheme.
+    
+    The particles are split into contiguous chunks, one per thread, which are
+    deposited in parallel on private grids. These are summed in a fixed order,
+    so the result is reproducible for a given number of threads.
 
     Source: 
     ----------
@@ -171,30 +228,71 @@ def histogram_cic_2d( q1, q2, w,
     # Allocate array for histogrammed data
     hist_data = np.zeros( (nbins_1, nbins_2), dtype=np.float64 )
 
-    # Go through particle array and bin the data
-    for i in range(n_ptcl):
+    n_chunks = _n_chunks(n_ptcl, nbins_1*nbins_2)
+    if n_chunks == 1:
+        _deposit_cic_2d(q1, q2, w, 0, n_ptcl,
+            bins_start_1, inv_spacing_1, bins_start_2, inv_spacing_2, hist_data)
+        return( hist_data )
+
+    # Go through particle chunks in parallel and bin the data on private grids
+    private = np.zeros( (n_chunks, nbins_1, nbins_2), dtype=np.float64 )
+    for c in prange(n_chunks):
+        _deposit_cic_2d(q1, q2, w, c*n_ptcl//n_chunks, (c+1)*n_ptcl//n_chunks,
+            bins_start_1, inv_spacing_1, bins_start_2, inv_spacing_2, private[c])
+
+    _reduce_private(private, hist_data)
+
+    return( hist_data )
+
+
+@njit
+def _deposit_cic_3d( q1, q2, q3, w, start, stop,
+    bins_start_1, inv_spacing_1, bins_start_2, inv_spacing_2,
+    bins_start_3, inv_spacing_3, hist_data ):
+    """
+    Deposits particles start..stop-1 onto hist_data (serial).
+    """
+    nbins_1, nbins_2, nbins_3 = hist_data.shape
+
+    for i in range(start, stop):
 
         # Calculate the index of lower bin to which this particle contributes
         q1_cell = (q1[i] - bins_start_1) * inv_spacing_1
         q2_cell = (q2[i] - bins_start_2) * inv_spacing_2
+        q3_cell = (q3[i] - bins_start_3) * inv_spacing_3
         i1_low_bin = int( math.floor( q1_cell ) )
         i2_low_bin = int( math.floor( q2_cell ) )
+        i3_low_bin = int( math.floor( q3_cell ) )
 
         # Calculate corresponding CIC shape and deposit the weight
         S1_low = 1. - (q1_cell - i1_low_bin)
         S2_low = 1. - (q2_cell - i2_low_bin)
+        S3_low = 1. - (q3_cell - i3_low_bin)
         if (i1_low_bin >= 0) and (i1_low_bin < nbins_1):
             if (i2_low_bin >= 0) and (i2_low_bin < nbins_2):
-                hist_data[ i1_low_bin, i2_low_bin ] += w[i]*S1_low*S2_low
+                if (i3_low_bin >= 0) and (i3_low_bin < nbins_3):
+                    hist_data[ i1_low_bin, i2_low_bin, i3_low_bin ] += w[i]*S1_low*S2_low*S3_low
+                if (i3_low_bin+1 >= 0) and (i3_low_bin+1 < nbins_3):
+                    hist_data[ i1_low_bin, i2_low_bin, i3_low_bin+1 ] += w[i]*S1_low*S2_low*(1.-S3_low)
+                
             if (i2_low_bin+1 >= 0) and (i2_low_bin+1 < nbins_2):
-                hist_data[ i1_low_bin, i2_low_bin+1 ] += w[i]*S1_low*(1.-S2_low)
+                if (i3_low_bin >= 0) and (i3_low_bin < nbins_3):
+                    hist_data[ i1_low_bin, i2_low_bin+1, i3_low_bin ] += w[i]*S1_low*(1.-S2_low)*S3_low
+                if (i3_low_bin+1 >= 0) and (i3_low_bin+1 < nbins_3):
+                    hist_data[ i1_low_bin, i2_low_bin+1, i3_low_bin+1 ] += w[i]*S1_low*(1.-S2_low)*(1.-S3_low)                
+                
         if (i1_low_bin+1 >= 0) and (i1_low_bin+1 < nbins_1):
             if (i2_low_bin >= 0) and (i2_low_bin < nbins_2):
-                hist_data[ i1_low_bin+1, i2_low_bin ] += w[i]*(1.-S1_low)*S2_low
+                if (i3_low_bin >= 0) and (i3_low_bin < nbins_3):
+                    hist_data[ i1_low_bin+1, i2_low_bin, i3_low_bin ] += w[i]*(1.-S1_low)*S2_low*S3_low
+                if (i3_low_bin+1 >= 0) and (i3_low_bin+1 < nbins_3):
+                    hist_data[ i1_low_bin+1, i2_low_bin, i3_low_bin+1 ] += w[i]*(1.-S1_low)*S2_low*(1.-S3_low)
+                
             if (i2_low_bin+1 >= 0) and (i2_low_bin+1 < nbins_2):
-                hist_data[ i1_low_bin+1, i2_low_bin+1 ] += w[i]*(1.-S1_low)*(1.-S2_low)
-
-    return( hist_data )
+                if (i3_low_bin >= 0) and (i3_low_bin < nbins_3):
+                    hist_data[ i1_low_bin+1, i2_low_bin+1, i3_low_bin  ] += w[i]*(1.-S1_low)*(1.-S2_low)*S3_low
+                if (i3_low_bin+1 >= 0) and (i3_low_bin+1 < nbins_3):
+                    hist_data[ i1_low_bin+1, i2_low_bin+1, i3_low_bin+1 ] += w[i]*(1.-S1_low)*(1.-S2_low)*(1.-S3_low)
 
 
 @njit(parallel=True)
@@ -209,6 +307,9 @@ def histogram_cic_3d( q1, q2, q3, w,
     and `nbins_3` bins in the third dimension.
     Contribution to each bins is determined by the
     Cloud-in-Cell weighting scheme.
+    
+    As in histogram_cic_2d, particle chunks are deposited in parallel
+    on private grids, which are summed in a fixed order.
 
     Source: 
     ----------
@@ -244,45 +345,167 @@ def histogram_cic_3d( q1, q2, q3, w,
     # Allocate array for histogrammed data
     hist_data = np.zeros( (nbins_1, nbins_2, nbins_3), dtype=np.float64 )
 
-    # Go through particle array and bin the data
-    for i in range(n_ptcl):
+    n_chunks = _n_chunks(n_ptcl, nbins_1*nbins_2*nbins_3)
+    if n_chunks == 1:
+        _deposit_cic_3d(q1, q2, q3, w, 0, n_ptcl,
+            bins_start_1, inv_spacing_1, bins_start_2, inv_spacing_2,
+            bins_start_3, inv_spacing_3, hist_data)
+        return( hist_data )
 
-        # Calculate the index of lower bin to which this particle contributes
-        q1_cell = (q1[i] - bins_start_1) * inv_spacing_1
-        q2_cell = (q2[i] - bins_start_2) * inv_spacing_2
-        q3_cell = (q3[i] - bins_start_3) * inv_spacing_3
-        i1_low_bin = int( math.floor( q1_cell ) )
-        i2_low_bin = int( math.floor( q2_cell ) )
-        i3_low_bin = int( math.floor( q3_cell ) )
+    # Go through particle chunks in parallel and bin the data on private grids
+    private = np.zeros( (n_chunks, nbins_1, nbins_2, nbins_3), dtype=np.float64 )
+    for c in prange(n_chunks):
+        _deposit_cic_3d(q1, q2, q3, w, c*n_ptcl//n_chunks, (c+1)*n_ptcl//n_chunks,
+            bins_start_1, inv_spacing_1, bins_start_2, inv_spacing_2,
+            bins_start_3, inv_spacing_3, private[c])
 
-        # Calculate corresponding CIC shape and deposit the weight
-        S1_low = 1. - (q1_cell - i1_low_bin)
-        S2_low = 1. - (q2_cell - i2_low_bin)
-        S3_low = 1. - (q3_cell - i3_low_bin)
+    _reduce_private(private, hist_data)
+
+    return( hist_data )
+
+
+############################### Shared particle cells ###################
+
+@njit(parallel=True)
+def _cell_indices(q, start, inv_spacing, nbins, out_index, out_offset):
+    for i in prange(q.size):
+        q_cell = (q[i] - start) * inv_spacing
+        # Particles far outside the grid are clamped to a cell without any node in the grid
+        if q_cell < -1:
+            out_index[i] = -2
+            out_offset[i] = 0
+        elif q_cell >= nbins:
+            out_index[i] = nbins
+            out_offset[i] = 0
+        else:
+            i_low = int(math.floor(q_cell))
+            out_index[i] = i_low
+            out_offset[i] = q_cell - i_low
+
+
+class ParticleCells:
+    """
+    Lower cell index (int32) and fractional offset in the cell (float32)
+    of each particle in a 2D grid, stored as separate arrays per dimension.
+    
+    These are computed once per step and shared by the deposition
+    (histogram_cic_2d_cells) and the gather (csr2d.gather.gather_2d_cells).
+    Use `update` to refill the arrays for new positions or grid limits.
+    
+    Parameters:
+    ----------
+    q1/q2 : float, array
+            q1/q2 position of the particles
+    nbins_1/nbins_2 : int
+            number of bins (vertices) in the q1/q2 direction
+    bins_start_1, bins_end_1, bins_start_2, bins_end_2: float
+            start/end value in the q1/q2 direction
+    ----------
+    """
+    def __init__(self, q1, q2,
+        nbins_1, bins_start_1, bins_end_1,
+        nbins_2, bins_start_2, bins_end_2 ):
+        
+        self.shape = (nbins_1, nbins_2)
+        
+        n_ptcl = len(q1)
+        self.index_1 = np.empty(n_ptcl, dtype=np.int32)
+        self.index_2 = np.empty(n_ptcl, dtype=np.int32)
+        self.offset_1 = np.empty(n_ptcl, dtype=np.float32)
+        self.offset_2 = np.empty(n_ptcl, dtype=np.float32)
+        self.update(q1, q2, bins_start_1, bins_end_1, bins_start_2, bins_end_2)
+        
+    def update(self, q1, q2, bins_start_1, bins_end_1, bins_start_2, bins_end_2):
+        """
+        Recomputes the cells in place, for the same number of particles and bins.
+        """
+        assert len(q1) == len(self), f'Expected {len(self)} particles, got {len(q1)}'
+        nbins_1, nbins_2 = self.shape
+        self.start = (bins_start_1, bins_start_2)
+        self.spacing = ((bins_end_1-bins_start_1)/(nbins_1-1), (bins_end_2-bins_start_2)/(nbins_2-1))
+        _cell_indices(np.asarray(q1, dtype=np.float64), bins_start_1, 1/self.spacing[0], nbins_1, self.index_1, self.offset_1)
+        _cell_indices(np.asarray(q2, dtype=np.float64), bins_start_2, 1/self.spacing[1], nbins_2, self.index_2, self.offset_2)
+        
+    def __len__(self):
+        return self.index_1.size
+
+
+@njit
+def _deposit_cells_2d( index_1, index_2, offset_1, offset_2, w, start, stop, hist_data ):
+    """
+    Deposits particles start..stop-1 onto hist_data (serial), see _deposit_cic_2d.
+    """
+    nbins_1, nbins_2 = hist_data.shape
+
+    for i in range(start, stop):
+        i1_low_bin = index_1[i]
+        i2_low_bin = index_2[i]
+        S1_low = 1. - offset_1[i]
+        S2_low = 1. - offset_2[i]
         if (i1_low_bin >= 0) and (i1_low_bin < nbins_1):
             if (i2_low_bin >= 0) and (i2_low_bin < nbins_2):
-                if (i3_low_bin >= 0) and (i3_low_bin < nbins_3):
-                    hist_data[ i1_low_bin, i2_low_bin, i3_low_bin ] += w[i]*S1_low*S2_low*S3_low
-                if (i3_low_bin+1 >= 0) and (i3_low_bin+1 < nbins_3):
-                    hist_data[ i1_low_bin, i2_low_bin, i3_low_bin+1 ] += w[i]*S1_low*S2_low*(1.-S3_low)
-                
+                hist_data[ i1_low_bin, i2_low_bin ] += w[i]*S1_low*S2_low
             if (i2_low_bin+1 >= 0) and (i2_low_bin+1 < nbins_2):
-                if (i3_low_bin >= 0) and (i3_low_bin < nbins_3):
-                    hist_data[ i1_low_bin, i2_low_bin+1, i3_low_bin ] += w[i]*S1_low*(1.-S2_low)*S3_low
-                if (i3_low_bin+1 >= 0) and (i3_low_bin+1 < nbins_3):
-                    hist_data[ i1_low_bin, i2_low_bin+1, i3_low_bin+1 ] += w[i]*S1_low*(1.-S2_low)*(1.-S3_low)                
-                
+                hist_data[ i1_low_bin, i2_low_bin+1 ] += w[i]*S1_low*(1.-S2_low)
         if (i1_low_bin+1 >= 0) and (i1_low_bin+1 < nbins_1):
             if (i2_low_bin >= 0) and (i2_low_bin < nbins_2):
-                if (i3_low_bin >= 0) and (i3_low_bin < nbins_3):
-                    hist_data[ i1_low_bin+1, i2_low_bin, i3_low_bin ] += w[i]*(1.-S1_low)*S2_low*S3_low
-                if (i3_low_bin+1 >= 0) and (i3_low_bin+1 < nbins_3):
-                    hist_data[ i1_low_bin+1, i2_low_bin, i3_low_bin+1 ] += w[i]*(1.-S1_low)*S2_low*(1.-S3_low)
-                
+                hist_data[ i1_low_bin+1, i2_low_bin ] += w[i]*(1.-S1_low)*S2_low
             if (i2_low_bin+1 >= 0) and (i2_low_bin+1 < nbins_2):
-                if (i3_low_bin >= 0) and (i3_low_bin < nbins_3):
-                    hist_data[ i1_low_bin+1, i2_low_bin+1, i3_low_bin  ] += w[i]*(1.-S1_low)*(1.-S2_low)*S3_low
-                if (i3_low_bin+1 >= 0) and (i3_low_bin+1 < nbins_3):
-                    hist_data[ i1_low_bin+1, i2_low_bin+1, i3_low_bin+1 ] += w[i]*(1.-S1_low)*(1.-S2_low)*(1.-S3_low)
+                hist_data[ i1_low_bin+1, i2_low_bin+1 ] += w[i]*(1.-S1_low)*(1.-S2_low)
 
-    return( hist_data )
\ No newline at end of file
+
+@njit(parallel=True)
+def _histogram_cells_2d( index_1, index_2, offset_1, offset_2, w, hist_data ):
+    n_ptcl = len(w)
+    nbins_1, nbins_2 = hist_data.shape
+    
+    n_chunks = _n_chunks(n_ptcl, nbins_1*nbins_2)
+    if n_chunks == 1:
+        _deposit_cells_2d(index_1, index_2, offset_1, offset_2, w, 0, n_ptcl, hist_data)
+        return
+
+    private = np.zeros( (n_chunks, nbins_1, nbins_2), dtype=np.float64 )
+    for c in prange(n_chunks):
+        _deposit_cells_2d(index_1, index_2, offset_1, offset_2, w,
+            c*n_ptcl//n_chunks, (c+1)*n_ptcl//n_chunks, private[c])
+
+    _reduce_private(private, hist_data)
+
+
+def histogram_cic_2d_cells(cells, w, out=None, accumulate=False):
+    """
+    Same as histogram_cic_2d, with the particle positions given as ParticleCells.
+    
+    Parameters:
+    ----------
+    cells : ParticleCells
+    w: float, array
+            weights (charges) of the particles
+    out : np.array, optional
+            array of cells.shape to deposit into. It is zeroed first.
+    accumulate : bool
+            If True, out is not zeroed, so that the particles are added to it.
+            Default: False
+    ----------
+    
+    The charge is always summed in float64. For an out array of another dtype
+    (float32), the sums are converted once at the end.
+    
+    Returns:
+    ----------
+    A 2D array of size cells.shape
+    ----------
+    """
+    if out is None:
+        out = np.zeros(cells.shape)
+    else:
+        assert out.shape == cells.shape, f'out array shape {out.shape} should be {cells.shape}'
+        if not accumulate:
+            out[:] = 0
+    if out.dtype != np.float64:
+        hist_data = np.zeros(cells.shape)
+        _histogram_cells_2d(cells.index_1, cells.index_2, cells.offset_1, cells.offset_2, w, hist_data)
+        out += hist_data
+        return out
+    _histogram_cells_2d(cells.index_1, cells.index_2, cells.offset_1, cells.offset_2, w, out)
+    return out
@@ -0,0 +1,254 @@
+"""
+Interpolation of two field grids (such as Ws and Wx) at the particle positions
+in a single parallel pass.
+
+order=1 uses the Cloud-in-Cell weights of csr2d.deposit.histogram_cic_2d.
+order=2, 3 are B-splines as in scipy.ndimage.map_coordinates (mode='constant'),
+on coefficients from `spline_coefficients`, which can be computed once and reused.
+"""
+import math
+
+import numpy as np
+from numba import njit, prange
+from scipy.ndimage import spline_filter
+
+# Largest offset [cells] past the last grid node that is taken as rounding, not extrapolation
+EDGE_TOLERANCE = 1e-9
+
+
+def spline_coefficients(grid, order, out=None):
+    """
+    B-spline coefficients of `grid` for `gather_2d` with prefiltered=True.
+    For order 1 this is the grid itself.
+    The coefficients can be written into a preallocated float64 (or float32) array `out`.
+    float32 grids keep their dtype; the gather always sums in float64.
+    """
+    if order == 1:
+        return np.ascontiguousarray(grid, dtype=np.float32 if grid.dtype == np.float32 else np.float64)
+    # map_coordinates(mode='constant') prefilters with mirror boundaries
+    return spline_filter(grid, order=order, output=np.float64 if out is None else out, mode='mirror')
+
+
+@njit
+def _mirror(i, n):
+    if i < 0:
+        return -i
+    if i > n - 1:
+        return 2*(n - 1) - i
+    return i
+
+
+@njit
+def _bspline_weights(i, f, order):
+    """
+    First index and the B-spline weights at coordinate u = i + f, with i = floor(u).
+    The 4th weight is 0 for order 2.
+    """
+    if order == 2:
+        # Centered on the nearest grid point
+        if f >= 0.5:
+            i += 1
+            f -= 1
+        return i - 1, (0.5*(0.5 - f)**2, 0.75 - f*f, 0.5*(0.5 + f)**2, 0.0)
+    return i - 1, ((1 - f)**3/6, (4 - 6*f*f + 3*f**3)/6, (1 + 3*f + 3*f*f - 3*f**3)/6, f**3/6)
+
+
+@njit
+def _spline_value(coef_a, coef_b, i1, f1, i2, f2, order):
+    """
+    Values of two splines at grid coordinates (i1 + f1, i2 + f2), zero outside of the grid.
+    """
+    n1, n2 = coef_a.shape
+    # No extrapolation beyond the grid
+    if i1 < 0 or i2 < 0 or i1 > n1 - 1 or i2 > n2 - 1:
+        return 0.0, 0.0
+    # Particles on the last node can get a small positive offset from rounding
+    if i1 == n1 - 1 and f1 <= EDGE_TOLERANCE:
+        f1 = 0.0
+    if i2 == n2 - 1 and f2 <= EDGE_TOLERANCE:
+        f2 = 0.0
+    if (i1 == n1 - 1 and f1 > 0) or (i2 == n2 - 1 and f2 > 0):
+        return 0.0, 0.0
+    j1, w1 = _bspline_weights(i1, f1, order)
+    j2, w2 = _bspline_weights(i2, f2, order)
+    a = 0.0
+    b = 0.0
+    # Fixed trip counts, so that the loops are unrolled. For order 2 the 4th weights are 0.
+    for d1 in range(4):
+        k1 = _mirror(j1 + d1, n1)
+        for d2 in range(4):
+            k2 = _mirror(j2 + d2, n2)
+            w = w1[d1] * w2[d2]
+            a += w * coef_a[k1, k2]
+            b += w * coef_b[k1, k2]
+    return a, b
+
+
+@njit(parallel=True)
+def _gather_cic_2d(q1, q2, start_1, inv_spacing_1, start_2, inv_spacing_2, scale, grid_a, grid_b, out_a, out_b):
+    nbins_1, nbins_2 = grid_a.shape
+    for i in prange(q1.size):
+        q1_cell = (q1[i] - start_1) * inv_spacing_1
+        q2_cell = (q2[i] - start_2) * inv_spacing_2
+        i1 = int(math.floor(q1_cell))
+        i2 = int(math.floor(q2_cell))
+        S1 = 1. - (q1_cell - i1)
+        S2 = 1. - (q2_cell - i2)
+        a = 0.0
+        b = 0.0
+        # Same weights and bounds as the deposition
+        for d1 in range(2):
+            k1 = i1 + d1
+            if k1 < 0 or k1 >= nbins_1:
+                continue
+            w1 = S1 if d1 == 0 else 1. - S1
+            for d2 in range(2):
+                k2 = i2 + d2
+                if k2 < 0 or k2 >= nbins_2:
+                    continue
+                w = w1 * (S2 if d2 == 0 else 1. - S2)
+                a += w * grid_a[k1, k2]
+                b += w * grid_b[k1, k2]
+        out_a[i] = scale * a
+        out_b[i] = scale * b
+
+
+@njit(parallel=True)
+def _gather_spline_2d(q1, q2, start_1, inv_spacing_1, start_2, inv_spacing_2, scale, order, coef_a, coef_b, out_a, out_b):
+    for i in prange(q1.size):
+        u1 = (q1[i] - start_1) * inv_spacing_1
+        u2 = (q2[i] - start_2) * inv_spacing_2
+        if not (u1 >= 0 and u2 >= 0):
+            # Also catches nan
+            out_a[i] = 0.0
+            out_b[i] = 0.0
+            continue
+        i1 = int(math.floor(u1))
+        i2 = int(math.floor(u2))
+        a, b = _spline_value(coef_a, coef_b, i1, u1 - i1, i2, u2 - i2, order)
+        out_a[i] = scale * a
+        out_b[i] = scale * b
+
+
+def gather_2d(q1, q2, grid_a, grid_b, start_1, spacing_1, start_2, spacing_2,
+              order=1, scale=1.0, prefiltered=False, out=None):
+    """
+    Interpolates two grids at the particle positions (q1, q2) in one pass.
+
+    Parameters
+    ----------
+    q1, q2 : np.array
+        Particle coordinates along the first and second grid dimension (z, x)
+
+    grid_a, grid_b : np.array (2D)
+        Grids (or their spline coefficients, see `prefiltered`) of equal shape
+
+    start_1, spacing_1, start_2, spacing_2 : float
+        Position of grid point [0, 0] and the grid spacings
+
+    order : int
+        1: CIC (bilinear), consistent with histogram_cic_2d
+        2, 3: quadratic, cubic B-splines, as scipy.ndimage.map_coordinates
+        Default: 1
+
+    scale : float
+        Factor applied to the results. Default: 1.0
+
+    prefiltered : bool
+        If True, grid_a and grid_b are already coefficients from `spline_coefficients`.
+        Default: False
+
+    out : tuple of two np.arrays, optional
+        Output arrays with the size of q1
+
+    Returns
+    -------
+    values_a, values_b : tuple(ndarray, ndarray)
+
+    """
+    assert grid_a.shape == grid_b.shape, f'Grid shapes {grid_a.shape} and {grid_b.shape} differ'
+    if order not in (1, 2, 3):
+        raise ValueError(f'Interpolation order must be 1, 2 or 3, got {order}')
+
+    n = len(q1)
+    if out is None:
+        out = (np.empty(n), np.empty(n))
+    for o in out:
+        assert o.shape == (n,), f'out array shape {o.shape} should be {(n,)}'
+
+    assert order == 1 or min(grid_a.shape) >= 4, 'Spline interpolation needs at least 4 grid points per dimension'
+    if not prefiltered:
+        grid_a = spline_coefficients(grid_a, order)
+        grid_b = spline_coefficients(grid_b, order)
+
+    args = (np.asarray(q1, dtype=np.float64), np.asarray(q2, dtype=np.float64),
+            float(start_1), 1/spacing_1, float(start_2), 1/spacing_2, float(scale))
+    if order == 1:
+        _gather_cic_2d(*args, grid_a, grid_b, *out)
+    else:
+        _gather_spline_2d(*args, order, grid_a, grid_b, *out)
+
+    return out
+
+
+@njit(parallel=True)
+def _gather_cells_cic_2d(index_1, index_2, offset_1, offset_2, scale, grid_a, grid_b, out_a, out_b):
+    nbins_1, nbins_2 = grid_a.shape
+    for i in prange(index_1.size):
+        i1 = index_1[i]
+        i2 = index_2[i]
+        S1 = 1. - offset_1[i]
+        S2 = 1. - offset_2[i]
+        a = 0.0
+        b = 0.0
+        for d1 in range(2):
+            k1 = i1 + d1
+            if k1 < 0 or k1 >= nbins_1:
+                continue
+            w1 = S1 if d1 == 0 else 1. - S1
+            for d2 in range(2):
+                k2 = i2 + d2
+                if k2 < 0 or k2 >= nbins_2:
+                    continue
+                w = w1 * (S2 if d2 == 0 else 1. - S2)
+                a += w * grid_a[k1, k2]
+                b += w * grid_b[k1, k2]
+        out_a[i] = scale * a
+        out_b[i] = scale * b
+
+
+@njit(parallel=True)
+def _gather_cells_spline_2d(index_1, index_2, offset_1, offset_2, scale, order, coef_a, coef_b, out_a, out_b):
+    for i in prange(index_1.size):
+        a, b = _spline_value(coef_a, coef_b, index_1[i], float(offset_1[i]), index_2[i], float(offset_2[i]), order)
+        out_a[i] = scale * a
+        out_b[i] = scale * b
+
+
+def gather_2d_cells(cells, grid_a, grid_b, order=1, scale=1.0, prefiltered=False, out=None):
+    """
+    Same as `gather_2d`, with the particle positions given as csr2d.deposit.ParticleCells,
+    which are shared with the deposition (histogram_cic_2d_cells).
+    """
+    assert grid_a.shape == grid_b.shape == cells.shape, f'Grid shapes {grid_a.shape}, {grid_b.shape} should be {cells.shape}'
+    if order not in (1, 2, 3):
+        raise ValueError(f'Interpolation order must be 1, 2 or 3, got {order}')
+
+    n = len(cells)
+    if out is None:
+        out = (np.empty(n), np.empty(n))
+    for o in out:
+        assert o.shape == (n,), f'out array shape {o.shape} should be {(n,)}'
+
+    assert order == 1 or min(grid_a.shape) >= 4, 'Spline interpolation needs at least 4 grid points per dimension'
+    if not prefiltered:
+        grid_a = spline_coefficients(grid_a, order)
+        grid_b = spline_coefficients(grid_b, order)
+
+    args = (cells.index_1, cells.index_2, cells.offset_1, cells.offset_2, float(scale))
+    if order == 1:
+        _gather_cells_cic_2d(*args, grid_a, grid_b, *out)
+    else:
+        _gather_cells_spline_2d(*args, order, grid_a, grid_b, *out)
+
+    return out
@@ -0,0 +1,412 @@
+"""
+Caching of Green function meshes.
+
+The Green meshes only depend on the grid size, the scaled grid spacing
+(dz/2/|rho|, dx/|rho|), beta, the sign of rho, and the transient parameters
+(half angles and lamb). They are cached on disk as plain .npy files so that
+repeated runs on the same lattice can memory-map them instead of recomputing.
+
+The disk cache is disabled unless a directory is configured, either with
+`set_disk_cache` or through the CSR2D_CACHE_DIR environment variable.
+
+In front of the disk cache there is an in-process LRU cache with a memory
+budget, so that meshes are reused automatically between kick calculations.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+CACHE_DIR_ENV = "CSR2D_CACHE_DIR"
+CACHE_SIZE_ENV = "CSR2D_CACHE_MAX_BYTES"
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3
+DEFAULT_MEMORY_BYTES = 1024 ** 3
+
+# Significant digits kept for float parameters in a key.
+# Grid spacings computed from slightly different bunch extents should still hit.
+KEY_DIGITS = 12
+
+
+def _round(value):
+    if value is None:
+        return None
+    return float(f"{float(value):.{KEY_DIGITS}g}")
+
+
+def mesh_key(case, nz, nx, dz, dx, rho, **params):
+    """
+    Hashable key for a Green mesh set.
+
+    Parameters
+    ----------
+    case : str
+        Name of the Green function set, e.g. 'psi_sx', 'A', 'C', 'D'
+
+    nz, nx : int
+        Size of the density mesh in z and x
+
+    dz, dx : float
+        Grid spacing of the density mesh in z and x [m]
+
+    rho : float
+        bending radius [m]. Only its sign and magnitude via the scaled spacings enter the key.
+
+    **params : float
+        Other parameters of the Green function (beta, alp, lamb, ...).
+        beta enters the key as 1 - beta: rounded beta is 1 for all gamma above ~1e6.
+
+    Returns
+    -------
+    key : tuple
+
+    """
+    rho_sign = 1 if rho >= 0 else -1
+    items = [
+        ("case", case),
+        ("nz", int(nz)),
+        ("nx", int(nx)),
+        ("dz", _round(dz / (2 * abs(rho)))),
+        ("dx", _round(dx / abs(rho))),
+        ("rho_sign", rho_sign),
+    ]
+    if params.get("beta") is not None:
+        params = dict(params)
+        params["one_minus_beta"] = 1 - float(params.pop("beta"))
+    for name in sorted(params):
+        value = params[name]
+        if isinstance(value, (float, np.floating)):
+            value = _round(value)
+        items.append((name, value))
+    return tuple(items)
+
+
+def key_digest(key):
+    """
+    Content address (sha256 hex digest) of a key from `mesh_key`.
+    """
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+class GreenMeshDiskCache:
+    """
+    Content-addressed on-disk cache of Green meshes with LRU eviction.
+
+    Each entry is a directory named by the key digest, holding one .npy file
+    per mesh and a meta.json file with the key. Entries are loaded memory-mapped
+    (read-only). The meta.json modification time is the last access time used
+    for eviction.
+
+    Parameters
+    ----------
+    directory : str
+        Cache directory. Created if needed.
+
+    max_bytes : int
+        Total size budget of the cache. The least recently used entries are
+        removed when a new entry pushes the total above this.
+
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key_digest(key))
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self._path(key), "meta.json"))
+
+    def get(self, key):
+        """
+        Returns the tuple of memory-mapped meshes stored under `key`, or None.
+        """
+        path = self._path(key)
+        meta_file = os.path.join(path, "meta.json")
+        try:
+            with open(meta_file) as f:
+                meta = json.load(f)
+            meshes = tuple(
+                np.load(os.path.join(path, f"mesh_{i}.npy"), mmap_mode="r")
+                for i in range(meta["n_meshes"])
+            )
+            os.utime(meta_file)
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return meshes
+
+    def put(self, key, meshes):
+        """
+        Stores a tuple of meshes under `key`, then evicts old entries if needed.
+        """
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        # Write to a private directory, then move it in place atomically
+        tmp = os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp)
+        try:
+            for i, mesh in enumerate(meshes):
+                np.save(os.path.join(tmp, f"mesh_{i}.npy"), np.ascontiguousarray(mesh))
+            with open(os.path.join(tmp, "meta.json"), "w") as f:
+                json.dump({"key": key, "n_meshes": len(meshes), "created": time.time()}, f)
+            os.rename(tmp, path)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict(keep=path)
+
+    def entries(self):
+        """
+        List of (last access time, size in bytes, path) of all entries.
+        """
+        out = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            meta_file = os.path.join(path, "meta.json")
+            if name.startswith(".") or not os.path.exists(meta_file):
+                continue
+            size = sum(e.stat().st_size for e in os.scandir(path))
+            out.append((os.path.getmtime(meta_file), size, path))
+        return out
+
+    def size(self):
+        """
+        Total size of the cache in bytes.
+        """
+        return sum(e[1] for e in self.entries())
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used entries until the cache fits in max_bytes.
+        The entry at path `keep` is never removed.
+        """
+        entries = sorted(self.entries())
+        total = sum(e[1] for e in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        for _, _, path in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _resident_bytes(meshes):
+    """
+    Memory of the meshes, without the read-only memory maps of GreenMeshDiskCache entries.
+    """
+    return sum(mesh.nbytes for mesh in meshes if not isinstance(mesh, np.memmap))
+
+
+class GreenMeshLRU:
+    """
+    In-memory LRU cache of Green meshes with a memory budget.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Memory budget. The least recently used entries are dropped when
+        a new entry pushes the total above this. An entry larger than the
+        budget is not stored. Memory-mapped meshes (from the disk cache)
+        are not counted.
+
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_BYTES):
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """
+        Returns the tuple of meshes stored under `key`, or None.
+        """
+        meshes = self._entries.get(key)
+        if meshes is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return meshes
+
+    def put(self, key, meshes):
+        """
+        Stores a tuple of meshes under `key`, dropping old entries if needed.
+        """
+        meshes = tuple(meshes)
+        size = _resident_bytes(meshes)
+        if key in self._entries:
+            self.nbytes -= _resident_bytes(self._entries.pop(key))
+        if size > self.max_bytes or self.max_bytes <= 0:
+            return
+        self._shrink(self.max_bytes - size)
+        self._entries[key] = meshes
+        self.nbytes += size
+
+    def _shrink(self, max_bytes):
+        while self._entries and self.nbytes > max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self.nbytes -= _resident_bytes(old)
+
+    def resize(self, max_bytes):
+        """
+        Sets a new memory budget, dropping old entries if needed.
+        """
+        self.max_bytes = int(max_bytes)
+        self._shrink(self.max_bytes)
+
+    def clear(self):
+        """
+        Removes all entries and resets the counters.
+        """
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        dict with the number of entries, bytes used, budget, hits and misses.
+        """
+        return {
+            "entries": len(self._entries),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_memory_cache = GreenMeshLRU()
+_disk_cache = None
+
+
+def get_memory_cache():
+    """
+    Returns the in-process GreenMeshLRU.
+    """
+    return _memory_cache
+
+
+def set_memory_cache_size(max_bytes):
+    """
+    Sets the memory budget of the in-process Green mesh cache.
+    Pass 0 to disable in-memory caching.
+    """
+    _memory_cache.resize(max_bytes)
+    return _memory_cache
+
+
+def set_disk_cache(directory, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Enables the on-disk Green mesh cache in `directory`.
+    Pass directory=None to disable it.
+    """
+    global _disk_cache
+    if directory is None:
+        _disk_cache = False
+    else:
+        _disk_cache = GreenMeshDiskCache(directory, max_bytes=max_bytes)
+    return _disk_cache
+
+
+def get_disk_cache():
+    """
+    Returns the active GreenMeshDiskCache, or None if disk caching is disabled.
+
+    On first use this is configured from the CSR2D_CACHE_DIR and
+    CSR2D_CACHE_MAX_BYTES environment variables.
+    """
+    global _disk_cache
+    if _disk_cache is None:
+        directory = os.environ.get(CACHE_DIR_ENV)
+        if directory:
+            max_bytes = int(os.environ.get(CACHE_SIZE_ENV, DEFAULT_MAX_BYTES))
+            _disk_cache = GreenMeshDiskCache(directory, max_bytes=max_bytes)
+        else:
+            _disk_cache = False
+    return _disk_cache or None
+
+
+def cached_meshes(key, compute, persist=True):
+    """
+    Returns the meshes for `key`, calling `compute()` and storing the result
+    if they are not cached.
+
+    The in-memory cache is checked first, then the disk cache.
+
+    Parameters
+    ----------
+    key : tuple
+        Key from `mesh_key`
+
+    compute : callable
+        Returns a tuple of np.arrays
+
+    persist : bool
+        If False, the result is only cached in memory.
+        Use this for meshes that are cheap to derive from other cached meshes.
+        Default: True
+
+    Returns
+    -------
+    meshes : tuple of read-only np.arrays
+
+    """
+    meshes = _memory_cache.get(key)
+    if meshes is not None:
+        return meshes
+
+    cache = get_disk_cache() if persist else None
+    if cache is not None:
+        meshes = cache.get(key)
+
+    if meshes is None:
+        meshes = tuple(compute())
+        # Cached meshes are shared between callers
+        for mesh in meshes:
+            mesh.flags.writeable = False
+        if cache is not None:
+            cache.put(key, meshes)
+
+    _memory_cache.put(key, meshes)
+
+    return meshes
+
+
+def cache_stats():
+    """
+    Hit and miss counters of the memory and disk caches.
+    """
+    cache = get_disk_cache()
+    return {
+        "memory": _memory_cache.stats(),
+        "disk": None if cache is None else {"hits": cache.hits, "misses": cache.misses},
+    }
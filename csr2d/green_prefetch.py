@@ -0,0 +1,193 @@
+"""
+Prefetched transient Green meshes at the phi or lamb of the tracking steps.
+
+The Green meshes of cases A, C and D depend on the position in the lattice element
+(phi for case A, lamb for cases C and D), so every tracking step through a bend entrance
+or exit needs a new mesh. A GreenMeshPrefetch computes the meshes of a list of
+positions (nodes) ahead of the tracking, in parallel, and stores them in the Green mesh
+cache (on disk if configured, see csr2d.green_cache). A step at a node then only looks up
+its meshes; any other position computes its meshes as usual. The prefetch keeps no meshes
+itself, so the memory cache budget applies: a node evicted from memory (and not on disk)
+is computed again when it is looked up.
+
+The meshes are not interpolated between the nodes: their near-singular ridges move
+with phi and lamb, and interpolated meshes are not accurate.
+
+Example
+-------
+    prefetched = prefetch_transient_meshes(nz, nx, dz, dx, rho=rho, beta=beta,
+                                           phi_nodes=phi_steps, executor=get_executor('thread'))
+    for phi in phi_steps:
+        kicks = csr2d_transient_kick_calc(z_b, x_b, weight, gamma=gamma, rho=rho, phi=phi,
+                                          nz=nz, nx=nx, zlim=zlim, xlim=xlim, prefetched=prefetched)
+"""
+import concurrent.futures as cf
+from functools import partial
+
+import numpy as np
+
+from csr2d.green_cache import cached_meshes, get_disk_cache, get_memory_cache, mesh_key
+from csr2d.igf import IGF_ORDER
+from csr2d.kick_transient import compute_potential_grids, potential_grid_key
+from csr2d.parallel import threads_unsafe
+
+
+# Parameter of the nodes for each case
+NODE_PARAMETERS = {'A': 'phi', 'C': 'lamb', 'D': 'lamb'}
+
+
+def _node_meshes(case, value, nz, nx, dz, dx, rho, beta, phi_m, igf, igf_order):
+    """
+    Green meshes of a node, without None for the missing Fx of case D.
+    """
+    params = {NODE_PARAMETERS[case]: value}
+    Gs, Gx, _, _ = compute_potential_grids(case, nz=nz, nx=nx, dz=dz, dx=dx, rho=rho, beta=beta, phi_m=phi_m,
+                                           igf=igf, igf_order=igf_order, **params)
+    return (Gs,) if Gx is None else (Gs, Gx)
+
+
+def _is_cached(key):
+    disk = get_disk_cache()
+    return key in get_memory_cache() or (disk is not None and key in disk)
+
+
+class GreenMeshPrefetch:
+    """
+    Green meshes of case A, C or D at a set of phi (case A) or lamb (cases C and D) nodes.
+
+    Parameters
+    ----------
+    case : str
+        'A', 'C' or 'D'
+
+    nodes : array-like
+        phi (case A) or lamb (cases C and D) values, such as the positions of the tracking steps
+
+    nz, nx, dz, dx :
+        Density grid, as for compute_potential_grids. The meshes only apply to this grid.
+
+    rho, beta : float
+
+    phi_m : float
+        Bending angle of the bend, for case C
+
+    igf, igf_order :
+        Integrated Green functions, see compute_potential_grids. Default: False
+
+    """
+    def __init__(self, case, nodes, *, nz, nx, dz, dx, rho, beta, phi_m=None, igf=False, igf_order=IGF_ORDER):
+        if case not in NODE_PARAMETERS:
+            raise ValueError(f'No prefetch for case {case}, must be one of {tuple(NODE_PARAMETERS)}')
+        nodes = np.unique(np.asarray(nodes, dtype=float))
+        if nodes.ndim != 1 or len(nodes) < 1:
+            raise ValueError('At least one node is needed')
+        self.case = case
+        self.parameter = NODE_PARAMETERS[case]
+        self.nodes = nodes
+        self.nz, self.nx, self.dz, self.dx = nz, nx, dz, dx
+        self.rho, self.beta, self.phi_m = rho, beta, phi_m
+        self.igf, self.igf_order = igf, igf_order
+        self.grid_key = mesh_key(case, nz, nx, dz, dx, rho, beta=beta)
+
+    def node_key(self, value):
+        """
+        Green mesh cache key of the node `value`, the same as compute_potential_grids.
+        """
+        return potential_grid_key(self.case, self.nz, self.nx, self.dz, self.dx, self.rho, self.beta,
+                                  phi_m=self.phi_m, igf=self.igf, igf_order=self.igf_order,
+                                  **{self.parameter: value})
+
+    def node_meshes(self, value):
+        """
+        Computes the meshes of the node `value`, without the cache.
+        """
+        return _node_meshes(self.case, value, nz=self.nz, nx=self.nx, dz=self.dz, dx=self.dx, rho=self.rho,
+                            beta=self.beta, phi_m=self.phi_m, igf=self.igf, igf_order=self.igf_order)
+
+    def build(self, executor=None):
+        """
+        Computes the meshes of the nodes that are not cached yet into the Green mesh cache,
+        one node per task of `executor` (None: one node after the other, each with the parallel
+        Numba kernels; an Executor; or a map function). Thread pools compute one node after
+        the other with the 'workqueue' Numba threading layer (see csr2d.parallel.threads_unsafe).
+        Returns self.
+        """
+        missing = [value for value in self.nodes if not _is_cached(self.node_key(value))]
+        if missing and executor is not None and not threads_unsafe(executor):
+            map_f = executor.map if isinstance(executor, cf.Executor) else executor
+            node_meshes = partial(_node_meshes, self.case, nz=self.nz, nx=self.nx, dz=self.dz, dx=self.dx,
+                                  rho=self.rho, beta=self.beta, phi_m=self.phi_m, igf=self.igf,
+                                  igf_order=self.igf_order)
+            for value, meshes in zip(missing, map_f(node_meshes, missing)):
+                # Results of worker processes go into the cache of this process
+                cached_meshes(self.node_key(value), lambda: meshes)
+        else:
+            for value in missing:
+                cached_meshes(self.node_key(value), partial(self.node_meshes, value))
+        return self
+
+    def check_grid(self, nz, nx, dz, dx, rho, beta, phi_m=None, igf=False, igf_order=IGF_ORDER):
+        """
+        Raises ValueError if the meshes were computed for another grid, rho, beta,
+        phi_m (for case C) or integrated Green function setting.
+        """
+        same = mesh_key(self.case, nz, nx, dz, dx, rho, beta=beta) == self.grid_key
+        if self.case == 'C':
+            same = same and np.isclose(phi_m, self.phi_m, rtol=1e-12, atol=0)
+        if not same:
+            raise ValueError(f'Case {self.case} meshes were prefetched for another grid, rho, beta or phi_m. '
+                             'Use fixed zlim and xlim when tracking with prefetched meshes.')
+        if bool(igf) != bool(self.igf) or (igf and igf_order != self.igf_order):
+            raise ValueError(f'Case {self.case} meshes were prefetched with igf={self.igf}, '
+                             f'igf_order={self.igf_order}, not igf={igf}, igf_order={igf_order}')
+
+    def get(self, value):
+        """
+        Meshes at the node `value`, (Es, Fx) for cases A and C, (Es, None) for case D,
+        as compute_potential_grids, from the Green mesh cache (computed again if evicted).
+        None if `value` is not a node.
+        """
+        at_node = np.flatnonzero(np.isclose(self.nodes, value, rtol=1e-12, atol=0))
+        if not len(at_node):
+            return None
+        node = self.nodes[at_node[0]]
+        meshes = cached_meshes(self.node_key(node), partial(self.node_meshes, node))
+        return (meshes[0], None) if len(meshes) == 1 else meshes
+
+    def __contains__(self, value):
+        return bool(np.any(np.isclose(self.nodes, value, rtol=1e-12, atol=0)))
+
+    @property
+    def n_cached(self):
+        """
+        Number of nodes whose meshes are in the memory or disk cache.
+        """
+        return sum(_is_cached(self.node_key(value)) for value in self.nodes)
+
+    def __repr__(self):
+        return (f"<GreenMeshPrefetch case {self.case}, {len(self.nodes)} {self.parameter} nodes "
+                f"[{self.nodes[0]:.4g}, {self.nodes[-1]:.4g}], {self.n_cached} cached>")
+
+
+def prefetch_transient_meshes(nz, nx, dz, dx, *, rho, beta, phi_nodes=None, lamb_nodes=None, phi_m=None,
+                              igf=False, igf_order=IGF_ORDER, executor=None):
+    """
+    Computes the Green meshes of a bend ahead of the tracking: case A at phi_nodes,
+    and cases C and D at lamb_nodes (after a bend of angle phi_m).
+
+    Returns
+    -------
+    dict of {case: GreenMeshPrefetch}, for csr2d_transient_kick_calc(..., prefetched=...)
+
+    """
+    prefetched = {}
+    options = dict(nz=nz, nx=nx, dz=dz, dx=dx, rho=rho, beta=beta, igf=igf, igf_order=igf_order)
+    if phi_nodes is not None:
+        prefetched['A'] = GreenMeshPrefetch('A', phi_nodes, **options)
+    if lamb_nodes is not None:
+        assert phi_m is not None and phi_m > 0, "phi_m (bending angle) must be given for the lamb nodes!!!"
+        prefetched['C'] = GreenMeshPrefetch('C', lamb_nodes, phi_m=phi_m, **options)
+        prefetched['D'] = GreenMeshPrefetch('D', lamb_nodes, **options)
+    for prefetch in prefetched.values():
+        prefetch.build(executor=executor)
+    return prefetched
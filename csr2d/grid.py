@@ -0,0 +1,210 @@
+"""
+Grid bounds from the particle distribution.
+
+With the grid spanning min/max of the particles, a few halo particles can stretch it,
+so that most cells are empty. `plan_grid` instead picks the bounds from weighted
+quantiles or n-sigma of the distribution, and reports the charge fraction outside.
+The kick calculations give these outliers a 1D steady-state (far field) kick,
+see CSRKickEngine(grid_method=...).
+"""
+import numpy as np
+
+
+GRID_METHODS = ('minmax', 'quantile', 'sigma')
+
+
+def weighted_quantiles(values, weights, quantiles):
+    """
+    Quantiles of `values` with `weights` (None: equal weights), from the cumulative weight.
+    """
+    values = np.asarray(values)
+    if weights is None or np.ptp(weights) == 0:
+        # Selection instead of a full sort
+        return np.quantile(values, quantiles)
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    return np.interp(np.asarray(quantiles) * cumulative[-1], cumulative, values[order])
+
+
+class GridPlan:
+    """
+    Grid bounds and the charge outside of them.
+
+    Attributes
+    ----------
+    zlim, xlim : tuple of floats
+        (min, max) of the grid
+
+    method : str
+        Method of `plan_grid`
+
+    clipped_fraction : float
+        Fraction of the charge outside of the grid
+
+    n_clipped : int
+        Number of particles outside of the grid
+
+    """
+    def __init__(self, zlim, xlim, method, clipped_fraction=0.0, n_clipped=0):
+        self.zlim = tuple(float(v) for v in zlim)
+        self.xlim = tuple(float(v) for v in xlim)
+        self.method = method
+        self.clipped_fraction = clipped_fraction
+        self.n_clipped = n_clipped
+
+    def inside(self, z_b, x_b):
+        """
+        Boolean array, True for particles within the grid
+        """
+        return ((z_b >= self.zlim[0]) & (z_b <= self.zlim[1]) &
+                (x_b >= self.xlim[0]) & (x_b <= self.xlim[1]))
+
+    def to_dict(self):
+        return {
+            "zlim": self.zlim,
+            "xlim": self.xlim,
+            "method": self.method,
+            "clipped_fraction": self.clipped_fraction,
+            "n_clipped": self.n_clipped,
+        }
+
+    def __repr__(self):
+        return (f"<GridPlan {self.method} zlim={self.zlim} xlim={self.xlim} "
+                f"clipped {self.n_clipped} particles ({self.clipped_fraction:.3g} of the charge)>")
+
+
+def _padded(lo, hi, qmin, qmax, margin):
+    pad = margin * (hi - lo)
+    return max(qmin, lo - pad), min(qmax, hi + pad)
+
+
+def _bounds(q, weight, method, quantile, n_sigma, margin):
+    qmin, qmax = q.min(), q.max()
+    if method == 'minmax':
+        return qmin, qmax
+    if method == 'quantile':
+        lo, hi = weighted_quantiles(q, weight, [quantile, 1 - quantile])
+    else:
+        mean = np.average(q, weights=weight)
+        sigma = np.sqrt(np.average((q - mean)**2, weights=weight))
+        lo, hi = mean - n_sigma * sigma, mean + n_sigma * sigma
+    return _padded(lo, hi, qmin, qmax, margin)
+
+
+class ChunkMoments:
+    """
+    Extent and weighted mean and standard deviation of z and x, accumulated over
+    chunks of particles, for `plan` bounds of a bunch that is read in chunks.
+
+    Quantiles need all particles at once, so only the 'minmax' and 'sigma' methods are available.
+    """
+    def __init__(self):
+        self.qmin = np.full(2, np.inf)
+        self.qmax = np.full(2, -np.inf)
+        self.weight = 0.0
+        self.n = 0
+        # Sums of w*(q - shift) and w*(q - shift)**2, shifted by the mean of the first chunk
+        self._shift = None
+        self._sum1 = np.zeros(2)
+        self._sum2 = np.zeros(2)
+
+    def add(self, z_b, x_b, weight):
+        q = np.stack((np.asarray(z_b, dtype=float), np.asarray(x_b, dtype=float)))
+        if not q.shape[1]:
+            return
+        self.qmin = np.minimum(self.qmin, q.min(axis=1))
+        self.qmax = np.maximum(self.qmax, q.max(axis=1))
+        if self._shift is None:
+            self._shift = q.mean(axis=1)
+        dq = q - self._shift[:, None]
+        self._sum1 += dq @ weight
+        self._sum2 += (dq * dq) @ weight
+        self.weight += np.sum(weight)
+        self.n += q.shape[1]
+
+    @property
+    def mean(self):
+        return self._shift + self._sum1 / self.weight
+
+    @property
+    def sigma(self):
+        d = self._sum1 / self.weight
+        return np.sqrt(np.maximum(self._sum2 / self.weight - d * d, 0))
+
+    def plan(self, method='sigma', n_sigma=5.0, margin=0.05, zlim=None, xlim=None):
+        """
+        GridPlan as `plan_grid` for the accumulated particles. Its clipped charge is not known
+        from the moments; n_clipped and clipped_fraction are 0 until set by the caller.
+        """
+        if method not in ('minmax', 'sigma'):
+            raise ValueError(f"Grid method {method} needs all particles at once, use 'minmax' or 'sigma' for chunks")
+        limits = [zlim, xlim]
+        for k in range(2):
+            if limits[k] is not None:
+                continue
+            if method == 'minmax':
+                limits[k] = (self.qmin[k], self.qmax[k])
+            else:
+                mean, sigma = self.mean[k], self.sigma[k]
+                limits[k] = _padded(mean - n_sigma * sigma, mean + n_sigma * sigma, self.qmin[k], self.qmax[k], margin)
+        return GridPlan(*limits, method)
+
+
+def plan_grid(z_b, x_b, weight=None, *, method='quantile', quantile=1e-4, n_sigma=5.0, margin=0.05,
+              zlim=None, xlim=None):
+    """
+    Grid bounds for the kick calculations from the particle distribution.
+
+    Parameters
+    ----------
+    z_b, x_b : np.array
+        Bunch coordinates [m]
+
+    weight : np.array, optional
+        Particle weights. Default: None (equal weights)
+
+    method : str
+        'minmax': the full extent of the particles (no clipping)
+        'quantile': the weighted quantiles quantile and 1-quantile in each dimension
+        'sigma': mean +/- n_sigma standard deviations in each dimension
+        The 'quantile' and 'sigma' bounds are widened by margin times their span,
+        and never exceed the particle extent.
+        Default: 'quantile'
+
+    quantile : float
+        Charge fraction cut at each end, per dimension. Default: 1e-4
+
+    n_sigma : float
+        Default: 5.0
+
+    margin : float
+        Default: 0.05
+
+    zlim, xlim : floats (min, max) or None
+        Fixed bounds, which are used instead of the planned ones. Default: None
+
+    Returns
+    -------
+    GridPlan
+
+    """
+    if method not in GRID_METHODS:
+        raise ValueError(f'Unknown grid method: {method}, must be one of {GRID_METHODS}')
+
+    z_b = np.asarray(z_b)
+    x_b = np.asarray(x_b)
+    if zlim is None:
+        zlim = _bounds(z_b, weight, method, quantile, n_sigma, margin)
+    if xlim is None:
+        xlim = _bounds(x_b, weight, method, quantile, n_sigma, margin)
+
+    plan = GridPlan(zlim, xlim, method)
+    outside = ~plan.inside(z_b, x_b)
+    plan.n_clipped = int(np.count_nonzero(outside))
+    if plan.n_clipped:
+        if weight is None:
+            plan.clipped_fraction = plan.n_clipped / len(z_b)
+        else:
+            plan.clipped_fraction = float(np.sum(weight[outside]) / np.sum(weight))
+
+    return plan
@@ -0,0 +1,119 @@
+"""
+Integrated Green function (IGF) meshes.
+
+The point-sampled Green meshes are singular near x = 0 (and psi_s near the origin),
+so that a coarse grid samples them poorly. With the charge density interpolated
+linearly between grid points (as CIC deposition assumes), the exact convolution
+weight of each grid point is the Green function averaged with a tent (hat)
+function of half-width dz, dx around the point:
+
+    G_igf(z, x) = int int G(z + u dz, x + v dx) (1-|u|) (1-|v|) du dv,  |u|, |v| < 1
+
+This is evaluated with Gauss-Legendre quadrature on each grid interval. The nodes
+are strictly inside the intervals, so the singular lines z = 0 and x = 0 are never
+evaluated, and nodes on an interval are shared by the two grid points at its ends.
+The cost is order**2 point evaluations per grid point.
+
+The meshes are averages (not integrals), so they replace the point-sampled meshes
+directly, with the same dz*dx factor in the convolution.
+"""
+import numpy as np
+
+from csr2d.core2 import psi_sx_mesh
+
+# Default number of Gauss-Legendre nodes per grid interval and dimension
+IGF_ORDER = 4
+
+# Maximum number of point evaluations per block of columns
+IGF_BLOCK_POINTS = 2**22
+
+
+def gauss_legendre_unit(order):
+    """
+    Gauss-Legendre nodes and weights on [0, 1].
+    """
+    t, w = np.polynomial.legendre.leggauss(order)
+    return (t + 1) / 2, w / 2
+
+
+def _interval_nodes(vec, d, t):
+    """
+    Quadrature nodes on the intervals [vec[0]-d, vec[0]], [vec[0], vec[1]], ..., [vec[-1]-d, vec[-1]]
+    Shape: (len(vec)+1)*len(t)
+    """
+    starts = vec[0] + (np.arange(-1, len(vec)) * d)
+    return (starts[:, None] + t[None, :] * d).ravel()
+
+
+def _tent_reduce(samples, t, w, axis):
+    """
+    Tent-weighted average along `axis` of samples at interval nodes.
+    samples has (n+1)*len(t) entries along `axis`, the result n.
+    """
+    samples = np.moveaxis(samples, axis, 0)
+    order = len(t)
+    samples = samples.reshape((-1, order) + samples.shape[1:])
+    # Contributions of each interval to the points at its lower and upper end
+    to_lower = np.tensordot(w * (1 - t), samples, axes=([0], [1]))
+    to_upper = np.tensordot(w * t, samples, axes=([0], [1]))
+    out = to_lower[1:] + to_upper[:-1]
+    return np.moveaxis(out, 0, axis)
+
+
+def igf_mesh(mesh_func, zvec, xvec, dz, dx, order=IGF_ORDER, block_points=IGF_BLOCK_POINTS):
+    """
+    Tent-averaged (IGF) meshes on the grid spanned by the 1D axes zvec and xvec.
+
+    Parameters
+    ----------
+    mesh_func : callable
+        mesh_func(zsub, xsub) returns a tuple of meshes with shape (len(zsub), len(xsub)),
+        such as `lambda z, x: psi_sx_mesh(z, x, beta, 0)`
+
+    zvec, xvec : np.array (1D)
+        Grid axes (in the coordinates of mesh_func)
+
+    dz, dx : float
+        Grid spacings, positive. Needed for axes with a single point.
+
+    order : int
+        Number of Gauss-Legendre nodes per interval and dimension. Default: IGF_ORDER
+
+    block_points : int
+        The x columns are processed in blocks of at most this many point evaluations
+        to bound memory. Default: IGF_BLOCK_POINTS
+
+    Returns
+    -------
+    meshes : tuple of np.arrays with shape (len(zvec), len(xvec))
+
+    """
+    zvec = np.asarray(zvec, dtype=float)
+    xvec = np.asarray(xvec, dtype=float)
+    t, w = gauss_legendre_unit(order)
+
+    zsub = _interval_nodes(zvec, abs(dz), t)
+
+    # Columns per block, at least one
+    block = max(1, block_points // (len(zsub) * order) - 1)
+
+    out = None
+    for j0 in range(0, len(xvec), block):
+        j1 = min(j0 + block, len(xvec))
+        xsub = _interval_nodes(xvec[j0:j1], abs(dx), t)
+        samples = mesh_func(zsub, xsub)
+        if out is None:
+            out = tuple(np.empty((len(zvec), len(xvec))) for _ in samples)
+        for o, s in zip(out, samples):
+            o[:, j0:j1] = _tent_reduce(_tent_reduce(s, t, w, 0), t, w, 1)
+
+    return out
+
+
+def psi_sx_igf_mesh(zvec, xvec, beta, dz, dx, order=IGF_ORDER):
+    """
+    IGF meshes of psi_s and psi_x on the grid spanned by zvec (z/2/rho) and xvec (x/rho),
+    with grid spacings dz and dx in the same units.
+    No half-cell averaging is needed at x = 0, since the nodes never touch it.
+    """
+    return igf_mesh(lambda z, x: psi_sx_mesh(z, x, beta, 0), zvec, xvec, dz, dx, order=order)
@@ -1,6 +1,7 @@
 from csr2d.deposit import split_particles, deposit_particles, histogram_cic_2d
 from csr2d.central_difference import central_difference_z
 from csr2d.core import psi_s, psi_x, psi_x_where_x_equals_zero
+from csr2d.green_cache import mesh_key, cached_meshes
 
 import numpy as np
 
@@ -72,6 +73,12 @@ def csr2d_kick_calc(
     xlim : floats (min, max) or None  
         x grid limits in [m]
         
+    reuse_psi_grids : bool
+        If True, use `psi_s_grid_old` and `psi_x_grid_old` instead of the Green meshes.
+        Not needed for speed: the Green meshes are cached automatically
+        for equal grid spacing, beta and |rho| (see csr2d.green_cache).
+        Default: False
+        
     map_f : map function for creating potential grids.
             Examples:
                 map (default)
@@ -169,18 +176,25 @@ def csr2d_kick_calc(
         #xvec2 = np.linspace(2 * xmin, 2 * xmax, 2 * nx)
         zvec2 = np.arange(-nz,nz,1)*dz # center = 0 is at [nz]
         xvec2 = np.arange(-nx,nx,1)*dx # center = 0 is at [nx]
-        zm2, xm2 = np.meshgrid(zvec2, xvec2, indexing="ij")
 
-        beta_grid = beta * np.ones(zm2.shape)
+        def compute():
+            zm2, xm2 = np.meshgrid(zvec2, xvec2, indexing="ij")
 
-        # Map (possibly parallel)
-        temp = map_f(psi_s, zm2 / 2 / rho, xm2 / rho, beta_grid)
-        psi_s_grid = np.array(list(temp))
-        temp2 = map_f(psi_x, zm2 / 2 / rho, xm2 / rho, beta_grid)
-        psi_x_grid = np.array(list(temp2))
+            beta_grid = beta * np.ones(zm2.shape)
+
+            # Map (possibly parallel)
+            temp = map_f(psi_s, zm2 / 2 / rho, xm2 / rho, beta_grid)
+            psi_s_grid = np.array(list(temp))
+            temp2 = map_f(psi_x, zm2 / 2 / rho, xm2 / rho, beta_grid)
+            psi_x_grid = np.array(list(temp2))
         
-        # Replacing the fake zeros along the x_axis ( due to singularity) with averaged value from the nearby grid
-        psi_x_grid[:,nx] = psi_x_where_x_equals_zero(zvec2, dx/rho, beta)
+            # Replacing the fake zeros along the x_axis ( due to singularity) with averaged value from the nearby grid
+            psi_x_grid[:,nx] = psi_x_where_x_equals_zero(zvec2, dx/rho, beta)
+            return psi_s_grid, psi_x_grid
+
+        # rho is positive here, so chicane bends of equal |rho| share meshes
+        key = mesh_key('legacy_psi_sx', nz, nx, dz, dx, rho, beta=beta)
+        psi_s_grid, psi_x_grid = cached_meshes(key, compute)
 
     if debug:
         t4 = time.time()
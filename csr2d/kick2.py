@@ -1,7 +1,17 @@
-from csr2d.deposit import histogram_cic_2d
+from csr2d.deposit import ParticleCells, histogram_cic_2d_cells
 from csr2d.central_difference import central_difference_z
-from csr2d.core2 import psi_sx, psi_s, psi_x0, Es_case_B0, Es_case_A, Fx_case_A, Es_case_C, Fx_case_C, Es_case_D
-from csr2d.convolution import fftconvolve2
+from csr2d.density import density_grids, z_filter_taps
+from csr2d.core2 import psi_sx, psi_sx0, psi_s, psi_x0, Es_case_B0, Es_case_A, Fx_case_A, Es_case_C, Fx_case_C, Es_case_D
+from csr2d.core2 import psi_sx_mesh, case_A_mesh, Es_case_B0_mesh, case_C_mesh, Es_case_D_mesh
+from csr2d.convolution import fftconvolve2, green_spectrum, GreenSpectrum
+from csr2d.gather import gather_2d_cells, spline_coefficients
+from csr2d.green_cache import mesh_key, cached_meshes
+from csr2d.igf import psi_sx_igf_mesh, IGF_ORDER
+from csr2d.profiling import profiled_call
+from csr2d.parallel import row_block_meshes
+from csr2d.grid import plan_grid, ChunkMoments, GRID_METHODS
+
+from functools import partial
 
 import numpy as np
 
@@ -38,13 +48,27 @@ def csr2d_kick_calc(
     psi_x_grid_old=None,
     map_f=map,
     species="electron",
-    imethod='map_coordinates',
+    imethod='gather',
+    iorder=2,
+    igf=False,
+    igf_order=IGF_ORDER,
+    spectral=False,
+    smoothing='savgol',
+    smoothing_sigma=2.0,
+    dtype=np.float64,
+    grid_method='minmax',
+    grid_quantile=1e-4,
+    grid_sigma=5.0,
+    outliers='far_field',
+    profiler=None,
     debug=False,
 ):
     """
     
     Calculates the 2D CSR kick on a set of particles with positions `z_b`, `x_b` and charges `charges`.
     
+    For repeated calls in a tracking loop, use CSRKickEngine, which keeps its work buffers.
+    
     
     Parameters
     ----------
@@ -77,21 +101,72 @@ def csr2d_kick_calc(
     xlim : floats (min, max) or None  
         x grid limits in [m]
         
+    reuse_psi_grids : bool
+        If True, use `psi_s_grid_old` and `psi_x_grid_old` instead of the Green meshes.
+        Not needed for speed: the Green meshes are cached automatically
+        for equal grid spacing, beta and |rho| (see csr2d.green_cache).
+        Default: False
+        
     map_f : map function for creating potential grids.
+            The Green meshes are evaluated in blocks of z rows with it,
+            see csr2d.parallel.row_block_meshes. An Executor can also be given.
             Examples:
-                map (default)
+                map (default: one call of the parallel Numba kernel)
                 executor.map
+                csr2d.parallel.get_executor('thread')
     
     species : str
         Particle species. Currently required to be 'electron'
         
     imethod : str
         Interpolation method for kicks. Must be one of:
-            'map_coordinates' (default): uses  scipy.ndimage.map_coordinates 
+            'gather' (default): uses csr2d.gather.gather_2d_cells, both kicks in one parallel pass
+            'map_coordinates': uses  scipy.ndimage.map_coordinates 
             'spline': uses: scipy.interpolate.RectBivariateSpline
+            
+    iorder : int
+        Interpolation order for imethod='gather':
+            1: bilinear, with the same weights as the CIC deposition
+            2 (default), 3: quadratic, cubic B-splines, same as 'map_coordinates' with that order
+    
+    igf : bool
+        If True, use integrated Green function meshes (see csr2d.igf),
+        which reach the same accuracy on coarser grids.
+        Default: False
+        
+    igf_order : int
+        Number of Gauss-Legendre nodes per cell and dimension for igf=True.
+        Default: csr2d.igf.IGF_ORDER
+        
+    spectral : bool
+        If True, the density smoothing and d/dz are applied in Fourier space,
+        as a transfer function cached with the Green function spectra
+        (see csr2d.density.z_filter_taps). The density is then treated as zero
+        outside of the grid, instead of using one-sided formulas at the grid edges.
+        Default: False
+        
+    smoothing : str
+        Density smoothing for spectral=True. Must be one of:
+            'savgol' (default): Savitzky-Golay filter with window 13 and order 2
+            'gaussian': Gaussian filter with standard deviation `smoothing_sigma` grid cells
+            
+    smoothing_sigma : float
+        See `smoothing`. Default: 2.0
+        
+    dtype : np.float64 or np.float32
+        Precision of the grids and FFTs, see CSRKickEngine. Default: np.float64
+        
+    grid_method, grid_quantile, grid_sigma, outliers :
+        Grid bounds from the distribution when zlim or xlim is not given, and the
+        kicks of the particles outside, see CSRKickEngine and csr2d.grid.plan_grid.
+        Default: 'minmax' (the particle extent)
+        
+    profiler : csr2d.profiling.Profiler, optional
+        Receives a record with the time spent in each stage
+        (deposit, filter, green, convolution, gather)
     
     debug: bool
-        If True, returns the computational grids. 
+        If True, returns the computational grids, the stage times and the profile record. 
         Default: False
         
               
@@ -105,126 +180,775 @@ def csr2d_kick_calc(
         dxp_ds : np.array
             relative x momentum kick [1/m]
     """
-    assert species == "electron", "TODO: support species {species}"
-    # assert np.sign(rho) == 1, 'TODO: negative rho'
-
-    # Grid setup
-    if zlim:
-        zmin = zlim[0]
-        zmax = zlim[1]
-    else:
-        zmin = z_b.min()
-        zmax = z_b.max()
-
-    if xlim:
-        xmin = xlim[0]
-        xmax = xlim[1]
-    else:
-        xmin = x_b.min()
-        xmax = x_b.max()
-
-    dz = (zmax - zmin) / (nz - 1)
-    dx = (xmax - xmin) / (nx - 1)
-
-    # Charge deposition
-    t1 = time.time()
-    charge_grid = histogram_cic_2d(z_b, x_b, weight, nz, zmin, zmax, nx, xmin, xmax)
-
-    if debug:
-        t2 = time.time()
-        print("Depositing particles takes:", t2 - t1, "s")
-
-    # Normalize the grid so its integral is unity
-    norm = np.sum(charge_grid) * dz * dx
-    lambda_grid = charge_grid / norm
-
-    # Apply savgol filter
-    lambda_grid_filtered = np.array([savgol_filter(lambda_grid[:, i], 13, 2) for i in np.arange(nx)]).T
-
-    # Differentiation in z
-    lambda_grid_filtered_prime = central_difference_z(lambda_grid_filtered, nz, nx, dz, order=1)
-
-    # Grid axis vectors
-    zvec = np.linspace(zmin, zmax, nz)
-    xvec = np.linspace(xmin, xmax, nx)
-
-    beta = np.sqrt(1 - 1 / gamma ** 2)
-
-    t3 = time.time()
-
-    if reuse_psi_grids == True:
-        psi_s_grid = psi_s_grid_old
-        psi_x_grid = psi_x_grid_old
-
-    else:
-        # Creating the potential grids        
-        psi_s_grid, psi_x_grid, zvec2, xvec2 = green_meshes(nz, nx, dz, dx, rho=rho, beta=beta)  
-    
-    if debug:
-        t4 = time.time()
-        print("Computing potential grids take:", t4 - t3, "s")
-
-    # Compute the wake via 2d convolution
-    conv_s, conv_x = fftconvolve2(lambda_grid_filtered_prime, psi_s_grid, psi_x_grid)
-
-    if debug:
-        t5 = time.time()
-        print("Convolution takes:", t5 - t4, "s")
-
-    Ws_grid = (beta ** 2 / abs(rho)) * (conv_s) * (dz * dx)
-    Wx_grid = (beta ** 2 / abs(rho)) * (conv_x) * (dz * dx)
-
-    # Calculate the kicks at the particle locations
-    
-    # Overall factor
-    Nb = np.sum(weight) / e_charge
-    kick_factor = r_e * Nb / gamma  # m
-        
-    # Interpolate Ws and Wx everywhere within the grid
-    if imethod == 'spline':
-        # RectBivariateSpline method
-        Ws_interp = RectBivariateSpline(zvec, xvec, Ws_grid)
-        Wx_interp = RectBivariateSpline(zvec, xvec, Wx_grid)
-        delta_kick = kick_factor * Ws_interp.ev(z_b, x_b)
-        xp_kick = kick_factor * Wx_interp.ev(z_b, x_b)
-    elif imethod == 'map_coordinates':
-        # map_coordinates method. Should match above fairly well. order=1 is even faster.
-        zcoord = (z_b-zmin)/dz
-        xcoord = (x_b-xmin)/dx
-        delta_kick = kick_factor * map_coordinates(Ws_grid, np.array([zcoord, xcoord]), order=2)
-        xp_kick    = kick_factor * map_coordinates(Wx_grid, np.array([zcoord, xcoord]), order=2)    
-    else:
-        raise ValueError(f'Unknown interpolation method: {imethod}')
+    engine = CSRKickEngine(
+        gamma=gamma,
+        rho=rho,
+        nz=nz,
+        nx=nx,
+        xlim=xlim,
+        zlim=zlim,
+        psi_grids=(psi_s_grid_old, psi_x_grid_old) if reuse_psi_grids else None,
+        species=species,
+        imethod=imethod,
+        iorder=iorder,
+        igf=igf,
+        igf_order=igf_order,
+        spectral=spectral,
+        smoothing=smoothing,
+        smoothing_sigma=smoothing_sigma,
+        executor=None if map_f is map else map_f,
+        dtype=dtype,
+        grid_method=grid_method,
+        grid_quantile=grid_quantile,
+        grid_sigma=grid_sigma,
+        outliers=outliers,
+        profiler=profiler,
+    )
+    return engine.kick(z_b, x_b, weight, debug=debug)
+
+
+def csr2d_kick_batch_calc(z_b, x_b, weight, *, gamma=None, rho=None, nz=100, nx=100, xlim=None, zlim=None, **kwargs):
+    """
+    2D CSR kicks of B independent bunches on a common grid, sharing one Green function spectrum.
+    See CSRKickEngine.kick_batch. Other keyword arguments are passed to CSRKickEngine.
     
-    if debug:
-        t6 = time.time()
-        print(f'Interpolation with {imethod} takes:', t6 - t5, "s")        
-
+    Returns
+    -------
+    dict with ddelta_ds and dxp_ds, each a list of B np.arrays
+    (an np.array with shape (B, n) for array input)
+    """
+    engine = CSRKickEngine(gamma=gamma, rho=rho, nz=nz, nx=nx, xlim=xlim, zlim=zlim, **kwargs)
+    return engine.kick_batch(z_b, x_b, weight)
 
-    result = {"ddelta_ds": delta_kick, "dxp_ds": xp_kick}
 
-    if debug:
-        timing = np.array([t2-t1, t4-t3, t5-t4, t6-t5])
-        result.update(
-            {
-                "zvec": zvec,
-                "xvec": xvec,
-                "zvec2": zvec2,
-                "xvec2": xvec2,
-                "Ws_grid": Ws_grid,
-                "Wx_grid": Wx_grid,
-                "psi_s_grid": psi_s_grid,
-                "psi_x_grid": psi_x_grid,
-                "charge_grid": charge_grid,
-                "lambda_grid_filtered_prime": lambda_grid_filtered_prime,
-                "timing": timing
-            }
-        )
+def compare_precision(z_b, x_b, weight, *, n_repeat=3, **kwargs):
+    """
+    Report of the float32 mode of CSRKickEngine against float64 for one bunch.
+    Keyword arguments (gamma, rho, nz, nx, ...) are passed to CSRKickEngine.
+    
+    Returns
+    -------
+    dict with:
+    
+        ddelta_ds, dxp_ds : dict
+            max_abs_error, max_rel_error (relative to the largest float64 kick) and rms_rel_error
+            
+        Ws_grid, Wx_grid : float
+            Largest wake difference relative to the largest float64 wake
+            
+        time_float64, time_float32 : float
+            Fastest of n_repeat kicks, after a first call that builds the Green spectrum [s]
+            
+        nbytes_float64, nbytes_float32 : int
+            Memory of the work grids and the Green spectrum [bytes]
+    
+    """
+    engines = {}
+    kicks = {}
+    report = {}
+    for name, dtype in (('float64', np.float64), ('float32', np.float32)):
+        engine = CSRKickEngine(dtype=dtype, **kwargs)
+        kicks[name] = engine.kick(z_b, x_b, weight)
+        times = []
+        for _ in range(n_repeat):
+            t1 = time.perf_counter()
+            engine.kick(z_b, x_b, weight)
+            times.append(time.perf_counter() - t1)
+        engines[name] = engine
+        report['time_' + name] = min(times)
+        report['nbytes_' + name] = engine.nbytes
+        
+    for key in ('ddelta_ds', 'dxp_ds'):
+        ref = kicks['float64'][key]
+        diff = kicks['float32'][key] - ref
+        scale = np.abs(ref).max()
+        report[key] = {
+            'max_abs_error': np.abs(diff).max(),
+            'max_rel_error': np.abs(diff).max() / scale,
+            'rms_rel_error': np.sqrt(np.mean(diff**2)) / scale,
+        }
+    for key in ('Ws_grid', 'Wx_grid'):
+        ref = getattr(engines['float64'], key)
+        report[key] = np.abs(getattr(engines['float32'], key) - ref).max() / np.abs(ref).max()
+        
+    return report
 
-    return result
 
+class CSRKickEngine:
+    """
+    2D CSR kick calculation for repeated use in a tracking loop.
+    
+    The engine owns the work grids (charge, density, wake, spline coefficients)
+    and the particle cell arrays, and keeps the Green function spectrum of the
+    last grid spacing, so that a `kick` call only allocates the FFT outputs.
+    
+    Parameters
+    ----------
+    gamma, rho, nz, nx, xlim, zlim, species, imethod, iorder, igf, igf_order, spectral, smoothing, smoothing_sigma :
+        See `csr2d_kick_calc`
+        
+    psi_grids : tuple of two np.arrays, optional
+        psi_s and psi_x grids to use instead of the Green meshes,
+        as `reuse_psi_grids` in `csr2d_kick_calc`
+        
+    workers : int or None
+        Number of threads for the FFTs. Default: None (scipy.fft default)
+        
+    executor : concurrent.futures.Executor or map function, optional
+        Evaluates the Green meshes in blocks of z rows, see csr2d.parallel.
+        A persistent pool from csr2d.parallel.get_executor is reused across calls.
+        Default: None (the parallel Numba kernels alone)
+        
+    dtype : np.float64 or np.float32
+        Precision of the density, wake and spline grids and of the FFTs (complex64 for np.float32).
+        The charge is deposited in float64, normalizations and the gather sums are in float64,
+        and the kicks are returned as float64. np.float32 halves the memory and bandwidth
+        of the large FFT buffers, at ~1e-6 relative accuracy of the wake (see `compare_precision`).
+        Default: np.float64
+        
+    grid_method : str
+        Grid bounds when zlim or xlim is not given, see csr2d.grid.plan_grid:
+        'minmax': the particle extent (as csr2d_kick_calc)
+        'quantile': weighted quantiles grid_quantile and 1-grid_quantile
+        'sigma': mean +/- grid_sigma standard deviations
+        With 'quantile' and 'sigma', the result has the GridPlan as 'grid',
+        with the clipped charge fraction. Default: 'minmax'
+        
+    grid_quantile, grid_sigma : float
+        See grid_method. Default: 1e-4, 5.0
+        
+    outliers : str
+        Kicks of the particles outside of a planned grid (grid_method 'quantile' or 'sigma'):
+        'far_field': ddelta_ds from the 1D steady-state wake of the whole bunch, dxp_ds = 0
+        'zero': no kick, as outside of zlim/xlim
+        Default: 'far_field'
+        
+    profiler : csr2d.profiling.Profiler, optional
+        Receives a record with the stage times of every kick
+        
+    Example
+    -------
+        engine = CSRKickEngine(gamma=gamma, rho=rho, nz=100, nx=100)
+        out = (np.empty(n), np.empty(n))
+        for step in range(n_steps):
+            ...
+            engine.kick(z_b, x_b, weight, out=out)
+    
+    """
+    def __init__(
+        self,
+        *,
+        gamma=None,
+        rho=None,
+        nz=100,
+        nx=100,
+        xlim=None,
+        zlim=None,
+        psi_grids=None,
+        species="electron",
+        imethod='gather',
+        iorder=2,
+        igf=False,
+        igf_order=IGF_ORDER,
+        spectral=False,
+        smoothing='savgol',
+        smoothing_sigma=2.0,
+        workers=None,
+        executor=None,
+        dtype=np.float64,
+        grid_method='minmax',
+        grid_quantile=1e-4,
+        grid_sigma=5.0,
+        outliers='far_field',
+        profiler=None,
+    ):
+        assert species == "electron", f"TODO: support species {species}"
+        if imethod not in ('gather', 'map_coordinates', 'spline'):
+            raise ValueError(f'Unknown interpolation method: {imethod}')
+        if grid_method not in GRID_METHODS:
+            raise ValueError(f'Unknown grid method: {grid_method}, must be one of {GRID_METHODS}')
+        if outliers not in ('far_field', 'zero'):
+            raise ValueError(f'Unknown outlier treatment: {outliers}')
+        
+        self.gamma = gamma
+        self.rho = rho
+        self.beta = np.sqrt(1 - 1 / gamma ** 2)
+        self.nz = nz
+        self.nx = nx
+        self.xlim = xlim
+        self.zlim = zlim
+        self.psi_grids = psi_grids
+        self.imethod = imethod
+        self.iorder = iorder
+        self.igf = igf
+        self.igf_order = igf_order
+        self.spectral = spectral
+        self.workers = workers
+        self.executor = executor
+        self.dtype = np.dtype(dtype)
+        self.grid_method = grid_method
+        self.grid_quantile = grid_quantile
+        self.grid_sigma = grid_sigma
+        self.outliers = outliers
+        self.grid_plan = None
+        self.profiler = profiler
+        
+        # Smoothing and d/dz as part of the Green function spectra
+        self.z_taps = z_filter_taps(smoothing, window=13, polyorder=2, sigma=smoothing_sigma) if spectral else None
+        
+        # Work grids
+        shape = (nz, nx)
+        # The charge is summed in float64 for charge conservation
+        self.charge_grid = np.zeros(shape)
+        self.lambda_grid_filtered = np.empty(shape, dtype=self.dtype)
+        self.lambda_grid_filtered_prime = np.empty(shape, dtype=self.dtype)
+        self.Ws_grid = np.empty(shape, dtype=self.dtype)
+        self.Wx_grid = np.empty(shape, dtype=self.dtype)
+        self._coefficients = (np.empty(shape, dtype=self.dtype), np.empty(shape, dtype=self.dtype))
+        
+        self._cells = None
+        self._batch = None
+        self._spectrum = None
+        self._spectrum_spacing = None
+        
+    @property
+    def nbytes(self):
+        """
+        Memory of the work grids and the Green function spectrum [bytes]
+        """
+        grids = (self.charge_grid, self.lambda_grid_filtered, self.lambda_grid_filtered_prime,
+                 self.Ws_grid, self.Wx_grid) + self._coefficients
+        n = sum(grid.nbytes for grid in grids)
+        if self._spectrum is not None:
+            n += sum(spectrum.nbytes for spectrum in self._spectrum.spectra)
+        return n
+        
+    def grid_limits(self, z_b, x_b, weight=None):
+        """
+        (zmin, zmax, xmin, xmax) from zlim, xlim or the particle distribution (see grid_method).
+        For grid_method other than 'minmax', the csr2d.grid.GridPlan is kept as grid_plan.
+        """
+        if self.grid_method != 'minmax':
+            self.grid_plan = plan_grid(z_b, x_b, weight, method=self.grid_method, quantile=self.grid_quantile,
+                                       n_sigma=self.grid_sigma, zlim=self.zlim or None, xlim=self.xlim or None)
+            return self.grid_plan.zlim + self.grid_plan.xlim
+        
+        if self.zlim:
+            zmin, zmax = self.zlim
+        else:
+            zmin = z_b.min()
+            zmax = z_b.max()
+        if self.xlim:
+            xmin, xmax = self.xlim
+        else:
+            xmin = x_b.min()
+            xmax = x_b.max()
+        return zmin, zmax, xmin, xmax
+        
+    def spectrum(self, dz, dx):
+        """
+        GreenSpectrum of psi_s and psi_x for grid spacing dz, dx.
+        The last one is kept, in front of the module-level Green mesh cache.
+        """
+        if self._spectrum_spacing == (dz, dx):
+            return self._spectrum
+        
+        if self.psi_grids is not None:
+            spectrum = green_spectrum(*self.psi_grids, z_taps=self.z_taps, workers=self.workers, dtype=self.dtype)
+        else:
+            spectrum = green_meshes_spectrum(self.nz, self.nx, dz, dx, rho=self.rho, beta=self.beta,
+                                             igf=self.igf, igf_order=self.igf_order, z_taps=self.z_taps,
+                                             executor=self.executor, dtype=self.dtype)
+        self._spectrum = spectrum
+        self._spectrum_spacing = (dz, dx)
+        return spectrum
+        
+    def kick(self, z_b, x_b, weight, out=None, debug=False):
+        """
+        Calculates the 2D CSR kick, see `csr2d_kick_calc`.
+        
+        Parameters
+        ----------
+        z_b, x_b, weight : np.array
+            Bunch coordinates [m] and weights [C]
+            
+        out : tuple of two np.arrays, optional
+            Arrays with the size of z_b to store ddelta_ds and dxp_ds in
+            
+        debug : bool
+            If True, also returns the computational grids (as copies),
+            the stage times [deposit, green, convolution, gather] in s as 'timing',
+            and the csr2d.profiling.CallRecord as 'profile'.
+            Default: False
+            
+        Returns
+        -------
+        dict with ddelta_ds and dxp_ds, see `csr2d_kick_calc`
+        
+        """
+        with profiled_call(self.profiler, 'csr2d_kick', n_particles=len(z_b)) as record:
+            result = self._kick(z_b, x_b, weight, out, debug, record)
+        if debug:
+            result["timing"] = record.seconds('deposit', 'green', 'convolution', 'gather')
+            result["profile"] = record
+        return result
+        
+    def kick_batch(self, z_b, x_b, weight, out=None):
+        """
+        2D CSR kicks of B independent bunches on one common grid.
+        
+        The bunches are deposited into a (B, nz, nx) stack, which is convolved
+        with the (single) Green function spectrum in one batched FFT.
+        
+        Parameters
+        ----------
+        z_b, x_b, weight : sequences of B np.arrays, or np.arrays with shape (B, n)
+            Bunch coordinates [m] and weights [C]. The bunches can have different sizes.
+            
+        out : tuple of two sequences of B np.arrays (or np.arrays with shape (B, n)), optional
+            To store ddelta_ds and dxp_ds in
+            
+        The grid spans zlim, xlim, or otherwise all of the bunches. With grid_method
+        'quantile' or 'sigma', it spans the planned grids of all bunches, and the particles
+        of each bunch outside of it are treated as set by outliers.
+        The (B, nz, nx) work grids are kept between calls with the same B.
+        Memory for the FFTs scales with B; split very large batches.
+        
+        Returns
+        -------
+        dict with:
+        
+            ddelta_ds : list of np.arrays (np.array with shape (B, n) for array input)
+            
+            dxp_ds : list of np.arrays (np.array with shape (B, n) for array input)
+            
+            grid : list of B csr2d.grid.GridPlan, for grid_method 'quantile' or 'sigma'
+            
+        """
+        n_bunch = len(z_b)
+        assert len(x_b) == n_bunch and len(weight) == n_bunch, 'z_b, x_b and weight must have the same number of bunches'
+        with profiled_call(self.profiler, 'csr2d_kick_batch', n_bunches=n_bunch,
+                           n_particles=sum(len(z) for z in z_b)) as record:
+            return self._kick_batch(z_b, x_b, weight, out, record)
+        
+    def _kick_batch(self, z_b, x_b, weight, out, record):
+        nz, nx = self.nz, self.nx
+        rho, beta = self.rho, self.beta
+        n_bunch = len(z_b)
+        
+        # Common grid
+        plans = None
+        if self.grid_method != 'minmax':
+            # Spanning the planned grids of all bunches
+            plans = [plan_grid(z_b[b], x_b[b], weight[b], method=self.grid_method, quantile=self.grid_quantile,
+                               n_sigma=self.grid_sigma, zlim=self.zlim or None, xlim=self.xlim or None)
+                     for b in range(n_bunch)]
+            zmin, zmax = min(plan.zlim[0] for plan in plans), max(plan.zlim[1] for plan in plans)
+            xmin, xmax = min(plan.xlim[0] for plan in plans), max(plan.xlim[1] for plan in plans)
+            # The particles of each bunch outside of the common grid
+            plans = [plan_grid(z_b[b], x_b[b], weight[b], method=self.grid_method, zlim=(zmin, zmax),
+                               xlim=(xmin, xmax)) for b in range(n_bunch)]
+        else:
+            zmin = self.zlim[0] if self.zlim else min(z.min() for z in z_b)
+            zmax = self.zlim[1] if self.zlim else max(z.max() for z in z_b)
+            xmin = self.xlim[0] if self.xlim else min(x.min() for x in x_b)
+            xmax = self.xlim[1] if self.xlim else max(x.max() for x in x_b)
+        dz = (zmax - zmin) / (nz - 1)
+        dx = (xmax - xmin) / (nx - 1)
+        
+        if self._batch is None or self._batch['charge_grid'].shape[0] != n_bunch:
+            shape = (n_bunch, nz, nx)
+            self._batch = {name: np.empty(shape, dtype=self.dtype) for name in ('density', 'Ws_grid', 'Wx_grid')}
+            self._batch['charge_grid'] = np.empty(shape)
+            self._batch['cells'] = [None] * n_bunch
+        batch = self._batch
+        cells = batch['cells']
+        
+        # Charge deposition
+        with record.stage('deposit'):
+            for b in range(n_bunch):
+                if cells[b] is None or len(cells[b]) != len(z_b[b]):
+                    cells[b] = ParticleCells(z_b[b], x_b[b], nz, zmin, zmax, nx, xmin, xmax)
+                else:
+                    cells[b].update(z_b[b], x_b[b], zmin, zmax, xmin, xmax)
+                histogram_cic_2d_cells(cells[b], weight[b], out=batch['charge_grid'][b])
+            
+        with record.stage('filter'):
+            charge_grid = batch['charge_grid']
+            if self.spectral:
+                density_scale = 1 / (charge_grid.sum(axis=(1, 2)) * dz * dx * dz)
+                density = charge_grid
+                if self.dtype != charge_grid.dtype:
+                    density = batch['density']
+                    density[...] = charge_grid
+            else:
+                for b in range(n_bunch):
+                    density_grids(charge_grid[b], dz, dx, window=13, polyorder=2, order=1,
+                                  out=(self.lambda_grid_filtered, batch['density'][b]))
+                density_scale = np.ones(n_bunch)
+                density = batch['density']
+            
+        with record.stage('green'):
+            spectrum = self.spectrum(dz, dx)
+            
+        # One batched FFT for all bunches
+        with record.stage('convolution'):
+            Ws_grid, Wx_grid = fftconvolve2(density, spectrum, workers=self.workers, out=(batch['Ws_grid'], batch['Wx_grid']))
+            scale = ((beta ** 2 / abs(rho)) * (dz * dx) * density_scale)[:, None, None]
+            Ws_grid *= scale
+            Wx_grid *= scale
+            
+        zvec = np.linspace(zmin, zmax, nz)
+        xvec = np.linspace(xmin, xmax, nx)
+        
+        if out is None:
+            if isinstance(z_b, np.ndarray) and z_b.ndim == 2:
+                out = (np.empty(z_b.shape), np.empty(z_b.shape))
+            else:
+                out = ([np.empty(len(z)) for z in z_b], [np.empty(len(z)) for z in z_b])
+                
+        kick_factors = [r_e * (np.sum(weight[b]) / e_charge) / self.gamma for b in range(n_bunch)]
+        with record.stage('gather'):
+            for b in range(n_bunch):
+                grid_kick_factor = self._grid_kick_factor(z_b[b], x_b[b], weight[b], None if plans is None else plans[b],
+                                                          kick_factors[b])
+                self._interpolate(z_b[b], x_b[b], cells[b], Ws_grid[b], Wx_grid[b], zvec, xvec, grid_kick_factor,
+                                  (out[0][b], out[1][b]))
+                
+        result = {"ddelta_ds": out[0], "dxp_ds": out[1]}
+        
+        if plans is not None:
+            record.info['clipped_fraction'] = [plan.clipped_fraction for plan in plans]
+            result["grid"] = plans
+            if self.outliers == 'far_field':
+                with record.stage('outliers'):
+                    for b, plan in enumerate(plans):
+                        if plan.n_clipped:
+                            self._far_field_kick(z_b[b], x_b[b], weight[b], plan, kick_factors[b],
+                                                 out[0][b], out[1][b])
+                
+        return result
+        
+    def kick_chunks(self, chunks):
+        """
+        2D CSR kick of a bunch given in chunks, with memory bounded by the chunk size.
+        
+        The charge grid is accumulated chunk by chunk, the wake is computed once,
+        and the kicks are then computed chunk by chunk.
+        
+        Parameters
+        ----------
+        chunks : callable returning an iterable of (z, x, weight) np.arrays, or a re-iterable (such as a list)
+            The chunks are read twice (three times if zlim or xlim is not set,
+            or for grid_method 'sigma', to find the grid limits), and must be the same each time.
+            grid_method 'quantile' needs all particles at once and raises ValueError.
+            For grid_method 'sigma', the GridPlan is kept as grid_plan, and the outliers
+            get the kicks set by outliers.
+            
+        Yields
+        ------
+        (ddelta_ds, dxp_ds) for each chunk, in order.
+        The deposition and wake are done at the first iteration.
+        
+        Example
+        -------
+            def chunks():
+                for i in range(0, n, chunk_size):
+                    yield z[i:i+chunk_size], x[i:i+chunk_size], w[i:i+chunk_size]
+                    
+            for ddelta_ds, dxp_ds in engine.kick_chunks(chunks):
+                ...
+        
+        """
+        if self.grid_method == 'quantile':
+            raise ValueError("grid_method 'quantile' needs all particles at once, use 'sigma' for chunks")
+        read = chunks if callable(chunks) else lambda: iter(chunks)
+        nz, nx = self.nz, self.nx
+        
+        with profiled_call(self.profiler, 'csr2d_kick_chunks') as record:
+            
+            # Grid setup
+            plan = None
+            if self.grid_method != 'minmax':
+                # Planned from the moments of all chunks, see csr2d.grid.ChunkMoments
+                moments = ChunkMoments()
+                for z, x, w in read():
+                    moments.add(z, x, w)
+                plan = moments.plan(method=self.grid_method, n_sigma=self.grid_sigma,
+                                    zlim=self.zlim or None, xlim=self.xlim or None)
+                zmin, zmax = plan.zlim
+                xmin, xmax = plan.xlim
+            elif self.zlim and self.xlim:
+                zmin, zmax = self.zlim
+                xmin, xmax = self.xlim
+            else:
+                zmin = xmin = np.inf
+                zmax = xmax = -np.inf
+                for z, x, _ in read():
+                    zmin, zmax = min(zmin, z.min()), max(zmax, z.max())
+                    xmin, xmax = min(xmin, x.min()), max(xmax, x.max())
+                if self.zlim:
+                    zmin, zmax = self.zlim
+                if self.xlim:
+                    xmin, xmax = self.xlim
+            dz = (zmax - zmin) / (nz - 1)
+            dx = (xmax - xmin) / (nx - 1)
+            
+            # Charge deposition, accumulated over the chunks
+            total_weight = 0.0
+            clipped_weight = 0.0
+            n_particles = 0
+            far_field = plan is not None and self.outliers == 'far_field'
+            if far_field:
+                # z histogram of the whole bunch, for the 1D wake of the outliers
+                z_histogram = np.zeros(nz)
+            with record.stage('deposit'):
+                self.charge_grid[:] = 0
+                for z, x, w in read():
+                    cells = self._chunk_cells(z, x, zmin, zmax, xmin, xmax)
+                    histogram_cic_2d_cells(cells, w, out=self.charge_grid, accumulate=True)
+                    total_weight += np.sum(w)
+                    n_particles += len(z)
+                    if plan is not None:
+                        outside = ~plan.inside(z, x)
+                        plan.n_clipped += int(np.count_nonzero(outside))
+                        clipped_weight += np.sum(w[outside])
+                    if far_field:
+                        z_histogram += np.histogram(z, weights=w, bins=nz, range=(moments.qmin[0], moments.qmax[0]))[0]
+            record.info['n_particles'] = n_particles
+            if plan is not None:
+                plan.clipped_fraction = float(clipped_weight / total_weight) if plan.n_clipped else 0.0
+                record.info['clipped_fraction'] = plan.clipped_fraction
+                self.grid_plan = plan
+            
+            Ws_grid, Wx_grid = self._wake(dz, dx, record)
+            
+            kick_factor = r_e * (total_weight / e_charge) / self.gamma
+            # The density on a planned grid is normalized to the charge inside of it
+            grid_kick_factor = r_e * ((total_weight - clipped_weight) / e_charge) / self.gamma
+            zvec = np.linspace(zmin, zmax, nz)
+            xvec = np.linspace(xmin, xmax, nx)
+            coefficients = self._spline_coefficients(Ws_grid, Wx_grid) if self.imethod == 'gather' else None
+            if far_field and plan.n_clipped:
+                wake_1d = csr1d_steady_state_wake(z_histogram, moments.qmin[0], moments.qmax[0], total_weight,
+                                                  rho=abs(self.rho), normalized_units=True)
+            
+            for z, x, _ in read():
+                with record.stage('gather'):
+                    cells = self._chunk_cells(z, x, zmin, zmax, xmin, xmax)
+                    kicks = self._interpolate(z, x, cells, Ws_grid, Wx_grid, zvec, xvec, grid_kick_factor, None,
+                                              coefficients=coefficients)
+                if far_field and plan.n_clipped:
+                    with record.stage('outliers'):
+                        # As _far_field_kick, with the wake of the whole bunch
+                        outside = ~plan.inside(z, x)
+                        kicks[0][outside] = kick_factor * np.interp(z[outside], *wake_1d)
+                        kicks[1][outside] = 0
+                yield kicks
+                
+    def kick_stream(self, z_b, x_b, weight, out=None, chunk_size=2**20):
+        """
+        2D CSR kick with the particles read in chunks of chunk_size, see `kick_chunks`.
+        
+        z_b, x_b, weight and the out arrays can be np.memmap arrays,
+        so that bunches larger than the available memory can be used.
+        
+        Returns
+        -------
+        dict with ddelta_ds and dxp_ds, see `csr2d_kick_calc`
+        
+        """
+        n = len(z_b)
+        if out is None:
+            out = (np.empty(n), np.empty(n))
+            
+        def chunks():
+            for i in range(0, n, chunk_size):
+                yield (np.asarray(z_b[i:i+chunk_size]), np.asarray(x_b[i:i+chunk_size]),
+                       np.asarray(weight[i:i+chunk_size]))
+                
+        for i, (delta_kick, xp_kick) in zip(range(0, n, chunk_size), self.kick_chunks(chunks)):
+            out[0][i:i+chunk_size] = delta_kick
+            out[1][i:i+chunk_size] = xp_kick
+            
+        result = {"ddelta_ds": out[0], "dxp_ds": out[1]}
+        if self.grid_method != 'minmax':
+            result["grid"] = self.grid_plan
+        return result
+        
+    def _chunk_cells(self, z, x, zmin, zmax, xmin, xmax):
+        """
+        ParticleCells of a chunk, reusing the arrays of the previous chunk of the same size.
+        """
+        if self._cells is None or len(self._cells) != len(z):
+            self._cells = ParticleCells(z, x, self.nz, zmin, zmax, self.nx, xmin, xmax)
+        else:
+            self._cells.update(z, x, zmin, zmax, xmin, xmax)
+        return self._cells
+        
+    def _grid_kick_factor(self, z_b, x_b, weight, plan, kick_factor):
+        """
+        kick_factor for the wake on a planned grid, which is normalized to the charge inside of the grid.
+        """
+        if plan is None or not plan.n_clipped:
+            return kick_factor
+        return kick_factor * np.sum(weight[plan.inside(z_b, x_b)]) / np.sum(weight)
+        
+    def _far_field_kick(self, z_b, x_b, weight, plan, kick_factor, delta_kick, xp_kick):
+        """
+        Kicks of the particles outside of the grid from the 1D steady-state wake of the whole bunch.
+        The x kick of these is set to zero.
+        """
+        outside = ~plan.inside(z_b, x_b)
+        wake = csr1d_steady_state_kick_calc(z_b, weight, nz=self.nz, rho=abs(self.rho), normalized_units=True,
+                                            z_eval=z_b[outside])
+        delta_kick[outside] = kick_factor * wake["denergy_ds"]
+        xp_kick[outside] = 0
+        
+    def _spline_coefficients(self, Ws_grid, Wx_grid):
+        return tuple(spline_coefficients(grid, self.iorder, out=c) for grid, c in zip((Ws_grid, Wx_grid), self._coefficients))
+        
+    def _interpolate(self, z_b, x_b, cells, Ws_grid, Wx_grid, zvec, xvec, kick_factor, out, coefficients=None):
+        """
+        kick_factor * (Ws, Wx) at the particles, with the interpolation method imethod.
+        For imethod 'gather', the spline coefficients of Ws_grid and Wx_grid can be given.
+        """
+        if self.imethod == 'gather':
+            if coefficients is None:
+                coefficients = self._spline_coefficients(Ws_grid, Wx_grid)
+            return gather_2d_cells(cells, *coefficients, order=self.iorder, scale=kick_factor,
+                                   prefiltered=True, out=out)
+        
+        if self.imethod == 'spline':
+            # RectBivariateSpline method
+            Ws_interp = RectBivariateSpline(zvec, xvec, Ws_grid)
+            Wx_interp = RectBivariateSpline(zvec, xvec, Wx_grid)
+            delta_kick = kick_factor * Ws_interp.ev(z_b, x_b)
+            xp_kick = kick_factor * Wx_interp.ev(z_b, x_b)
+        else:
+            # map_coordinates method. Should match above fairly well. order=1 is even faster.
+            # Spacing from the grid limits, as the deposition: zvec[1]-zvec[0] can round
+            # to put the particles at zmax, xmax just past the last node, where the kick is zero
+            zmin, dz = zvec[0], (zvec[-1] - zvec[0]) / (len(zvec) - 1)
+            xmin, dx = xvec[0], (xvec[-1] - xvec[0]) / (len(xvec) - 1)
+            zcoord = (z_b-zmin)/dz
+            xcoord = (x_b-xmin)/dx
+            delta_kick = kick_factor * map_coordinates(Ws_grid, np.array([zcoord, xcoord]), order=2)
+            xp_kick    = kick_factor * map_coordinates(Wx_grid, np.array([zcoord, xcoord]), order=2)
+        if out is not None:
+            out[0][...] = delta_kick
+            out[1][...] = xp_kick
+            return out
+        return delta_kick, xp_kick
+        
+    def _wake(self, dz, dx, record):
+        """
+        Ws_grid and Wx_grid from the deposited charge_grid.
+        """
+        charge_grid = self.charge_grid
+        rho, beta = self.rho, self.beta
+        
+        with record.stage('filter'):
+            if self.spectral:
+                # Smoothing and d/dz are part of the Green function spectra.
+                # The normalization and 1/dz are applied to the wake.
+                density_scale = 1 / (np.sum(charge_grid) * dz * dx * dz)
+                density = charge_grid
+                if self.dtype != charge_grid.dtype:
+                    density = self.lambda_grid_filtered_prime
+                    density[...] = charge_grid
+            else:
+                # Normalize the grid so its integral is unity, apply savgol filter and differentiate in z
+                density_grids(charge_grid, dz, dx, window=13, polyorder=2, order=1,
+                              out=(self.lambda_grid_filtered, self.lambda_grid_filtered_prime))
+                density_scale = 1
+                density = self.lambda_grid_filtered_prime
+
+        # Creating the potential grids (in Fourier space, cached)
+        with record.stage('green'):
+            spectrum = self.spectrum(dz, dx)
+
+        # Compute the wake via 2d convolution
+        with record.stage('convolution'):
+            Ws_grid, Wx_grid = fftconvolve2(density, spectrum, workers=self.workers, out=(self.Ws_grid, self.Wx_grid))
+            Ws_grid *= (beta ** 2 / abs(rho)) * (dz * dx * density_scale)
+            Wx_grid *= (beta ** 2 / abs(rho)) * (dz * dx * density_scale)
+            
+        return Ws_grid, Wx_grid
+        
+    def _kick(self, z_b, x_b, weight, out, debug, record):
+        nz, nx = self.nz, self.nx
+        rho, beta = self.rho, self.beta
+        
+        # Grid setup
+        zmin, zmax, xmin, xmax = self.grid_limits(z_b, x_b, weight)
+        dz = (zmax - zmin) / (nz - 1)
+        dx = (xmax - xmin) / (nx - 1)
+
+        # Charge deposition
+        with record.stage('deposit'):
+            # Cell indices and offsets are shared by the deposition and the gather
+            if self._cells is None or len(self._cells) != len(z_b):
+                self._cells = ParticleCells(z_b, x_b, nz, zmin, zmax, nx, xmin, xmax)
+            else:
+                self._cells.update(z_b, x_b, zmin, zmax, xmin, xmax)
+            cells = self._cells
+            charge_grid = histogram_cic_2d_cells(cells, weight, out=self.charge_grid)
+
+        Ws_grid, Wx_grid = self._wake(dz, dx, record)
+
+        # Calculate the kicks at the particle locations
+        
+        # Overall factor
+        Nb = np.sum(weight) / e_charge
+        kick_factor = r_e * Nb / self.gamma  # m
+        grid_kick_factor = self._grid_kick_factor(z_b, x_b, weight, self.grid_plan, kick_factor)
+        
+        # Grid axis vectors
+        zvec = np.linspace(zmin, zmax, nz)
+        xvec = np.linspace(xmin, xmax, nx)
+            
+        # Interpolate Ws and Wx everywhere within the grid
+        with record.stage('gather'):
+            delta_kick, xp_kick = self._interpolate(z_b, x_b, cells, Ws_grid, Wx_grid, zvec, xvec, grid_kick_factor, out)
 
-def green_meshes(nz, nx, dz, dx, rho=None, beta=None):
+        result = {"ddelta_ds": delta_kick, "dxp_ds": xp_kick}
+        
+        if self.grid_method != 'minmax':
+            plan = self.grid_plan
+            record.info['clipped_fraction'] = plan.clipped_fraction
+            result["grid"] = plan
+            if plan.n_clipped and self.outliers == 'far_field':
+                with record.stage('outliers'):
+                    self._far_field_kick(z_b, x_b, weight, plan, kick_factor, delta_kick, xp_kick)
+
+        if debug:
+            if self.psi_grids is not None:
+                psi_s_grid, psi_x_grid = self.psi_grids
+                zvec2 = np.arange(-nz+1,nz+1,1)*dz
+                xvec2 = np.arange(-nx+1,nx+1,1)*dx
+            else:
+                psi_s_grid, psi_x_grid, zvec2, xvec2 = green_meshes(nz, nx, dz, dx, rho=rho, beta=beta,
+                                                                    igf=self.igf, igf_order=self.igf_order)
+            result.update(
+                {
+                    "zvec": zvec,
+                    "xvec": xvec,
+                    "zvec2": zvec2,
+                    "xvec2": xvec2,
+                    "Ws_grid": Ws_grid.copy(),
+                    "Wx_grid": Wx_grid.copy(),
+                    "psi_s_grid": psi_s_grid,
+                    "psi_x_grid": psi_x_grid,
+                    "charge_grid": charge_grid.copy(),
+                    "lambda_grid_filtered_prime": None if self.spectral else self.lambda_grid_filtered_prime.copy(),
+                }
+            )
+
+        return result
+
+
+def green_meshes(nz, nx, dz, dx, rho=None, beta=None, igf=False, igf_order=IGF_ORDER, executor=None):
     """
     Computes Green funcion meshes for psi_s and psi_x simultaneously.
     These meshes are in real space (not scaled space).
@@ -238,10 +962,24 @@ def green_meshes(nz, nx, dz, dx, rho=None, beta=None):
         Grid spacing of the density mesh in z and x [m]
         
     rho : float
-        bending radius (must be positve)
+        bending radius in [m]
+        The meshes for negative rho are derived from the cached meshes for |rho|.
         
     beta : float
         relativistic beta
+        
+    igf : bool
+        If True, the meshes hold the Green functions averaged over the
+        linear interpolation weights of each grid point (see csr2d.igf)
+        instead of point values.
+        Default: False
+        
+    igf_order : int
+        Number of Gauss-Legendre nodes per cell and dimension for igf=True.
+        
+    executor : concurrent.futures.Executor or map function, optional
+        Evaluates the meshes in blocks of z rows, see csr2d.parallel.row_block_meshes.
+        Default: None (one call of the parallel Numba kernel)
     
     Returns:
     tuple of:
@@ -260,6 +998,10 @@ def green_meshes(nz, nx, dz, dx, rho=None, beta=None):
     """
     rho_sign = 1 if rho>=0 else -1
     
+    igf_params = {'igf_order': igf_order} if igf else {}
+    key = mesh_key('psi_sx', nz, nx, dz, dx, abs(rho), beta=beta, **igf_params)
+    key_mirrored = mesh_key('psi_sx', nz, nx, dz, dx, rho, beta=beta, **igf_params)
+    
     # Change to internal coordinates
     dx = dx/rho
     dz = dz/(2*abs(rho))
@@ -274,12 +1016,38 @@ def green_meshes(nz, nx, dz, dx, rho=None, beta=None):
     #xvec2[nx-1] = -dx/2
     #xvec2[-1] = dx/2 
     
-    zm2, xm2 = np.meshgrid(zvec2, xvec2, indexing="ij")
+    # Module-level functions, so that they can be sent to worker processes
+    if igf:
+        mesh_func = partial(psi_sx_igf_mesh, beta=beta, dz=dz, dx=abs(dx), order=igf_order)
+    else:
+        # Evaluate both in one Numba kernel. psi_x will average around 0
+        mesh_func = partial(psi_sx_mesh, beta=beta, dx=abs(dx))
+    
+    def psi_sx_columns(xvec):
+        return row_block_meshes(mesh_func, zvec2, xvec, executor=executor)
+    
+    def compute():
+        # Meshes for positive rho
+        return psi_sx_columns(rho_sign*xvec2)
     
-    # Evaluate
-    #psi_s_grid, psi_x_grid = psi_sx(zm2, xm2, beta)
-    psi_s_grid = psi_s(zm2, xm2, beta) # Numba routines!
-    psi_x_grid = rho_sign*psi_x0(zm2, xm2, beta, abs(dx)) # Will average around 0
+    def compute_mirrored():
+        # Negative rho mirrors the meshes in x, and psi_x changes sign.
+        # The last column has no mirror image, so it is evaluated directly.
+        # (It does not enter the convolution, see fftconvolve2)
+        psi_s_pos, psi_x_pos = cached_meshes(key, compute)
+        psi_s_grid = np.empty_like(psi_s_pos)
+        psi_x_grid = np.empty_like(psi_x_pos)
+        psi_s_grid[:,:-1] = psi_s_pos[:,-2::-1]
+        psi_x_grid[:,:-1] = -psi_x_pos[:,-2::-1]
+        psi_s_last, psi_x_last = psi_sx_columns(xvec2[-1:])
+        psi_s_grid[:,-1] = psi_s_last[:,0]
+        psi_x_grid[:,-1] = -psi_x_last[:,0]
+        return psi_s_grid, psi_x_grid
+    
+    if rho_sign == 1:
+        psi_s_grid, psi_x_grid = cached_meshes(key, compute)
+    else:
+        psi_s_grid, psi_x_grid = cached_meshes(key_mirrored, compute_mirrored, persist=False)
     
     # Average out the values around x=0
     #psi_s_grid[:,nx-1] = (psi_s_grid[:,nx-1] + psi_s_grid[:,-1])/2
@@ -291,6 +1059,56 @@ def green_meshes(nz, nx, dz, dx, rho=None, beta=None):
     return psi_s_grid, psi_x_grid, zvec2*2*rho, xvec2*rho
 
 
+def green_meshes_spectrum(nz, nx, dz, dx, rho=None, beta=None, igf=False, igf_order=IGF_ORDER, z_taps=None,
+                          executor=None, dtype=np.float64):
+    """
+    Fourier transforms of the psi_s and psi_x Green function meshes from `green_meshes`,
+    prepared for fftconvolve2. These are cached in memory like the meshes.
+    
+    Parameters
+    ----------
+    nz, nx : int
+        Size of the density mesh in z and x
+
+    dz, dx : float
+        Grid spacing of the density mesh in z and x [m]
+        
+    rho : float
+        bending radius in [m]
+        
+    beta : float
+        relativistic beta
+        
+    igf, igf_order, executor : 
+        See `green_meshes`
+        
+    z_taps : tuple of floats, optional
+        z filter multiplied into the spectra, see green_spectrum
+        
+    dtype : np.float64 or np.float32
+        Precision of the convolutions, see green_spectrum. Default: np.float64
+    
+    Returns:
+        GreenSpectrum for psi_s and psi_x
+    
+    """
+    def compute():
+        psi_s_grid, psi_x_grid, _, _ = green_meshes(nz, nx, dz, dx, rho=rho, beta=beta, igf=igf, igf_order=igf_order,
+                                                    executor=executor)
+        return green_spectrum(psi_s_grid, psi_x_grid, z_taps=z_taps, dtype=dtype).spectra
+    
+    params = {'igf_order': igf_order} if igf else {}
+    if np.dtype(dtype) != np.float64:
+        params['dtype'] = np.dtype(dtype).name
+    if z_taps is not None:
+        z_taps = tuple(z_taps)
+        params['z_taps'] = z_taps
+    key = mesh_key('psi_sx_spectrum', nz, nx, dz, dx, rho, beta=beta, **params)
+    spectra = cached_meshes(key, compute, persist=False)
+    
+    return GreenSpectrum(spectra, (2*nz, 2*nx), 0 if z_taps is None else len(z_taps)//2)
+
+
 def green_meshes_case_B(nz, nx, dz, dx, rho=None, beta=None):
     """
     Computes Green funcion meshes for psi_s and psi_x simultaneously.
@@ -324,6 +1142,8 @@ def green_meshes_case_B(nz, nx, dz, dx, rho=None, beta=None):
     """
     rho_sign = 1 if rho>=0 else -1
     
+    key = mesh_key('Es_B', nz, nx, dz, dx, rho, beta=beta)
+    
     # Change to internal coordinates
     dx = dx/rho
     dz = dz/(2*abs(rho))
@@ -333,9 +1153,10 @@ def green_meshes_case_B(nz, nx, dz, dx, rho=None, beta=None):
     xvec2 = np.arange(-nx+1,nx+1,1)*dx # center = 0 is at [nx-1]
     
     
-    zm2, xm2 = np.meshgrid(zvec2, xvec2, indexing="ij")
+    def compute():
+        return (Es_case_B0_mesh(zvec2, xvec2, beta),) # Numba routines!
     
-    Es_case_B_grid = Es_case_B0(zm2, xm2, beta, dx) # Numba routines!
+    Es_case_B_grid, = cached_meshes(key, compute)
     
     return Es_case_B_grid, zvec2*2*rho, xvec2*rho
 
@@ -378,6 +1199,8 @@ def green_meshes_case_A(nz, nx, dz, dx, rho=None, beta=None, alp=None):
     """
     rho_sign = 1 if rho>=0 else -1
     
+    key = mesh_key('A', nz, nx, dz, dx, rho, beta=beta, alp=alp)
+    
     # Change to internal coordinates
     dx = dx/rho
     dz = dz/(2*abs(rho))
@@ -387,10 +1210,10 @@ def green_meshes_case_A(nz, nx, dz, dx, rho=None, beta=None, alp=None):
     xvec2 = np.arange(-nx+1,nx+1,1)*dx # center = 0 is at [nx-1]
     
     
-    zm2, xm2 = np.meshgrid(zvec2, xvec2, indexing="ij")
+    def compute():
+        return case_A_mesh(zvec2, xvec2, beta, alp) # Numba routines!
     
-    Es_case_A_grid = Es_case_A(zm2, xm2, beta, alp) # Numba routines!
-    Fx_case_A_grid = Fx_case_A(zm2, xm2, beta, alp) # Numba routines!
+    Es_case_A_grid, Fx_case_A_grid = cached_meshes(key, compute)
     
     return Es_case_A_grid, Fx_case_A_grid, zvec2*2*rho, xvec2*rho
 
@@ -435,6 +1258,8 @@ def green_meshes_case_C(nz, nx, dz, dx, rho=None, beta=None, alp=None, lamb=None
     """
     rho_sign = 1 if rho>=0 else -1
     
+    key = mesh_key('C', nz, nx, dz, dx, rho, beta=beta, alp=alp, lamb=lamb)
+    
     # Change to internal coordinates
     dx = dx/rho
     dz = dz/(2*abs(rho))
@@ -444,10 +1269,10 @@ def green_meshes_case_C(nz, nx, dz, dx, rho=None, beta=None, alp=None, lamb=None
     xvec2 = np.arange(-nx+1,nx+1,1)*dx # center = 0 is at [nx-1]
     
     
-    zm2, xm2 = np.meshgrid(zvec2, xvec2, indexing="ij")
+    def compute():
+        return case_C_mesh(zvec2, xvec2, beta, alp, lamb) # Numba routines!
     
-    Es_case_C_grid = Es_case_C(zm2, xm2, beta, alp, lamb) # Numba routines!
-    Fx_case_C_grid = Fx_case_C(zm2, xm2, beta, alp, lamb) # Numba routines!
+    Es_case_C_grid, Fx_case_C_grid = cached_meshes(key, compute)
     
     return Es_case_C_grid, Fx_case_C_grid, zvec2*2*rho, xvec2*rho
 
@@ -485,6 +1310,8 @@ def green_meshes_case_D(nz, nx, dz, dx, rho=None, beta=None, lamb=None):
     """
     rho_sign = 1 if rho>=0 else -1
     
+    key = mesh_key('D', nz, nx, dz, dx, rho, beta=beta, lamb=lamb)
+    
     # Change to internal coordinates
     dx = dx/rho
     dz = dz/(2*abs(rho))
@@ -494,15 +1321,16 @@ def green_meshes_case_D(nz, nx, dz, dx, rho=None, beta=None, lamb=None):
     xvec2 = np.arange(-nx+1,nx+1,1)*dx # center = 0 is at [nx-1]
     
     
-    zm2, xm2 = np.meshgrid(zvec2, xvec2, indexing="ij")
+    def compute():
+        return (Es_case_D_mesh(zvec2, xvec2, beta, lamb),)
     
-    Es_case_D_grid = Es_case_D(zm2, xm2, beta, lamb)
+    Es_case_D_grid, = cached_meshes(key, compute)
     
     return Es_case_D_grid, zvec2*2*rho, xvec2*rho
 
 
 
-def csr1d_steady_state_kick_calc(z, weights, nz=100, rho=1, species="electron", normalized_units=False):
+def csr1d_steady_state_kick_calc(z, weights, nz=100, rho=1, species="electron", normalized_units=False, z_eval=None):
 
     """
 
@@ -533,6 +1361,9 @@ def csr1d_steady_state_kick_calc(z, weights, nz=100, rho=1, species="electron",
         Otherwise, units of [eV/m] are returned (default).
         Default: False
         
+    z_eval : np.array, optional
+        Positions to evaluate the kicks at, instead of z [m]
+        
     Returns
     -------
     dict with:
@@ -552,12 +1383,31 @@ def csr1d_steady_state_kick_calc(z, weights, nz=100, rho=1, species="electron",
 
     # Density
     H, edges = np.histogram(z, weights=weights, bins=nz)
-    zmin, zmax = edges[0], edges[-1]
+    zvec, wake = csr1d_steady_state_wake(H, edges[0], edges[-1], np.sum(weights), rho=rho,
+                                         normalized_units=normalized_units)
+
+    # Interpolate to get the kicks
+    delta_kick = np.interp(z if z_eval is None else z_eval, zvec, wake)
+
+    return {"denergy_ds": delta_kick, "zvec": zvec, "wake": wake}
+
+
+def csr1d_steady_state_wake(H, zmin, zmax, Qtot, rho=1, normalized_units=False):
+    """
+    Steady state CSR 1D wake from the charge histogram H over [zmin, zmax] (as np.histogram)
+    of a bunch with total charge Qtot [C], see `csr1d_steady_state_kick_calc`.
+    The histogram can be accumulated over chunks of the bunch.
+    
+    Returns
+    -------
+    zvec, wake : np.arrays
+    
+    """
+    nz = len(H)
     dz = (zmax - zmin) / (nz - 1)
 
     zvec = np.linspace(zmin, zmax, nz)  # Sloppy with bin centers
 
-    Qtot = np.sum(weights)
     density = H / dz / Qtot
 
     # Density derivative
@@ -577,7 +1427,4 @@ def csr1d_steady_state_kick_calc(z, weights, nz=100, rho=1, species="electron",
     # Convolve to get wake
     wake = np.convolve(densityp_filtered, green, mode="full")[0 : len(zvec)]
 
-    # Interpolate to get the kicks
-    delta_kick = np.interp(z, zvec, wake)
-
-    return {"denergy_ds": delta_kick, "zvec": zvec, "wake": wake}
+    return zvec, wake
@@ -1,9 +1,21 @@
 from csr2d.deposit import histogram_cic_2d
 from csr2d.central_difference import central_difference_z
-from csr2d.core2 import psi_sx, psi_s, psi_x0, Es_case_B0, Es_case_A, Fx_case_A, Es_case_C, Fx_case_C, Es_case_D
+from csr2d.density import density_grids
+from csr2d.core2 import psi_sx, psi_sx0, psi_s, psi_x0, Es_case_B0, Es_case_A, Fx_case_A, Es_case_C, Fx_case_C, Es_case_D
+from csr2d.core2 import psi_sx_mesh, case_A_mesh, case_C_mesh, case_D_mesh
 from csr2d.convolution import fftconvolve2
+from csr2d.green_cache import mesh_key, cached_meshes
+from csr2d.igf import igf_mesh, psi_sx_igf_mesh, IGF_ORDER
+from csr2d.profiling import profiled_call
+from csr2d.parallel import row_block_meshes
+from csr2d.grid import plan_grid, GridPlan
+from csr2d.gather import gather_2d
+
+from functools import partial
 
 import numpy as np
+import scipy.fft as sp_fft
+from numba import njit, prange
 
 from scipy.signal import savgol_filter
 from scipy.interpolate import RectBivariateSpline
@@ -21,7 +33,24 @@ import time
 
 
 # @njit (doesn't like savgol filter...)
-def compute_dist_grid(z_b, x_b, weight, *, nz=100, nx=100, xlim=None, zlim=None, debug=False):
+def compute_dist_grid(z_b, x_b, weight, *, nz=100, nx=100, xlim=None, zlim=None, grid_method='minmax',
+                      grid_quantile=1e-4, grid_sigma=5.0, profiler=None, debug=False):
+    """
+    Deposits the particles and returns the grid axes, spacings, and the smoothed density and its z derivative.
+    The stage times go to `profiler` (csr2d.profiling.Profiler), if given.
+    
+    Without zlim or xlim, grid_method 'quantile' or 'sigma' picks the grid bounds from the
+    distribution (see csr2d.grid.plan_grid); the particles outside are not deposited.
+    
+    With debug=True, a dict with the csr2d.grid.GridPlan as 'grid' (None for 'minmax')
+    and the csr2d.profiling.CallRecord as 'profile' is returned as a 7th item.
+    """
+
+    plan = None
+    if grid_method != 'minmax':
+        plan = plan_grid(z_b, x_b, weight, method=grid_method, quantile=grid_quantile, n_sigma=grid_sigma,
+                         zlim=zlim or None, xlim=xlim or None)
+        zlim, xlim = plan.zlim, plan.xlim
 
     if zlim:
         zmin = zlim[0]
@@ -40,45 +69,65 @@ def compute_dist_grid(z_b, x_b, weight, *, nz=100, nx=100, xlim=None, zlim=None,
     dz = (zmax - zmin) / (nz - 1)
     dx = (xmax - xmin) / (nx - 1)
 
-    # Charge deposition
-    t1 = time.time()
-    charge_grid = histogram_cic_2d(z_b, x_b, weight, nz, zmin, zmax, nx, xmin, xmax)
-
-    if debug:
-        t2 = time.time()
-        print("Depositing particles takes:", t2 - t1, "s")
-
-    # Normalize the grid so its integral is unity
-    norm = np.sum(charge_grid) * dz * dx
-    lambda_grid = charge_grid / norm
+    with profiled_call(profiler, 'dist_grid', n_particles=len(z_b)) as record:
+        # Charge deposition
+        with record.stage('deposit'):
+            charge_grid = histogram_cic_2d(z_b, x_b, weight, nz, zmin, zmax, nx, xmin, xmax)
 
-    # Apply savgol filter
-    lambda_grid_filtered = np.array([savgol_filter(lambda_grid[:, i], 13, 2) for i in np.arange(nx)]).T
-
-    # Differentiation in z
-    lambda_grid_filtered_prime = central_difference_z(lambda_grid_filtered, nz, nx, dz, order=1)
+        # Normalize the grid so its integral is unity, apply savgol filter and differentiate in z
+        with record.stage('filter'):
+            lambda_grid_filtered, lambda_grid_filtered_prime = density_grids(charge_grid, dz, dx, window=13, polyorder=2, order=1)
 
     # Grid axis vectors
     zvec = np.linspace(zmin, zmax, nz)
     xvec = np.linspace(xmin, xmax, nx)
     
+    if debug:
+        return zvec, xvec, dz, dx, lambda_grid_filtered, lambda_grid_filtered_prime, {"grid": plan, "profile": record}
     return zvec, xvec, dz, dx, lambda_grid_filtered, lambda_grid_filtered_prime
 
 
 
 
-#@njit # (jit doesn't like np.meshgrid...)
-def compute_potential_grids(case, nz=100, nx=100, dz=None, dx=None, rho=None, beta=None, phi=None, phi_m=None, lamb=None):
+def potential_grid_key(case, nz, nx, dz, dx, rho, beta, phi=None, phi_m=None, lamb=None, igf=False, igf_order=IGF_ORDER):
+    """
+    Green mesh cache key of compute_potential_grids for case A, B, C or D.
+    """
+    # Keys are shared with the kick2.green_meshes* functions
+    igf_params = {'igf_order': igf_order} if igf else {}
+    if case == 'A':
+        return mesh_key('A', nz, nx, dz, dx, rho, beta=beta, alp=phi/2, **igf_params)
+    elif case == 'B':
+        return mesh_key('psi_sx', nz, nx, dz, dx, rho, beta=beta, **igf_params)
+    elif case == 'C':
+        return mesh_key('C', nz, nx, dz, dx, rho, beta=beta, alp=phi_m/2, lamb=lamb, **igf_params)
+    elif case == 'D':
+        return mesh_key('D', nz, nx, dz, dx, rho, beta=beta, lamb=lamb, **igf_params)
+    return None
+
+
+def compute_potential_grids(case, nz=100, nx=100, dz=None, dx=None, rho=None, beta=None, phi=None, phi_m=None, lamb=None,
+                            igf=False, igf_order=IGF_ORDER, executor=None):
     """
     The output of the 4 cases are:
         Case A, C, D: Es_grid, Fx_grid, zvec2, xvec2
         Case B:       psi_s_grid, psi_x_grid, zvec2, xvec2    
+    There is no Fx formula for case D, so its Fx_grid is None.
+        
+    With igf=True the grids hold integrated Green function values
+    (see csr2d.igf), with igf_order Gauss-Legendre nodes per cell and dimension.
+    
+    An executor (or map function) evaluates the grids in blocks of z rows,
+    see csr2d.parallel.row_block_meshes.
     """
     
     assert rho>0 , "rho (bending angle) must be positive!!!"
     
     #rho_sign = 1 if rho>=0 else -1
     
+    key = potential_grid_key(case, nz, nx, dz, dx, rho, beta, phi=phi, phi_m=phi_m, lamb=lamb,
+                             igf=igf, igf_order=igf_order)
+    
     ## Change to internal coordinates
     dx = dx/rho
     dz = dz/(2*abs(rho))
@@ -87,12 +136,17 @@ def compute_potential_grids(case, nz=100, nx=100, dz=None, dx=None, rho=None, be
     zvec2 = np.arange(-nz+1,nz+1,1)*dz # center = 0 is at [nz-1]
     xvec2 = np.arange(-nx+1,nx+1,1)*dx # center = 0 is at [nx-1]
     
-    zm2, xm2 = np.meshgrid(zvec2, xvec2, indexing="ij")
-
+    def mesh(mesh_func, n_meshes=2):
+        # mesh_func is a partial of a module-level function, so that it can be sent to worker processes
+        if igf:
+            mesh_func = partial(igf_mesh, mesh_func, dz=dz, dx=dx, order=igf_order)
+        return lambda: row_block_meshes(mesh_func, zvec2, xvec2, executor=executor, n_meshes=n_meshes)
+    
     if   case=='A': 
         assert phi>0 , "phi (entrance angle) must be positive!!!"
-        Es_case_A_grid = Es_case_A(zm2, xm2, beta, phi/2) # Numba routines!
-        Fx_case_A_grid = Fx_case_A(zm2, xm2, beta, phi/2) # Numba routines!
+        compute = mesh(partial(case_A_mesh, beta=beta, alp=phi/2)) # Numba routines!
+        
+        Es_case_A_grid, Fx_case_A_grid = cached_meshes(key, compute)
         
         return Es_case_A_grid, Fx_case_A_grid, zvec2*2*rho, xvec2*rho
         
@@ -100,8 +154,14 @@ def compute_potential_grids(case, nz=100, nx=100, dz=None, dx=None, rho=None, be
     
     elif case=='B':
         
-        psi_s_grid = psi_s(zm2, xm2, beta) # Numba routines!
-        psi_x_grid = psi_x0(zm2, xm2, beta, abs(dx)) # Will average around 0
+        if igf:
+            compute = lambda: row_block_meshes(partial(psi_sx_igf_mesh, beta=beta, dz=dz, dx=dx, order=igf_order),
+                                               zvec2, xvec2, executor=executor)
+        else:
+            # Numba routines! psi_x will average around 0
+            compute = lambda: row_block_meshes(partial(psi_sx_mesh, beta=beta, dx=abs(dx)), zvec2, xvec2, executor=executor)
+        
+        psi_s_grid, psi_x_grid = cached_meshes(key, compute)
     
         return psi_s_grid, psi_x_grid, zvec2*2*rho, xvec2*rho
     
@@ -110,122 +170,527 @@ def compute_potential_grids(case, nz=100, nx=100, dz=None, dx=None, rho=None, be
         assert phi_m>0 , "phi_m must be positive!!!"
         assert lamb>0 , "lamb (exit distance over rho) must be positive!!!"
         
-        Es_case_C_grid = Es_case_C(zm2, xm2, beta, phi_m/2, lamb) # Numba routines!
-        Fx_case_C_grid = Fx_case_C(zm2, xm2, beta, phi_m/2, lamb) # Numba routines!
+        compute = mesh(partial(case_C_mesh, beta=beta, alp=phi_m/2, lamb=lamb)) # Numba routines!
+        
+        Es_case_C_grid, Fx_case_C_grid = cached_meshes(key, compute)
         
         return Es_case_C_grid, Fx_case_C_grid, zvec2*2*rho, xvec2*rho
     #    return green_meshes_case_C(nz, nx, dz, dx, rho=rho, beta=beta, alp=phi_m/2, lamb=lamb) 
     
+    elif case=='D':
+        assert lamb>0 , "lamb (exit distance over rho) must be positive!!!"
+        
+        compute = mesh(partial(case_D_mesh, beta=beta, lamb=lamb), n_meshes=1) # Numba routines!
+        
+        Es_case_D_grid, = cached_meshes(key, compute)
+        
+        return Es_case_D_grid, None, zvec2*2*rho, xvec2*rho
     
     else:
         print('INVALID CASE GIVEN. MUST be one of ABCDE!!')
 
 
 
-#@njit #(doesn't like fftconvole2 and condition_grid )
+def band_indices(zvec2, z_lo=None, z_hi=None):
+    """
+    Row index ranges [lo, hi) of the sorted axis zvec2 with z_lo <= z <= z_hi,
+    one per column (z_lo and z_hi are arrays over the columns, or None for no limit).
+    These are the rows kept by the boundary conditions, without boolean grids.
+    """
+    n = len(zvec2)
+    n_columns = len(z_hi if z_lo is None else z_lo)
+    lo = np.zeros(n_columns, dtype=np.int64) if z_lo is None else np.searchsorted(zvec2, z_lo, side='left')
+    hi = np.full(n_columns, n, dtype=np.int64) if z_hi is None else np.searchsorted(zvec2, z_hi, side='right')
+    return lo, hi
+
+
+@njit(parallel=True)
+def _band_columns(green, c0, lo, hi, out):
+    """
+    out[:, c] = green[:, c0 + c] in rows lo[c] <= i < hi[c], zero elsewhere
+    """
+    for c in prange(out.shape[1]):
+        for i in range(out.shape[0]):
+            if lo[c] <= i < hi[c]:
+                out[i, c] = green[i, c0 + c]
+            else:
+                out[i, c] = 0.0
+
+
+@njit
+def _band_direct_column(rho_t, green_t, c0, lo, hi, out):
+    """
+    Column c0 of fftconvolve2(rho, green) by direct summation, with green[:, c0 + k]
+    limited to rows lo[k] <= r < hi[k]. Only the band is visited.
+    Takes the transposes rho_t = rho.T and green_t = green.T, contiguous along z.
+    """
+    n1, n0 = rho_t.shape
+    out[:] = 0.0
+    for k in range(n1):
+        b = n1 - 1 - k
+        for r in range(lo[k], hi[k]):
+            g = green_t[c0 + k, r]
+            # out[i] gets rho row a = i + n0 - 1 - r, for 0 <= i, a < n0
+            i0 = max(0, r - n0 + 1)
+            i1 = min(n0, r + 1)
+            offset = n0 - 1 - r
+            for i in range(i0, i1):
+                out[i] += g * rho_t[b, i + offset]
+
+
+# Relative cost of one multiply-add of the direct sum to one n*log2(n) unit of the FFT path
+DIRECT_COST_RATIO = 1.5
+
+CONVOLUTION_METHODS = ('auto', 'fft', 'direct')
+
+
+class _ObservedConvolution:
+    """
+    Columns of fftconvolve2(rho, *greens), with the Green meshes masked per observation column.
+
+    Only the nx Green columns that reach the observation column enter, so each column
+    costs 1D FFTs in z of an (2nz, nx) block instead of a full 2D convolution.
+    The z transform of rho is shared by all observation columns.
+
+    With method='auto', a column whose band of rows is thin (small fill fraction)
+    is summed directly over the band instead, when that is estimated to be cheaper.
+    """
+    def __init__(self, rho, method='auto'):
+        if method not in CONVOLUTION_METHODS:
+            raise ValueError(f'Unknown convolution method: {method}, must be one of {CONVOLUTION_METHODS}')
+        self.rho = rho
+        self.method = method
+        self.n0, self.n1 = rho.shape
+        self.L = sp_fft.next_fast_len(2*self.n0, real=True)
+        self._rho_hat = None
+        self.buffer = np.empty((2*self.n0, self.n1))
+        self._transposed = {}
+        self.n_direct = 0
+        self.n_fft = 0
+
+    def _transpose(self, a):
+        # Transposes for the direct sums, made once per mesh
+        if id(a) not in self._transposed:
+            self._transposed[id(a)] = (a, np.ascontiguousarray(a.T))
+        return self._transposed[id(a)][1]
+
+    @property
+    def rho_hat(self):
+        if self._rho_hat is None:
+            self._rho_hat = sp_fft.rfft(self.rho, n=self.L, axis=0)
+        return self._rho_hat
+
+    def use_direct(self, lo, hi):
+        """
+        True if the direct sum over the band is estimated to be cheaper than the FFTs.
+        """
+        if self.method != 'auto':
+            return self.method == 'direct'
+        band = np.sum(np.maximum(hi - lo, 0))
+        fft_cost = self.n1 * self.L * np.log2(self.L)
+        return DIRECT_COST_RATIO * band * self.n0 < fft_cost
+
+    def column(self, greens, j, lo, hi):
+        n0, n1 = self.n0, self.n1
+        # Green columns j .. j+n1-1 reach observation column j
+        lo = lo[j:j+n1]
+        hi = hi[j:j+n1]
+        results = []
+        if self.use_direct(lo, hi):
+            self.n_direct += 1
+            rho_t = self._transpose(self.rho)
+            for green in greens:
+                out = np.empty(n0)
+                _band_direct_column(rho_t, self._transpose(green), j, lo, hi, out)
+                results.append(out)
+            return results
+
+        self.n_fft += 1
+        for green in greens:
+            _band_columns(green, j, lo, hi, self.buffer)
+            green_hat = sp_fft.rfft(self.buffer, n=self.L, axis=0)
+            w_hat = np.einsum('kl,kl->k', self.rho_hat, green_hat[:, ::-1])
+            results.append(sp_fft.irfft(w_hat, self.L)[n0-1:2*n0-1])
+        return results
+
+
+@njit
+def _bspline_basis(t, k, x, basis):
+    """
+    Index l of the knot interval t[l] <= x < t[l+1] and the k+1 non-zero B-splines there (de Boor).
+    x is clamped to the base interval, as in FITPACK.
+    """
+    n = len(t)
+    x = min(max(x, t[k]), t[n - k - 1])
+    l = np.searchsorted(t, x, side='right') - 1
+    l = min(max(l, k), n - k - 2)
+    basis[0] = 1.0
+    for j in range(1, k + 1):
+        saved = 0.0
+        for r in range(j):
+            right = t[l + r + 1] - x
+            left = x - t[l + r + 1 - j]
+            temp = basis[r] / (right + left)
+            basis[r] = saved + right * temp
+            saved = left * temp
+        basis[j] = saved
+    return l
+
+
+@njit(parallel=True)
+def _boundary_term_sums(tz, tx, coefficients, kz, kx, zvec, xvec2, z_shifts, psi, out):
+    """
+    out[m, i] = sum_c lambda(zvec[i] - z_shifts[s, c], xvec2[c]) * psi[m, c], with s = m // 2,
+    lambda the tensor product spline (tz, tx, coefficients, kz, kx).
+    """
+    n2 = len(xvec2)
+    n_coef_x = len(tx) - kx - 1
+    # The x basis is the same for all z
+    x_index = np.empty(n2, dtype=np.int64)
+    x_basis = np.empty((n2, kx + 1))
+    for c in range(n2):
+        x_index[c] = _bspline_basis(tx, kx, xvec2[c], x_basis[c])
+    for i in prange(len(zvec)):
+        z_basis = np.empty(kz + 1)
+        sums = np.zeros(out.shape[0])
+        for s in range(z_shifts.shape[0]):
+            for c in range(n2):
+                lz = _bspline_basis(tz, kz, zvec[i] - z_shifts[s, c], z_basis)
+                lx = x_index[c]
+                value = 0.0
+                for a in range(kz + 1):
+                    row = (lz - kz + a) * n_coef_x + lx - kx
+                    partial_sum = 0.0
+                    for b in range(kx + 1):
+                        partial_sum += coefficients[row + b] * x_basis[c, b]
+                    value += partial_sum * z_basis[a]
+                sums[2*s] += value * psi[2*s, c]
+                sums[2*s + 1] += value * psi[2*s + 1, c]
+        for m in range(out.shape[0]):
+            out[m, i] = sums[m]
+
+
+def _case_B_boundary_terms(x_observe, zvec, xvec2, zi_vec, zo_vec, lambda_interp, beta, rho, dx):
+    """
+    The two boundary terms of case B for one observation x: Ws_zi, Ws_zo, Wx_zi, Wx_zo
+
+    The spline lambda is evaluated at z - zi and z - zo, for all z in zvec and x' in xvec2,
+    and summed against the boundary Green values in one compiled loop.
+    """
+    temp = (x_observe - xvec2)/rho
+
+    # Boundary Green values, rows psi_s(zi), psi_x(zi), psi_s(zo), psi_x(zo)
+    psi = np.stack((
+        psi_s(zi_vec/2/np.abs(rho), temp, beta), psi_x0(zi_vec/2/np.abs(rho), temp, beta, dx),
+        psi_s(zo_vec/2/np.abs(rho), temp, beta), psi_x0(zo_vec/2/np.abs(rho), temp, beta, dx)))
+
+    tz, tx, coefficients = lambda_interp.tck
+    kz, kx = lambda_interp.degrees
+    W = np.empty((4, len(zvec)))
+    _boundary_term_sums(tz, tx, coefficients, kz, kx, np.asarray(zvec, dtype=float), xvec2,
+                        np.stack((zi_vec, zo_vec)), psi, W)
+
+    Ws_zi_vec, Wx_zi_vec, Ws_zo_vec, Wx_zo_vec = W
+    return Ws_zi_vec, (-1.0) * Ws_zo_vec, Wx_zi_vec, (-1.0) * Wx_zo_vec
+
+
 def boundary_convolve(
-    case, x_observe, zvec=None, xvec=None,  zvec2=None, xvec2=None, 
-    G_lamb = None, G_lamb_p = None, Gs=None, Gx=None, 
-    beta=None, rho=None, phi=None, phi_m=None, lamb=None, dx=None):
+    case, x_observe, zvec=None, xvec=None,  zvec2=None, xvec2=None,
+    G_lamb = None, G_lamb_p = None, Gs=None, Gx=None,
+    beta=None, rho=None, phi=None, phi_m=None, lamb=None, dx=None, convolution='auto'):
     """
     The grids required for the 4 cases are:
-        Case A, C, D: 
-            G_lamb = lambda_grid, Gs = Es_grid, Gx = Fx_grid
-        Case B: 
+        Case A, C, D:
+            G_lamb = lambda_grid, Gs = Es_grid, Gx = Fx_grid (None for case D, giving a zero conv_x)
+        Case B:
             G_lamb = lambda_grid, G_lamb_p = lambda_grid_prime, Gs = psi_s_grid, Gx = psi_x_grid
 
     The "optional" parameters required by the 4 cases are:
-        Case A: phi 
-        Case B: phi, zvec, dx (for on-axis calculation and boundary terms ) 
+        Case A: phi
+        Case B: phi, zvec, dx (for on-axis calculation and boundary terms )
         Case C: phi_m, lamb
         Case D: phi_m, lamb (, and dx for boundary terms if formula available)
+
+    x_observe can be a single x, a sequence of x values, or None for all of xvec.
+    For a single x the results are 1D arrays along z, otherwise they have
+    shape (nz, number of observation columns).
+
+    The Green meshes are masked per observation column with the row ranges
+    of band_indices, and only that column of the convolution is computed.
+    convolution selects how: 'fft' (1D FFTs in z), 'direct' (numba sum over the band only),
+    or 'auto' (direct when the band's fill fraction makes it cheaper, e.g. case B
+    for bunches much longer than wide, where zo < z < zi is a thin sliver of the mesh).
     """
 
+    if case not in ('A', 'B', 'C', 'D'):
+        print('INVALID CASE GIVEN. MUST be one of ABCDE!!')
+        return
+
+    single = x_observe is not None and np.ndim(x_observe) == 0
+    x_observe = xvec if x_observe is None else np.atleast_1d(x_observe)
+
     # Strictly speaking x_observe should be a value from xvec
-    x_observe_index = np.argmin(np.abs(xvec - x_observe))
-    #print('x_observe_index :', x_observe_index )
-    
-    if case == 'A':
-        # Boundary condition 
-        temp = (x_observe - xvec2)/abs(rho)
-        zi_vec = abs(rho)*(phi-beta*np.sqrt(temp**2 + 4*(1+temp)*np.sin(phi/2)**2))
-        #zo_vec = -beta*np.abs(x_observe - xvec2)  
+    x_observe_index = np.argmin(np.abs(xvec[None, :] - x_observe[:, None]), axis=1)
 
-        # Want "True" if (z < zi), where the potential grid values are set to ZERO
-        condition_grid = np.array([(zvec2 < zi_vec[i]) for i in range(len(xvec2))])
-        Es_grid_bounded = np.where(condition_grid.T, 0, Gs)
-        Fx_grid_bounded = np.where(condition_grid.T, 0, Gx)
+    if case == 'B':
+        conv = _ObservedConvolution(G_lamb_p, method=convolution)
+        # lambda lives in the observation grid
+        lambda_interp = RectBivariateSpline(zvec, xvec, G_lamb)
+    else:
+        conv = _ObservedConvolution(G_lamb, method=convolution)
 
-        
-        #### Method one: FFT #######
-        conv_s, conv_x = fftconvolve2(G_lamb, Es_grid_bounded, Fx_grid_bounded)
+    results = [np.empty((conv.n0, len(x_observe))) for _ in range(6 if case == 'B' else 2)]
 
-        return conv_s[:,x_observe_index], conv_x[:,x_observe_index]
+    for m, (xo, j) in enumerate(zip(x_observe, x_observe_index)):
+        if case == 'A':
+            # Boundary condition
+            temp = (xo - xvec2)/abs(rho)
+            zi_vec = abs(rho)*(phi-beta*np.sqrt(temp**2 + 4*(1+temp)*np.sin(phi/2)**2))
+            #zo_vec = -beta*np.abs(x_observe - xvec2)
 
-        
-        ####### Method 2: William writing new Convolve to compute values only along specified x_oberseve_index
-        #Ws_along_x_observe = \
-        #my_super_convolve2(lambda_grid_filtered, Es_grid_bounded, np.arange(len(zvec)), x_observe_index)
-        #Wx_along_x_observe = \
-        #my_super_convolve2(lambda_grid_filtered, Fx_grid_bounded, np.arange(len(zvec)), x_observe_index)
-        
-        
-        # convolve4 is slower than convolve2....
-        #Ws_along_x_observe, Wx_along_x_observe= \
-        #my_super_convolve4(lambda_grid_filtered, Es_grid_bounded, Fx_grid_bounded, np.arange(len(zvec)), x_observe_index)
-        
-        #return Ws_along_x_observe, Wx_along_x_observe
-        ###############################################
-        
-    elif case=='C':
-        temp = (x_observe - xvec2)/rho
-        zid_vec = rho*(phi_m + lamb - beta*np.sqrt(lamb**2 + temp**2 + 4*(1+temp)*np.sin(phi_m/2)**2 + 2*lamb*np.sin(phi_m)))
+            # The potential grid values are ZERO for z < zi
+            lo, hi = band_indices(zvec2, z_lo=zi_vec)
 
-        condition_grid = np.array([(zvec2 < zid_vec[i]) for i in range(len(xvec2))])
-        Es_grid_bounded = np.where(condition_grid.T, 0, Gs)
-        Fx_grid_bounded = np.where(condition_grid.T, 0, Gx)
+        elif case == 'C':
+            temp = (xo - xvec2)/rho
+            zid_vec = rho*(phi_m + lamb - beta*np.sqrt(lamb**2 + temp**2 + 4*(1+temp)*np.sin(phi_m/2)**2 + 2*lamb*np.sin(phi_m)))
 
-        conv_s, conv_x = fftconvolve2(G_lamb, Es_grid_bounded, Fx_grid_bounded)
-    
-        return conv_s[:,x_observe_index], conv_x[:,x_observe_index]
-    
-    elif case=='B':
-        temp = (x_observe - xvec2)/rho
-        zi_vec = rho*( phi - beta*np.sqrt(temp**2 + 4*(1+temp)*np.sin(phi/2)**2))
-        zo_vec = -beta*np.abs(x_observe - xvec2)
+            lo, hi = band_indices(zvec2, z_lo=zid_vec)
+
+        elif case == 'D':
+            temp = (xo - xvec2)/rho
+            zi_vec = rho*(phi_m + lamb - beta*np.sqrt(lamb**2 + temp**2 + 4*(1+temp)*np.sin(phi_m/2)**2 + 2*lamb*np.sin(phi_m)))
+            zo_vec = rho*(lamb - beta*np.sqrt(lamb**2 + temp**2))
 
+            # The potential values are ZERO for (z > zi) OR (z < zo)
+            lo, hi = band_indices(zvec2, z_lo=zo_vec, z_hi=zi_vec)
 
-        # Computing the integral term of case B
-        # Want "True" if (z > zi) OR (z < zo), where the potential values are set to ZERO
-        condition_grid = np.array([(zvec2 > zi_vec[i]) | (zvec2 < zo_vec[i]) for i in range(len(xvec2))])
-        psi_s_grid_bounded = np.where(condition_grid.T, 0, Gs)
-        psi_x_grid_bounded = np.where(condition_grid.T, 0, Gx)
-        conv_s, conv_x = fftconvolve2(G_lamb_p, psi_s_grid_bounded, psi_x_grid_bounded)
+        else:
+            temp = (xo - xvec2)/rho
+            zi_vec = rho*( phi - beta*np.sqrt(temp**2 + 4*(1+temp)*np.sin(phi/2)**2))
+            zo_vec = -beta*np.abs(xo - xvec2)
+
+            # Computing the integral term of case B
+            # The potential values are ZERO for (z > zi) OR (z < zo)
+            lo, hi = band_indices(zvec2, z_lo=zo_vec, z_hi=zi_vec)
+
+        if Gx is None:
+            # Case D has no Fx
+            conv_s, = conv.column((Gs,), j, lo, hi)
+            conv_x = np.zeros_like(conv_s)
+        else:
+            conv_s, conv_x = conv.column((Gs, Gx), j, lo, hi)
         #Ws_grid = (beta**2 / abs(rho)) * (conv_s) * (dz * dx)
         #Wx_grid = (beta**2 / abs(rho)) * (conv_x) * (dz * dx)
 
-        # Computing the two boundary terms of case B 
-        # ==========================================
-        lambda_interp = RectBivariateSpline(zvec, xvec, G_lamb)  # lambda lives in the observation grid
+        if case == 'B':
+            # Computing the two boundary terms of case B
+            # ==========================================
+            Ws_zi_vec, Ws_zo_vec, Wx_zi_vec, Wx_zo_vec = _case_B_boundary_terms(
+                xo, zvec, xvec2, zi_vec, zo_vec, lambda_interp, beta, rho, dx)
+            columns = (conv_s, Ws_zi_vec, Ws_zo_vec, conv_x, Wx_zi_vec, Wx_zo_vec)
+        else:
+            columns = (conv_s, conv_x)
 
-        lambda_zi_vec = lambda z: lambda_interp.ev( z - zi_vec, xvec2 )
-        psi_s_zi_vec = psi_s(zi_vec/2/np.abs(rho), temp, beta)
-        Ws_zi = lambda z:  np.dot(psi_s_zi_vec, lambda_zi_vec(z))
-        Ws_zi_vec = np.array(list(map(Ws_zi, zvec)))
-        psi_x_zi_vec = psi_x0(zi_vec/2/np.abs(rho), temp, beta, dx)
-        Wx_zi = lambda z:  np.dot(psi_x_zi_vec, lambda_zi_vec(z))
-        Wx_zi_vec = np.array(list(map(Wx_zi, zvec)))
+        for result, column in zip(results, columns):
+            result[:, m] = column
 
+    if single:
+        return tuple(result[:, 0] for result in results)
+    return tuple(results)
 
-        lambda_zo_vec = lambda z: lambda_interp.ev( z - zo_vec, xvec2 )
-        psi_s_zo_vec = psi_s(zo_vec/2/np.abs(rho), temp, beta)
-        Ws_zo = lambda z: (-1.0) * np.dot(psi_s_zo_vec, lambda_zo_vec(z))
-        Ws_zo_vec = np.array(list(map(Ws_zo, zvec)))
-        psi_x_zo_vec = psi_x0(zo_vec/2/np.abs(rho), temp, beta, dx)
-        Wx_zo = lambda z: (-1.0) * np.dot(psi_x_zo_vec, lambda_zo_vec(z))
-        Wx_zo_vec = np.array(list(map(Wx_zo, zvec)))
 
-        return conv_s[:,x_observe_index], Ws_zi_vec, Ws_zo_vec, conv_x[:,x_observe_index], Wx_zi_vec, Wx_zo_vec
+def transient_cases(phi=None, phi_m=None, lamb=None):
+    """
+    The transient cases contributing at a position in or after a bend:
+        In the bend, at angle phi from the entrance (lamb None or 0): ('A', 'B')
+            A: source in the entrance drift, B: source in the bend
+        In the exit drift, at lamb*rho after a bend of angle phi_m: ('C', 'D')
+            C: source in the bend, D: source in the entrance drift
+    Case E (source in the exit drift) has no Green function here and is left out.
+    """
+    if not lamb:
+        assert phi is not None and phi > 0, "phi (entrance angle) must be positive in the bend!!!"
+        return ('A', 'B')
+    assert lamb > 0, "lamb (exit distance over rho) must be positive!!!"
+    assert phi_m is not None and phi_m > 0, "phi_m (bending angle) must be given after the bend!!!"
+    return ('C', 'D')
+
+
+def csr2d_transient_kick_calc(
+    z_b,
+    x_b,
+    weight,
+    *,
+    gamma=None,
+    rho=None,
+    phi=None,
+    phi_m=None,
+    lamb=None,
+    nz=100,
+    nx=100,
+    xlim=None,
+    zlim=None,
+    grid_method='minmax',
+    grid_quantile=1e-4,
+    grid_sigma=5.0,
+    igf=False,
+    igf_order=IGF_ORDER,
+    convolution='auto',
+    iorder=2,
+    executor=None,
+    prefetched=None,
+    species="electron",
+    profiler=None,
+    debug=False,
+):
+    """
+    Calculates the 2D transient CSR kick on a set of particles, at a position in or after a bend.
     
-    else:
-        print('INVALID CASE GIVEN. MUST be one of ABCDE!!')
\ No newline at end of file
+    The cases are picked from the position (see `transient_cases`): A and B in the bend
+    at angle phi from the entrance, C and D in the exit drift at distance lamb*rho
+    after a bend of angle phi_m. The Green meshes are cached (see csr2d.green_cache),
+    the wakes are computed on the whole grid with `boundary_convolve`, and interpolated
+    at the particles like csr2d.kick2.csr2d_kick_calc.
+    
+    Parameters
+    ----------
+    z_b, x_b : np.array
+        Bunch coordinates in [m]
+        
+    weight : np.array
+        weight array (positive only) in [C]
+        This should sum to the total charge in the bunch
+        
+    gamma : float
+        Relativistic gamma
+        
+    rho : float
+        bending radius in [m], must be positive
+        
+    phi : float
+        Angle from the bend entrance [rad], for the position in the bend
+        
+    phi_m : float
+        Bending angle of the bend [rad], for the position in the exit drift
+        
+    lamb : float or None
+        Distance from the bend exit over rho, for the position in the exit drift.
+        None or 0: the position is in the bend. Default: None
+        
+    nz, nx, zlim, xlim, grid_method, grid_quantile, grid_sigma :
+        Grid, see compute_dist_grid. Particles outside of the grid get zero kicks.
+        
+    igf, igf_order : 
+        Integrated Green function meshes, see compute_potential_grids. Default: False
+        
+    convolution : str
+        'auto', 'fft' or 'direct', see boundary_convolve. Default: 'auto'
+        
+    iorder : int
+        Interpolation order, see csr2d.gather.gather_2d. Default: 2
+        
+    executor : None, concurrent.futures.Executor or map function
+        Evaluates the Green meshes in row blocks on a cache miss, see compute_potential_grids
+        
+    prefetched : dict of {case: csr2d.green_prefetch.GreenMeshPrefetch}, optional
+        Green meshes of cases A, C and D computed ahead at a set of phi or lamb nodes
+        (see csr2d.green_prefetch.prefetch_transient_meshes). A position at a node uses
+        these meshes, any other position computes its meshes.
+        The meshes are computed for one grid, so zlim and xlim should be fixed.
+        
+    species : str
+        Particle species. Currently required to be 'electron'
+        
+    profiler : csr2d.profiling.Profiler, optional
+        Receives the records of the deposition and of the kick calculation
+        
+    debug: bool
+        If True, also returns the cases, the grids, the wakes of each case,
+        and the csr2d.profiling.CallRecord of the kick calculation as 'profile'.
+        Default: False
+              
+    Returns
+    -------
+    dict with:
+    
+        ddelta_ds : np.array
+            relative z momentum kick [1/m]
+            
+        dxp_ds : np.array
+            relative x momentum kick [1/m]
+    """
+    assert species == "electron", f"TODO: support species {species}"
+    assert rho > 0, "rho (bending radius) must be positive!!!"
+    
+    cases = transient_cases(phi=phi, phi_m=phi_m, lamb=lamb)
+    beta = np.sqrt(1 - 1 / gamma**2)
+    
+    zvec, xvec, dz, dx, lambda_grid_filtered, lambda_grid_filtered_prime = compute_dist_grid(
+        z_b, x_b, weight, nz=nz, nx=nx, xlim=xlim, zlim=zlim, grid_method=grid_method,
+        grid_quantile=grid_quantile, grid_sigma=grid_sigma, profiler=profiler)
+    
+    with profiled_call(profiler, 'csr2d_transient_kick', n_particles=len(z_b), cases=''.join(cases)) as record:
+        Ws_grid = np.zeros((nz, nx))
+        Wx_grid = np.zeros((nz, nx))
+        wakes = {}
+        for case in cases:
+            with record.stage('green'):
+                prefetch = prefetched.get(case) if prefetched else None
+                meshes = None
+                if prefetch is not None:
+                    prefetch.check_grid(nz, nx, dz, dx, rho, beta, phi_m=phi_m, igf=igf, igf_order=igf_order)
+                    meshes = prefetch.get(phi if case == 'A' else lamb)
+                if meshes is not None:
+                    Gs, Gx = meshes
+                    zvec2 = np.arange(-nz+1,nz+1,1)*dz
+                    xvec2 = np.arange(-nx+1,nx+1,1)*dx
+                else:
+                    Gs, Gx, zvec2, xvec2 = compute_potential_grids(case, nz=nz, nx=nx, dz=dz, dx=dx, rho=rho, beta=beta,
+                                                                   phi=phi, phi_m=phi_m, lamb=lamb,
+                                                                   igf=igf, igf_order=igf_order, executor=executor)
+            with record.stage('convolution'):
+                conv = boundary_convolve(case, None, zvec=zvec, xvec=xvec, zvec2=zvec2, xvec2=xvec2,
+                                         G_lamb=lambda_grid_filtered, G_lamb_p=lambda_grid_filtered_prime,
+                                         Gs=Gs, Gx=Gx, beta=beta, rho=rho, phi=phi, phi_m=phi_m, lamb=lamb, dx=dx,
+                                         convolution=convolution)
+            if case == 'B':
+                conv_s, Ws_zi, Ws_zo, conv_x, Wx_zi, Wx_zo = conv
+                Ws = (beta**2 / rho) * (conv_s*(dz*dx) + (Ws_zi + Ws_zo)*dx)
+                Wx = (beta**2 / rho) * (conv_x*(dz*dx) + (Wx_zi + Wx_zo)*dx)
+            else:
+                factor = (beta**2 / rho**2) if case == 'D' else (1/gamma**2 / rho**2)
+                Ws = factor * conv[0] * (dz*dx)
+                Wx = factor * conv[1] * (dz*dx)
+            Ws_grid += Ws
+            Wx_grid += Wx
+            wakes[case] = (Ws, Wx)
+        
+        # Overall factor. A planned grid holds only the charge inside of it, to which the density is normalized
+        if grid_method != 'minmax':
+            inside = GridPlan((zvec[0], zvec[-1]), (xvec[0], xvec[-1]), grid_method).inside(z_b, x_b)
+            Nb = np.sum(weight[inside]) / e_charge
+        else:
+            Nb = np.sum(weight) / e_charge
+        kick_factor = r_e * Nb / gamma  # m
+        
+        with record.stage('gather'):
+            delta_kick, xp_kick = gather_2d(z_b, x_b, Ws_grid, Wx_grid, zvec[0], dz, xvec[0], dx,
+                                            order=iorder, scale=kick_factor)
+    
+    result = {"ddelta_ds": delta_kick, "dxp_ds": xp_kick}
+    
+    if debug:
+        result.update(
+            {
+                "cases": cases,
+                "zvec": zvec,
+                "xvec": xvec,
+                "Ws_grid": Ws_grid,
+                "Wx_grid": Wx_grid,
+                "wakes": wakes,
+                "profile": record,
+            }
+        )
+    
+    return result
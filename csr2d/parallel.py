@@ -0,0 +1,198 @@
+"""
+Green function meshes evaluated in z-row blocks by a worker pool.
+
+The mesh functions (such as csr2d.core2.psi_sx_mesh) fill a (len(zvec), len(xvec))
+mesh from its axes, so a mesh can be split into blocks of rows that are evaluated
+independently and written into their rows of the result.
+
+Worker pools are expensive to start, so `get_executor` keeps one pool per kind
+and size for the lifetime of the process.
+
+    - Threads: the mesh kernels are compiled with nogil=True, so blocks run concurrently.
+      This needs the 'tbb' or 'omp' Numba threading layer: the 'workqueue' layer aborts the
+      process when parallel kernels run from several threads at once, so with it
+      thread pools fall back to a single call of the (parallel) kernels, see `threads_unsafe`.
+    - Processes: the workers write their rows into shared memory, so the meshes
+      are not pickled back. The mesh function must be picklable
+      (a module-level function or a functools.partial of one, not a lambda).
+      The pool of `get_executor` starts its workers with 'spawn', so scripts using it
+      need the usual `if __name__ == '__main__':` guard.
+"""
+import atexit
+import concurrent.futures as cf
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+
+import numba
+from numba import njit, prange
+import numpy as np
+
+
+_EXECUTORS = {}
+
+
+@njit(parallel=True)
+def _start_threading_layer(a):
+    for i in prange(a.size):
+        a[i] = i
+
+
+def threads_unsafe(executor):
+    """
+    True if `executor` (an Executor, or the map method of one) runs its tasks in threads
+    of this process and the Numba threading layer is 'workqueue', which is not threadsafe:
+    parallel kernels must then not be called from its threads.
+    """
+    owner = executor if isinstance(executor, cf.Executor) else getattr(executor, '__self__', None)
+    if not isinstance(owner, cf.ThreadPoolExecutor):
+        return False
+    try:
+        layer = numba.threading_layer()
+    except ValueError:
+        # The layer is chosen at the first parallel launch
+        _start_threading_layer(np.empty(1))
+        layer = numba.threading_layer()
+    return layer == 'workqueue'
+
+
+def get_executor(kind='thread', max_workers=None):
+    """
+    Persistent worker pool, created at the first call and reused afterwards.
+
+    Parameters
+    ----------
+    kind : str
+        'thread' or 'process'. Default: 'thread'
+
+    max_workers : int or None
+        Number of workers. Default: None (os.cpu_count())
+
+    Returns
+    -------
+    concurrent.futures.ThreadPoolExecutor or ProcessPoolExecutor
+
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    key = (kind, max_workers)
+    if key not in _EXECUTORS:
+        if kind == 'thread':
+            _EXECUTORS[key] = cf.ThreadPoolExecutor(max_workers=max_workers)
+        elif kind == 'process':
+            # Forked workers can deadlock in the Numba threading layer of the parent
+            _EXECUTORS[key] = cf.ProcessPoolExecutor(max_workers=max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+        else:
+            raise ValueError(f'Unknown executor kind: {kind}')
+    return _EXECUTORS[key]
+
+
+def executor_workers(executor):
+    """
+    Number of workers of a pool from `get_executor`, or os.cpu_count() for any other executor.
+    """
+    for (_, max_workers), pool in _EXECUTORS.items():
+        if pool is executor or getattr(executor, '__self__', None) is pool:
+            return max_workers
+    return os.cpu_count()
+
+
+def shutdown_executors():
+    """
+    Shuts down the pools from `get_executor`.
+    """
+    for executor in _EXECUTORS.values():
+        executor.shutdown()
+    _EXECUTORS.clear()
+
+
+atexit.register(shutdown_executors)
+
+
+def _row_blocks(n_rows, n_blocks):
+    edges = np.linspace(0, n_rows, min(n_blocks, n_rows) + 1).astype(int)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _block(mesh_func, zvec, xvec):
+    return mesh_func(zvec, xvec)
+
+
+def _shared_block(mesh_func, zvec, xvec, row0, names, shape):
+    """
+    Evaluates a row block in a worker process and writes it into the shared meshes.
+    """
+    shms = [shared_memory.SharedMemory(name=name) for name in names]
+    try:
+        for shm, block in zip(shms, mesh_func(zvec, xvec)):
+            np.ndarray(shape, buffer=shm.buf)[row0:row0 + len(zvec)] = block
+    finally:
+        for shm in shms:
+            shm.close()
+
+
+def row_block_meshes(mesh_func, zvec, xvec, executor=None, n_blocks=None, n_meshes=2):
+    """
+    mesh_func(zvec, xvec), evaluated in blocks of z rows by `executor`.
+
+    Parameters
+    ----------
+    mesh_func : callable
+        mesh_func(zsub, xvec) returns a tuple of n_meshes meshes with shape (len(zsub), len(xvec))
+
+    zvec, xvec : np.array (1D)
+        Grid axes
+
+    executor : None, concurrent.futures.Executor or callable
+        None: a single call of mesh_func
+        ThreadPoolExecutor: executor.map over the blocks, or a single call of mesh_func
+        with the 'workqueue' Numba threading layer (see `threads_unsafe`)
+        ProcessPoolExecutor: the workers write into shared memory
+        other Executor: executor.map over the blocks
+        callable: a map function such as map or executor.map (the `map_f` of csr2d_kick_calc)
+
+    n_blocks : int or None
+        Number of row blocks. Default: None (the number of workers of a pool from `get_executor`,
+        otherwise os.cpu_count())
+
+    n_meshes : int
+        Number of meshes returned by mesh_func. Default: 2
+
+    Returns
+    -------
+    meshes : tuple of np.arrays with shape (len(zvec), len(xvec))
+
+    """
+    if executor is None or threads_unsafe(executor):
+        return tuple(mesh_func(zvec, xvec))
+
+    zvec = np.asarray(zvec, dtype=float)
+    xvec = np.asarray(xvec, dtype=float)
+    shape = (len(zvec), len(xvec))
+    if n_blocks is None:
+        n_blocks = executor_workers(executor)
+    blocks = _row_blocks(len(zvec), n_blocks)
+
+    if isinstance(executor, cf.ProcessPoolExecutor):
+        nbytes = max(1, np.prod(shape, dtype=int) * np.dtype(float).itemsize)
+        shms = [shared_memory.SharedMemory(create=True, size=nbytes) for _ in range(n_meshes)]
+        try:
+            names = [shm.name for shm in shms]
+            futures = [executor.submit(_shared_block, mesh_func, zvec[i0:i1], xvec, i0, names, shape)
+                       for i0, i1 in blocks]
+            for future in futures:
+                future.result()
+            return tuple(np.ndarray(shape, buffer=shm.buf).copy() for shm in shms)
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+    map_f = executor.map if isinstance(executor, cf.Executor) else executor
+    out = tuple(np.empty(shape) for _ in range(n_meshes))
+    results = map_f(_block, [mesh_func] * len(blocks), [zvec[i0:i1] for i0, i1 in blocks], [xvec] * len(blocks))
+    for (i0, i1), result in zip(blocks, results):
+        for o, block in zip(out, result):
+            o[i0:i1] = block
+    return out
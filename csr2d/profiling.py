@@ -0,0 +1,262 @@
+"""
+Per-stage timing of the kick calculations.
+
+Each kick calculation is a CallRecord with the perf_counter_ns start and end of its
+stages (deposit, filter, green, convolution, gather). A Profiler collects these records,
+keeps aggregate counters, calls an optional callback per record, and exports Chrome
+trace JSON (open in chrome://tracing or https://ui.perfetto.dev).
+
+Example
+-------
+    profiler = Profiler()
+    engine = CSRKickEngine(gamma=gamma, rho=rho, profiler=profiler)
+    ...
+    print(profiler.summary())
+    profiler.export_chrome_trace('kicks.json')
+"""
+from collections import deque
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from csr2d.green_cache import cache_stats
+
+
+class CallRecord:
+    """
+    Stage timings of a single call.
+
+    Attributes
+    ----------
+    name : str
+        Name of the call, e.g. 'csr2d_kick'
+
+    info : dict
+        Extra information, such as the number of particles
+
+    start_ns, end_ns : int
+        time.perf_counter_ns() at the start and end of the call
+
+    stages : list of (name, start_ns, end_ns)
+
+    cache : dict
+        Changes of the Green mesh cache hit and miss counters during the call
+
+    """
+    def __init__(self, name, **info):
+        self.name = name
+        self.info = info
+        self.stages = []
+        self.cache = {}
+        self.thread_id = threading.get_ident()
+        self.end_ns = None
+        self.start_ns = time.perf_counter_ns()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager timing a stage of the call.
+        """
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.stages.append((name, start, time.perf_counter_ns()))
+
+    def finish(self):
+        self.end_ns = time.perf_counter_ns()
+
+    @property
+    def duration_ns(self):
+        end = time.perf_counter_ns() if self.end_ns is None else self.end_ns
+        return end - self.start_ns
+
+    @property
+    def durations_ns(self):
+        """
+        dict of the total time in each stage [ns]
+        """
+        out = {}
+        for name, start, end in self.stages:
+            out[name] = out.get(name, 0) + end - start
+        return out
+
+    def seconds(self, *names):
+        """
+        Array of the times in the stages `names` [s]
+        """
+        durations = self.durations_ns
+        return np.array([durations.get(name, 0) * 1e-9 for name in names])
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "info": self.info,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ns": self.duration_ns,
+            "stages": self.durations_ns,
+            "cache": self.cache,
+        }
+
+    def __repr__(self):
+        stages = ", ".join(f"{k}={v/1e6:.3f} ms" for k, v in self.durations_ns.items())
+        return f"<CallRecord {self.name} {self.duration_ns/1e6:.3f} ms: {stages}>"
+
+
+def _cache_counters():
+    stats = cache_stats()
+    out = {"memory_hits": stats["memory"]["hits"], "memory_misses": stats["memory"]["misses"]}
+    if stats["disk"] is not None:
+        out["disk_hits"] = stats["disk"]["hits"]
+        out["disk_misses"] = stats["disk"]["misses"]
+    return out
+
+
+class Profiler:
+    """
+    Collects CallRecords, with aggregate counters.
+
+    Parameters
+    ----------
+    callback : callable, optional
+        Called with each finished CallRecord
+
+    max_records : int
+        Number of most recent records kept for percentiles and the trace export.
+        Totals and call counts include all calls. Default: 100000
+
+    """
+    def __init__(self, callback=None, max_records=100000):
+        self.callback = callback
+        self.records = deque(maxlen=max_records)
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the records and counters.
+        """
+        self.records.clear()
+        self.calls = {}
+        self.total_ns = {}
+        self.cache = {}
+        self.origin_ns = time.perf_counter_ns()
+
+    @contextmanager
+    def call(self, name, **info):
+        """
+        Context manager yielding a CallRecord for one call.
+        """
+        record = CallRecord(name, **info)
+        cache_before = _cache_counters()
+        try:
+            yield record
+        finally:
+            record.finish()
+            cache_after = _cache_counters()
+            record.cache = {k: cache_after[k] - cache_before.get(k, 0) for k in cache_after}
+            self.add(record)
+
+    def add(self, record):
+        """
+        Adds a finished CallRecord.
+        """
+        self.records.append(record)
+        self.calls[record.name] = self.calls.get(record.name, 0) + 1
+        totals = self.total_ns.setdefault(record.name, {})
+        totals["total"] = totals.get("total", 0) + record.duration_ns
+        for stage, ns in record.durations_ns.items():
+            totals[stage] = totals.get(stage, 0) + ns
+        for k, v in record.cache.items():
+            self.cache[k] = self.cache.get(k, 0) + v
+        if self.callback is not None:
+            self.callback(record)
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """
+        Aggregates per call name and stage.
+
+        Returns
+        -------
+        dict of {call name: {stage: {calls, total_s, mean_s, p50_s, ...}}}, and
+        'cache' with the summed cache counter changes.
+        For the percentiles, only the kept records are used.
+
+        """
+        out = {}
+        for name, n_calls in self.calls.items():
+            samples = {}
+            for record in self.records:
+                if record.name != name:
+                    continue
+                samples.setdefault("total", []).append(record.duration_ns)
+                for stage, ns in record.durations_ns.items():
+                    samples.setdefault(stage, []).append(ns)
+            stages = {}
+            for stage, total in self.total_ns[name].items():
+                entry = {"calls": n_calls, "total_s": total * 1e-9, "mean_s": total * 1e-9 / n_calls}
+                if stage in samples:
+                    values = np.percentile(np.array(samples[stage]) * 1e-9, percentiles)
+                    for p, v in zip(percentiles, values):
+                        entry[f"p{p}_s"] = float(v)
+                stages[stage] = entry
+            out[name] = stages
+        out["cache"] = dict(self.cache)
+        return out
+
+    def chrome_trace(self):
+        """
+        The kept records as a Chrome trace event dict (complete 'X' events, times in us).
+        """
+        pid = os.getpid()
+        events = []
+        for record in self.records:
+            args = {k: v for k, v in record.info.items() if isinstance(v, (int, float, str, bool))}
+            args.update(record.cache)
+            events.append({
+                "name": record.name, "ph": "X", "pid": pid, "tid": record.thread_id,
+                "ts": (record.start_ns - self.origin_ns) / 1e3,
+                "dur": record.duration_ns / 1e3,
+                "args": args,
+            })
+            for stage, start, end in record.stages:
+                events.append({
+                    "name": stage, "ph": "X", "pid": pid, "tid": record.thread_id,
+                    "ts": (start - self.origin_ns) / 1e3,
+                    "dur": (end - start) / 1e3,
+                })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        """
+        Writes `chrome_trace()` as JSON to `path`.
+        """
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def export_json(self, path):
+        """
+        Writes the kept records and `summary()` as JSON to `path`.
+        """
+        with open(path, "w") as f:
+            json.dump({"summary": self.summary(), "records": [r.to_dict() for r in self.records]}, f)
+
+
+@contextmanager
+def profiled_call(profiler, name, **info):
+    """
+    profiler.call(name, **info), or a stand-alone CallRecord if profiler is None.
+    """
+    if profiler is None:
+        record = CallRecord(name, **info)
+        try:
+            yield record
+        finally:
+            record.finish()
+    else:
+        with profiler.call(name, **info) as record:
+            yield record